@@ -7,11 +7,12 @@ This module provide routines to perform fast toeplitz matrix computations
 """
 from . import matrixalgebra
 import numpy as np
+import numba as nb
 from scipy import sparse, linalg
 # FTT modules
 import pyfftw
 pyfftw.interfaces.cache.enable()
-from pyfftw.interfaces.numpy_fft import fft, ifft
+from pyfftw.interfaces.numpy_fft import fft, ifft, rfft, irfft
 
 
 def toeplitz_multiplication(v, first_row, first_column):
@@ -42,60 +43,162 @@ def toeplitz_multiplication(v, first_row, first_column):
     return np.real(ifft(a_2n_fft*fft(v, 2*n))[0:n])
 
 
-def multiple_toepltiz_inverse(c_mat, lambda_n, a):
+@nb.njit
+def durbin(r, y, z):
     """
+    Durbin's algorithm solving the Yule-Walker equations T_m y = -r[1:m+1],
+    where T_m is the m x m symmetric Toeplitz matrix of first row r[0:m] and
+    r[0] = 1. See Algorithm 4.7.1 of Golub and Van Loan, Matrix Computations.
 
-    Efficiently compute several Toepltiz systems with the same Toepltiz
-    matrix
-
-    T xj = cj
+    Parameters
+    ----------
+    r : ndarray
+        normalized autocovariance, of size m + 1
+    y : ndarray
+        output array of size m, where the solution is written
+    z : ndarray
+        workspace array of size m
 
-    which is in matrix form
+    """
 
-    T x_mat = c_mat
+    m = y.shape[0]
+    y[0] = -r[1]
+    beta = 1.0
+    alpha = -r[1]
+
+    for k in range(1, m):
+        beta = (1.0 - alpha * alpha) * beta
+        s = r[k + 1]
+        for i in range(k):
+            s += r[k - i] * y[i]
+        alpha = - s / beta
+        for i in range(k):
+            z[i] = y[i] + alpha * y[k - 1 - i]
+        for i in range(k):
+            y[i] = z[i]
+        y[k] = alpha
+
+
+class ToeplitzInverse(object):
+    """
+    Operator solving symmetric Toeplitz systems T x = c from the precomputed
+    solution of T z = e_1, following Jain's algorithm [1]. The spectra of the
+    circulant decomposition are computed once at construction, and real FFTs
+    are used since all vectors are real.
 
-    Where T is a n_data x n_data Toeplitz matrix and c_mat is a n_data x n_knots matrix
+    References
+    ----------
+    [1] Jain, Fast Inversion of Banded Toeplitz Matrices by Circular
+    Decompositions, 1978
 
     """
 
-    n = c_mat.shape[0]
-    #zero_vect = np.zeros(n_data)
+    def __init__(self, lambda_n, a):
+        """
+
+        Parameters
+        ----------
+        lambda_n : scalar float
+            constant such that z = (1/lambda_n) * [ 1  a ]^T is solution of
+            T z = e1 where e1 = [1 0 .. 0].
+        a : array_like
+            vector of size n_data-1 such that a = lambda_n * [z1 .. zN-1]
+            where z is the solution of the system T z = e1
+
+        """
+
+        self.lambda_n = lambda_n
+        self.a = a
+        self.n = len(a) + 1
+        # Residual of the precomputation, if available
+        self.residual = None
+        # Workspace of the precomputation, which can be reused
+        self.workspace = None
+        # Cf. Step 2 of Ref. [1]
+        self.ae_2n_fft = rfft(np.concatenate(([1], a)), 2 * self.n)
+        # using hermitian and real property of covariance matrices:
+        self.be_2n_fft = self.ae_2n_fft.conj()
+        # Skew-circulant part
+        self.signs_be_2n_fft = (-1.0)**(np.arange(self.n + 1) + 1) \
+            * self.be_2n_fft
+
+    def solve_many(self, c_mat):
+        """
+        Solve the systems T x_mat = c_mat, for all columns of c_mat at once.
+
+        Parameters
+        ----------
+        c_mat : array_like
+            right-hand sides, size n_data x K
+
+        Returns
+        -------
+        x_mat : numpy array
+            solutions, size n_data x K
+
+        """
+
+        n = self.n
+        ae_2n_fft = self.ae_2n_fft[:, np.newaxis]
+        be_2n_fft = self.be_2n_fft[:, np.newaxis]
+
+        ce_2n_fft = rfft(c_mat, 2 * n, axis=0)
+        u_2n = irfft(ae_2n_fft * ce_2n_fft, 2 * n, axis=0)
+        v_2n = irfft(be_2n_fft * ce_2n_fft, 2 * n, axis=0)
+
+        pe_2n_fft = rfft(v_2n[0:n, :], 2 * n, axis=0)
+        qe_2n_fft = rfft(u_2n[n:, :], 2 * n, axis=0)
+
+        we_2n = irfft(ae_2n_fft * pe_2n_fft
+                      + self.signs_be_2n_fft[:, np.newaxis] * qe_2n_fft,
+                      2 * n, axis=0)
 
+        return we_2n[0:n, :] / self.lambda_n
 
-    # PRECOMPUTATIONS
-    # Cf. Step 2 of Ref. [1]
-    #ae_2n = np.concatenate(([1],a,zero_vect))
-    #ae_2n_fft = fft(ae_2n)
-    ae_2n_fft = fft(np.concatenate(([1],a)),2*n)
-    # using hermitian and real property of covariance matrices:
-    # be_2n_fft = fft(be_2n)
-    be_2n_fft = ae_2n_fft.conj() #np.real(ae_2n_fft) - 1j*np.imag(ae_2n_fft)
+    def solve(self, c):
+        """
+        Solve the system T x = c.
 
-    signs = (-1)**(np.arange(2*n)+1)
+        Parameters
+        ----------
+        c : array_like
+            right-hand side vector, size n_data
 
-    x_mat = np.empty(np.shape(c_mat))
+        Returns
+        -------
+        x : numpy array
+            vector of size n_data, solution of the problem T x = c
 
-    print("shape of c_mat is " + str(c_mat.shape))
+        """
 
-    for j in range(c_mat.shape[1]):
-        #ce_2n = np.zeros(2*n_data)
-        #ce_2n[0:n_data] = c_mat[:,j]
-        #ce_2n = np.concatenate((c_mat[:,j],zero_vect))
-        #ce_2n_fft = fft(ce_2n)
-        ce_2n_fft = fft(c_mat[:,j],2*n)
-        u_2n = ifft( ae_2n_fft*ce_2n_fft )
-        v_2n = ifft( be_2n_fft*ce_2n_fft )
+        return self.solve_many(c[:, np.newaxis])[:, 0]
 
-        #pe_2n_fft = fft( np.concatenate((v_2n[0:n_data],zero_vect)) )
-        #qe_2n_fft = fft( np.concatenate((u_2n[n_data:],zero_vect))  )
-        pe_2n_fft = fft( v_2n[0:n] , 2*n )
-        qe_2n_fft = fft( u_2n[n:] , 2*n  )
 
-        we_2n = ifft( ae_2n_fft*pe_2n_fft + signs*be_2n_fft*qe_2n_fft )
+def multiple_toepltiz_inverse(c_mat, lambda_n, a):
+    """
+
+    Efficiently compute several Toepltiz systems with the same Toepltiz
+    matrix
+
+    T xj = cj
+
+    which is in matrix form
+
+    T x_mat = c_mat
+
+    Where T is a n_data x n_data Toeplitz matrix and c_mat is a n_data x n_knots matrix.
+    All columns are processed at once with FFTs along the first axis.
+    A precomputed ToeplitzInverse instance can be passed instead of lambda_n,
+    in which case a is ignored.
+
+    """
 
-        x_mat[:,j] = np.real(we_2n[0:n]/lambda_n)
+    if isinstance(lambda_n, ToeplitzInverse):
+        t_inv = lambda_n
+    else:
+        t_inv = ToeplitzInverse(lambda_n, a)
 
-    return x_mat
+    return t_inv.solve_many(c_mat)
 
 
 def toepltiz_inverse_jain(c, lambda_n, a):
@@ -137,49 +240,12 @@ def toepltiz_inverse_jain(c, lambda_n, a):
 
     """
 
-    n = len(c)
-
-    # Cf. Step 2 of Ref. [1]
-    # 1)
-    #ae_2n = np.concatenate(([1],a,np.zeros(n_data)))
-
-    # be_2n = np.concatenate(([1],np.zeros(n_data-1),[0],a[::-1]))
-    # ce_2n = np.concatenate((c,np.zeros(n_data)))
-
-    # 2)
-    #ce_2n_fft = fft(ce_2n)
-    #ae_2n_fft = fft(ae_2n)
-    ce_2n_fft = fft(c,2*n)
-    ae_2n_fft = fft(np.concatenate(([1],a)),2*n)
-    # using hermitian and real property of covariance matrices:
-    # be_2n_fft = fft(be_2n)
-    be_2n_fft = ae_2n_fft.conj()
-    #be_2n_fft = np.real(ae_2n_fft) - 1j*np.imag(ae_2n_fft)
-    u_2n = ifft( ae_2n_fft*ce_2n_fft )
-    v_2n = ifft( be_2n_fft*ce_2n_fft )
-
-    # 3)
-    # pe_2n = np.zeros(2*n_data)
-    # qe_2n = np.zeros(2*n_data)
-    # pe_2n[0:n_data] = v_2n[0:n_data]
-    # qe_2n[0:n_data] = u_2n[n_data:]
-
-    # or better:
-    #pe_2n_fft = fft( np.concatenate((v_2n[0:n_data],np.zeros(n_data))) )
-    #qe_2n_fft = fft( np.concatenate((u_2n[n_data:],np.zeros(n_data)))  )
-    # or even better:
-    pe_2n_fft = fft( v_2n[0:n], 2*n )
-    qe_2n_fft = fft( u_2n[n:] , 2*n )
-
-    # 4)
-    signs = (-1)**(np.arange(2*n)+1)
-    we_2n = ifft( ae_2n_fft*pe_2n_fft + signs*be_2n_fft*qe_2n_fft )
-
-    return np.real(we_2n[0:n]/lambda_n)
+    return ToeplitzInverse(lambda_n, a).solve(c)
 
 
 def teopltiz_precompute(r, p=10, nit=1000, tol=1e-4, method='PCG',
-                        precond='taper'):
+                        precond='taper', operator=False, workspace=None,
+                        verbose=False):
     """
     Solve the system T y = e1 where T is symmetric Toepltiz.
     where e1 = [1 0 0 0 0 0].T to compute the vector a and lambda_n for
@@ -200,8 +266,22 @@ def teopltiz_precompute(r, p=10, nit=1000, tol=1e-4, method='PCG',
         maximum number of iterations for PCG
     tol : scalar float
         relative error convergence criterium for the PCG algorithm
+    method : str in {'PCG', 'levinson', 'durbin', 'superfast'}
+        algorithm to use. 'levinson' calls scipy.linalg.solve_toeplitz.
+        'durbin' runs a compiled Levinson-Durbin recursion, which solves
+        the system in O(n^2) operations and O(n) memory. 'superfast' is an
+        alias for 'durbin'. For direct methods, the achieved residual is
+        stored in the residual attribute of the output operator.
     precond : str in {'taper', 'circulant'}
         preconditionner to use
+    operator : bool
+        if True, return a ToeplitzInverse instance instead of (lambda_n, a)
+    workspace : ndarray, optional
+        array of size 2 x (n_data - 1) used by the 'durbin' method, which can
+        be reused from one call to the next. The vector a is written in its
+        first row.
+    verbose : bool
+        if True, print the residual achieved by direct methods
 
     Returns
     -------
@@ -209,6 +289,8 @@ def teopltiz_precompute(r, p=10, nit=1000, tol=1e-4, method='PCG',
         prefactor of the inverse of T
     a : numpy array
         vector of size n_data-1 involved in the computation of the inverse of T
+    t_inv : ToeplitzInverse instance
+        operator computing T^{-1} x (only if operator is True)
 
 
 
@@ -243,10 +325,33 @@ def teopltiz_precompute(r, p=10, nit=1000, tol=1e-4, method='PCG',
         matrixalgebra.print_pcg_status(info)
     elif method == 'levinson':
         z = linalg.solve_toeplitz(r, e1)
+    elif (method == 'durbin') | (method == 'superfast'):
+        if (workspace is None) or (workspace.shape != (2, ndim - 1)):
+            workspace = np.empty((2, ndim - 1))
+        # The solution of T z = e1 is proportional to [1 y] where y solves
+        # the Yule-Walker equations
+        durbin(r / r[0], workspace[0], workspace[1])
+        y = workspace[0]
+        z = np.concatenate(([1], y)) / (r[0] + np.dot(r[1:], y))
+    else:
+        raise ValueError("Unknown Toeplitz solver.")
 
     lambda_n = 1/z[0]
     a = lambda_n * z[1:]
 
+    residual = None
+    if method != 'PCG':
+        residual = np.linalg.norm(toeplitz_multiplication(z, r, r) - e1)
+        if verbose:
+            print("Toeplitz solver residual || T z - e1 || = "
+                  + str(residual))
+
+    if operator:
+        t_inv = ToeplitzInverse(lambda_n, a)
+        t_inv.residual = residual
+        t_inv.workspace = workspace
+        return t_inv
+
     return lambda_n, a
 
 
@@ -270,15 +375,16 @@ def compute_toepltiz_precond(r, p=10, taper='Wendland2'):
 
     Returns
     -------
-    solve : sparse.linalg.factorized instance
-        preconditionner operator, calculating P x for all vectors x
+    solve : callable
+        preconditionner operator, calculating P x for all vectors x, or all
+        columns of a matrix x at once
 
     """
 
     # Preconditionning : use sparse matrix
     T_approx = build_sparse_cov2(r, p, len(r), form="csc", taper = taper)
     # Preconditionner
-    solve = sparse.linalg.factorized(T_approx)
+    solve = sparse.linalg.splu(T_approx).solve
 
     return solve
 
@@ -298,7 +404,8 @@ def toepltiz_mat_vect_prod(y, s_2n):
     Parameters
     ----------
     y : numpy array
-        input data vector of size n_data
+        input data vector of size n_data, or matrix of size n_data x K whose
+        columns are transformed at once
     S_2N : numpy array (size P >= 2N)
         PSD vector
 
@@ -311,7 +418,9 @@ def toepltiz_mat_vect_prod(y, s_2n):
 
     """
 
-    return np.real(ifft(s_2n * fft(y, len(s_2n)))[0:len(y)])
+    s_v = np.reshape(s_2n, (len(s_2n),) + (1,) * (np.ndim(y) - 1))
+
+    return np.real(ifft(s_v * fft(y, len(s_2n), axis=0), axis=0)[0:len(y)])
 
 
 def toepltiz_linear_op(ndim, s_2n):
@@ -342,8 +451,7 @@ def toepltiz_linear_op(ndim, s_2n):
 
     t_func = lambda x: toepltiz_mat_vect_prod(x, s_2n)
     th_func = lambda x: toepltiz_mat_vect_prod(x, s_2n)
-    tmat_func = lambda X: np.array([toepltiz_mat_vect_prod(X[:,j],s_2n) 
-                                    for j in X.shape[1]]).T
+    tmat_func = lambda X: toepltiz_mat_vect_prod(X, s_2n)
 
     t_op = sparse.linalg.LinearOperator(shape=(ndim,ndim),
                                         matvec=t_func,
@@ -465,22 +573,11 @@ def build_sparse_cov2(autocorr, p, n_data, form=None, taper='Wendland2'):
 
 
     """
-    k = np.array([])
-    values = list()
-    tap = taper_covariance(np.arange(0, n_data), p, taper=taper)
-    r_tap = autocorr[0:n_data] * tap
-
-    # calculate the rows and columns indices of the non-zero values
-    # Do it diagonal per diagonal
-    for i in range(p+1):
-        rf = np.ones(n_data - i) * r_tap[i]
-        values.append(rf)
-        k = np.hstack((k, i))
-        # Symmetric values
-        if i != 0:
-            values.append(rf)
-            k = np.hstack((k, -i))
-    # [build_diagonal(values, r_tap, k, i) for i in range(p + 1)]
-
-    return sparse.diags(values, k.astype(int), format=form,
-                        dtype=autocorr.dtype)
\ No newline at end of file
+    tap = taper_covariance(np.arange(0, p + 1), p, taper=taper)
+    r_tap = autocorr[0:p + 1] * tap
+
+    # Offsets of the non-zero diagonals and their constant values
+    k = np.concatenate((np.arange(0, p + 1), - np.arange(1, p + 1)))
+    values = [np.full(n_data - np.abs(ki), r_tap[np.abs(ki)]) for ki in k]
+
+    return sparse.diags(values, k, format=form, dtype=autocorr.dtype)
\ No newline at end of file
@@ -7,14 +7,255 @@ computations.
 """
 import numpy as np
 from numpy import linalg as LA
+from scipy import linalg
 from scipy import sparse
+import threading
 import pyfftw
-from pyfftw.interfaces.numpy_fft import fft, ifft
+from pyfftw.interfaces.numpy_fft import fft, ifft, rfft, irfft
+from scipy.fft import next_fast_len
 from . import fastoeplitz
 pyfftw.interfaces.cache.enable()
 
 
-def mat_vect_prod(y_in, ind_in, ind_out, mask, s_2n):
+class MaskedToeplitzOperator(object):
+    """
+    Linear operator computing products with the blocks of a symmetric Toeplitz
+    covariance matrix C, restricted to subsets of rows and columns:
+
+    Com = M_o C M_m^T
+
+    The products are computed by circulant embedding with real FFTs. Each
+    thread allocates its own aligned buffers and FFTW plans on first use, with
+    a 5-smooth transform length, so that products can be computed
+    concurrently by a pool of threads.
+
+    """
+
+    def __init__(self, autocorr, ind_in, ind_out=None, n_fft=None, threads=1,
+                 planner_effort='FFTW_ESTIMATE'):
+        """
+
+        Parameters
+        ----------
+        autocorr : ndarray
+            autocovariance function, whose size is the size n of the complete
+            data vector
+        ind_in : array_like
+            default chronological indices of the values contained in the input
+            vectors in the complete data vector
+        ind_out : array_like, optional
+            default chronological indices of the values contained in the
+            output vectors in the complete data vector. If None, they are the
+            same as ind_in.
+        n_fft : int, optional
+            size of the FFTs, should be at least 2n - 1. If None, the smallest
+            5-smooth number larger than 2n - 1 is chosen.
+        threads : int
+            number of threads used by FFTW
+        planner_effort : str
+            FFTW planner flag
+
+        """
+
+        self.autocorr = np.asarray(autocorr, dtype=np.float64)
+        self.n = len(self.autocorr)
+        self.ind_in = np.asarray(ind_in)
+        if ind_out is None:
+            self.ind_out = self.ind_in
+        else:
+            self.ind_out = np.asarray(ind_out)
+        if n_fft is None:
+            n_fft = next_fast_len(2 * self.n - 1, real=True)
+        elif n_fft < 2 * self.n - 1:
+            raise ValueError("The FFT size must be at least 2n - 1.")
+        self.n_fft = n_fft
+        self.threads = threads
+        self.planner_effort = planner_effort
+        self.local = threading.local()
+        self.build_plans()
+
+    def plans(self, k=None):
+        """
+        Get the buffers and FFTW plans of the calling thread, building them
+        if necessary.
+
+        Parameters
+        ----------
+        k : int, optional
+            number of columns of the transformed blocks. If None, the plans
+            transform single vectors.
+
+        Returns
+        -------
+        plans : tuple
+            real buffer, complex buffer, forward and backward plans
+
+        """
+
+        blocks = getattr(self.local, 'blocks', None)
+        if blocks is None:
+            blocks = self.local.blocks = {}
+
+        if k not in blocks:
+            if k is None:
+                shape, shape_hat = (self.n_fft, ), (self.n_fft // 2 + 1, )
+            else:
+                shape, shape_hat = (self.n_fft, k), (self.n_fft // 2 + 1, k)
+            x = pyfftw.empty_aligned(shape, dtype='float64')
+            x_hat = pyfftw.empty_aligned(shape_hat, dtype='complex128')
+            rfft = pyfftw.FFTW(x, x_hat, axes=(0,), direction='FFTW_FORWARD',
+                               flags=(self.planner_effort,),
+                               threads=self.threads)
+            irfft = pyfftw.FFTW(x_hat, x, axes=(0,),
+                                direction='FFTW_BACKWARD',
+                                flags=(self.planner_effort,),
+                                threads=self.threads)
+            blocks[k] = (x, x_hat, rfft, irfft)
+
+        return blocks[k]
+
+    def build_plans(self):
+        """
+        Compute the spectrum of the circulant embedding of the covariance.
+        """
+
+        x, x_hat, rfft, irfft = self.plans()
+        # First column of the circulant embedding
+        x[:] = 0
+        x[0:self.n] = self.autocorr
+        x[self.n_fft - self.n + 1:] = self.autocorr[1:][::-1]
+        rfft()
+        self.spectrum = np.real(x_hat).copy()
+
+    def __getstate__(self):
+        # FFTW plans and thread-local storage cannot be pickled: they are
+        # rebuilt on loading
+        state = self.__dict__.copy()
+        for key in ['local', 'spectrum']:
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.local = threading.local()
+        self.build_plans()
+
+    @classmethod
+    def from_spectrum(cls, s_2n, ind_in, ind_out=None, n_data=None,
+                      onesided=False, **kwargs):
+        """
+        Build the operator from the DFT covariances.
+
+        Parameters
+        ----------
+        s_2n : numpy array (size P >= 2N)
+            Vector of DFT covariances. Should be be S(f) * fs / 2, where
+            S(f) is the one-sided PSD.
+        ind_in : array_like
+            chronological indices of the input values
+        ind_out : array_like, optional
+            chronological indices of the output values
+        n_data : int, optional
+            size N of the complete data vector. Default is P / 2.
+        onesided : bool
+            if True, s_2n only contains the DFT covariances at non-negative
+            frequencies (size P / 2 + 1).
+
+        Returns
+        -------
+        op : MaskedToeplitzOperator instance
+            the covariance operator
+
+        """
+
+        if onesided:
+            n_fft = 2 * (len(s_2n) - 1)
+            autocorr = irfft(s_2n, n_fft)
+        else:
+            n_fft = len(s_2n)
+            autocorr = np.real(ifft(s_2n))
+        if n_data is None:
+            n_data = n_fft // 2
+        autocorr = autocorr[0:n_data]
+
+        return cls(autocorr, ind_in, ind_out=ind_out, **kwargs)
+
+    def dot(self, v, ind_in=None, ind_out=None):
+        """
+        Compute the product y_out = Com y_in
+
+        Parameters
+        ----------
+        v : ndarray
+            input vector
+        ind_in : array_like, optional
+            chronological indices of the input values. Default is the ones
+            provided at construction.
+        ind_out : array_like, optional
+            chronological indices of the output values. Default is the ones
+            provided at construction.
+
+        Returns
+        -------
+        y_out : ndarray
+            output vector
+
+        """
+
+        if ind_in is None:
+            ind_in = self.ind_in
+        if ind_out is None:
+            ind_out = self.ind_out
+
+        x, x_hat, rfft, irfft = self.plans()
+        x[:] = 0
+        x[ind_in] = v
+        rfft()
+        x_hat *= self.spectrum
+        irfft()
+        y_out = x[ind_out]
+
+        return y_out
+
+    def rdot(self, v):
+        """
+        Compute the product with the transposed operator, Cmo y_in
+        """
+
+        return self.dot(v, ind_in=self.ind_out, ind_out=self.ind_in)
+
+    def matmat(self, a_in, ind_in=None, ind_out=None):
+        """
+        Compute the product A_out = Com A_in for a matrix A_in of size
+        N_in x K. All columns are transformed at once.
+        """
+
+        if ind_in is None:
+            ind_in = self.ind_in
+        if ind_out is None:
+            ind_out = self.ind_out
+
+        x, x_hat, rfft, irfft = self.plans(a_in.shape[1])
+        x[:] = 0
+        x[ind_in, :] = a_in
+        rfft()
+        x_hat *= self.spectrum[:, np.newaxis]
+        irfft()
+        a_out = x[ind_out, :]
+
+        return a_out
+
+    def linear_operator(self):
+        """
+        Get the scipy.sparse.linalg.LinearOperator equivalent of the operator
+        """
+
+        return sparse.linalg.LinearOperator(
+            shape=(len(self.ind_out), len(self.ind_in)), matvec=self.dot,
+            rmatvec=self.rdot, matmat=self.matmat, dtype=np.float64)
+
+
+def mat_vect_prod(y_in, ind_in, ind_out, mask, s_2n, onesided=False):
     """
     Linear operator that calculate Com y_in assuming that we can write:
 
@@ -37,6 +278,9 @@ def mat_vect_prod(y_in, ind_in, ind_out, mask, s_2n):
     s_2n : numpy array (size P >= 2N)
         Vector of DFT covariances. Should be be S(f) * fs / 2, where
         S(f) is the one-sided PSD.
+    onesided : bool
+        if True, s_2n only contains the DFT covariances at non-negative
+        frequencies (size P / 2 + 1, with P even), and real FFTs are used.
 
 
     Returns
@@ -51,12 +295,16 @@ def mat_vect_prod(y_in, ind_in, ind_out, mask, s_2n):
     y = np.zeros(len(mask))  # + 1j*np.zeros(N)
     y[ind_in] = y_in
 
+    if onesided:
+        n_fft = 2 * (len(s_2n) - 1)
+        return irfft(s_2n * rfft(y, n_fft), n_fft)[ind_out]
+
     n_fft = len(s_2n)
 
     return np.real(ifft(s_2n * fft(y, n_fft))[ind_out])
 
 
-def matmat_prod(a_in, ind_in, ind_out, mask, s_2n):
+def matmat_prod(a_in, ind_in, ind_out, mask, s_2n, onesided=False):
     """
     Linear operator that calculates Coi * a_in assuming that we can write:
 
@@ -79,6 +327,9 @@ def matmat_prod(a_in, ind_in, ind_out, mask, s_2n):
     s_2n : numpy array (size P >= 2N)
         Vector of DFT covariances. Should be be S(f) * fs / 2, where
         S(f) is the one-sided PSD.
+    onesided : bool
+        if True, s_2n only contains the DFT covariances at non-negative
+        frequencies (size P / 2 + 1, with P even), and real FFTs are used.
 
 
     Returns
@@ -88,19 +339,25 @@ def matmat_prod(a_in, ind_in, ind_out, mask, s_2n):
 
     """
     N_in = len(ind_in)
-    N_out = len(ind_out)
 
     (N_in_A,K) = np.shape(a_in)
 
     if N_in_A != N_in :
         raise TypeError("Matrix dimensions do not match")
 
-    A_out = np.empty((N_out,K),dtype = np.float64)
+    # All columns are transformed at once along the time axis
+    y = np.zeros((len(mask), K))
+    y[ind_in, :] = a_in
+
+    if onesided:
+        n_fft = 2 * (len(s_2n) - 1)
+        return irfft(s_2n[:, np.newaxis] * rfft(y, n_fft, axis=0), n_fft,
+                     axis=0)[ind_out, :]
 
-    for j in range(K):
-        A_out[:,j] = mat_vect_prod(a_in[:,j],ind_in,ind_out,mask,s_2n)
+    n_fft = len(s_2n)
 
-    return A_out
+    return np.real(ifft(s_2n[:, np.newaxis] * fft(y, n_fft, axis=0),
+                        axis=0)[ind_out, :])
 
 
 def precond_bicgstab(x0, b, a_func, n_it, stp, P, z0_hat=None, verbose=True):
@@ -226,6 +483,101 @@ def precond_bicgstab(x0, b, a_func, n_it, stp, P, z0_hat=None, verbose=True):
     return x, sr, info  # ,sz
 
 
+def precond_cg(x0, b, a_func, n_it, stp, P, verbose=True):
+    """
+    Function solving the linear system A X = B for a symmetric positive
+    definite matrix A, with the preconditioned conjugate gradient algorithm.
+    If several right-hand sides are provided, they are solved simultaneously
+    with the breakdown-free block conjugate gradient algorithm [1], so that
+    each iteration applies A and P to a block of vectors at once.
+
+    References
+    ----------
+    [1] H. Ji and Y. Li, A breakdown-free block conjugate gradient method,
+    BIT Numerical Mathematics 57, 379–403 (2017)
+
+    Parameters
+    ----------
+    x0 : numpy array of size No or No x K
+        initial guess for the solution (can be zeros(No) array)
+    b : numpy array of size No or No x K
+        observed vector(s) (right hand side of the system)
+    a_func: linear operator
+        linear function calculating A*X for any matrix X of size No x K
+    n_it : scalar integer
+        number of maximal iterations
+    stp : scalar float
+        stopping criterion on the residual norm of each right-hand side,
+        relative to its norm
+    P : linear operator
+        preconditionner operator, calculating PX for any matrix X of size
+        No x K
+
+    Returns
+    -------
+    x : numpy array of size No or No x K
+        the solution
+    sr : numpy array
+        maximum relative residual norm at each iteration
+    info : int
+        0 if the algorithm converged, 1 otherwise
+
+    """
+
+    b_mat = np.reshape(b, (b.shape[0], -1))
+    x = np.array(np.reshape(x0, b_mat.shape), dtype=np.float64)
+    b_norm = LA.norm(b_mat, axis=0)
+    b_norm[b_norm == 0] = 1.0
+    sr = np.zeros(n_it + 1)
+
+    r = b_mat - a_func(x)
+    sr[0] = np.max(LA.norm(r, axis=0) / b_norm)
+    k = 0
+
+    if sr[0] > stp:
+        # Orthonormal basis of preconditioned residuals: search directions
+        p = linalg.orth(P(r))
+
+    while (k < n_it) & (sr[k] > stp):
+
+        q = a_func(p)
+        ptq = np.dot(p.T, q)
+        alpha = linalg.solve(ptq, np.dot(p.T, r), assume_a='pos')
+        x += np.dot(p, alpha)
+        r -= np.dot(q, alpha)
+
+        k = k + 1
+        sr[k] = np.max(LA.norm(r, axis=0) / b_norm)
+
+        if sr[k] > stp:
+            z = P(r)
+            beta = - linalg.solve(ptq, np.dot(q.T, z), assume_a='pos')
+            # Orthonormalization removes linearly dependent directions
+            p = linalg.orth(z + np.dot(p, beta))
+            if p.shape[1] == 0:
+                break
+
+        if verbose:
+            if k % 20 == 0:
+                print('PCG Iteration ' + str(k) + ' completed')
+                print('Relative residuals = ' + str(sr[k])
+                      + ' compared to criterion = ' + str(stp))
+
+    if verbose:
+        print("Preconditioned CG algorithm ended with:")
+        print(str(k) + " iterations.")
+    info = 0
+
+    if sr[k] > stp:
+        print("Attention: Preconditioned CG algorithm ended \
+        without reaching the specified convergence criterium. Check quality of \
+        reconstruction.")
+        print("Current criterium: " + str(sr[k]) + " > " + str(stp))
+        info = 1
+
+    return np.reshape(x, b.shape), sr[0:k+1], info
+
+
 def print_pcg_status(info):
     """
     Function that takes the status result of the scipy.sparse.linalg.bicgstab
@@ -241,15 +593,29 @@ def print_pcg_status(info):
         
 
 def precond_linear_op(solver, N_out, N_in):
+    """
+    Construct the linear operator of a preconditionner.
+
+    Parameters
+    ----------
+    solver : callable
+        function computing the approximation of A^{-1} X, where X is either a
+        vector or a matrix whose columns are processed at once.
+    N_out : int
+        size of the output vectors
+    N_in : int
+        size of the input vectors
+
+    Returns
+    -------
+    p_op : scipy.sparse.linalg.LinearOperator instance
+        preconditionner operator
+
+    """
 
     P_func = lambda x: solver(x)
     PH_func = lambda x: solver(x)
-
-    def Pmat_func(X):
-        # Z = np.empty((N_out,X.shape[1]),dtype = np.float64)
-        # for j in range(X.shape[1]):
-        #     Z[:,j] = solver(X[:,j])
-        return np.array([solver(X[:, j]) for j in range(X.shape[1])]).T
+    Pmat_func = lambda X: solver(X)
 
     p_op = sparse.linalg.LinearOperator(shape=(N_out, N_in), matvec=P_func,
                                         rmatvec=PH_func, matmat=Pmat_func,
@@ -293,20 +659,14 @@ def cov_linear_op(ind_in, ind_out, mask, s_2n):
 
     """
 
-    C_func = lambda x: mat_vect_prod(x, ind_in, ind_out, mask, s_2n)
-    CH_func = lambda x: mat_vect_prod(x, ind_out, ind_in, mask, s_2n)
-    Cmat_func = lambda X: matmat_prod(X, ind_in, ind_out, mask, s_2n)
+    op = MaskedToeplitzOperator.from_spectrum(s_2n, ind_in, ind_out=ind_out,
+                                              n_data=len(mask))
 
-    N_in = len(ind_in)
-    N_out = len(ind_out)
-    Coi_op = sparse.linalg.LinearOperator(shape=(N_out, N_in), matvec=C_func,
-                                          rmatvec=CH_func, matmat=Cmat_func,
-                                          dtype=np.float64)
-
-    return Coi_op
+    return op.linear_operator()
 
 
-def pcg_solve(ind_obs, mask, s_2n, b, x0, tol, maxiter, p_solver, pcg_algo):
+def pcg_solve(ind_obs, mask, s_2n, b, x0, tol, maxiter, p_solver, pcg_algo,
+              coo_op=None, verbose=False):
     """
     Function that solves the problem Ax = b by calling iterative algorithms,
     using user-specified methods.
@@ -333,10 +693,18 @@ def pcg_solve(ind_obs, mask, s_2n, b, x0, tol, maxiter, p_solver, pcg_algo):
     p_solver : sparse.linalg.factorized instance
         preconditionner matrix: linear operator which calculates an
         approximation of the solution: u_approx = C_OO^{-1} b for any vector b
-    pcg_algo : string {'mine','scipy','scipy.bicgstab','scipy.bicg','scipy.cg',
-        'scipy.cgs'}
+    pcg_algo : string {'cg', 'mine','scipy','scipy.bicgstab','scipy.bicg',
+        'scipy.cg', 'scipy.cgs'}
         Type of preconditioned conjugate gradient (PCG) algorithm to use.
-
+        'cg' is the preconditioned conjugate gradient, which exploits the
+        symmetry of A. If b has several columns, they are solved together by
+        block conjugate gradient. Other algorithms solve them one by one.
+    coo_op : MaskedToeplitzOperator instance, optional
+        precomputed operator calculating C_OO x. If None, it is built from
+        s_2n.
+    verbose : bool
+        if True, print the number of iterations and the residual at exit.
+        Non-convergence is always reported.
 
     Returns
     -------
@@ -347,39 +715,62 @@ def pcg_solve(ind_obs, mask, s_2n, b, x0, tol, maxiter, p_solver, pcg_algo):
 
     n_o = len(ind_obs)
 
-    if pcg_algo == 'mine':
+    if coo_op is None:
+        coo_op = MaskedToeplitzOperator.from_spectrum(s_2n, ind_obs,
+                                                      n_data=len(mask))
+
+    if (np.ndim(b) == 2) & (pcg_algo != 'cg'):
+        results = [pcg_solve(ind_obs, mask, s_2n, b[:, j], x0[:, j], tol,
+                             maxiter, p_solver, pcg_algo, coo_op=coo_op,
+                             verbose=verbose)
+                   for j in range(b.shape[1])]
+        u = np.array([res[0] for res in results]).T
+        info = np.max([res[1] for res in results])
+
+    elif pcg_algo == 'cg':
+        p_op = precond_linear_op(p_solver, n_o, n_o)
+        u, sr, info = precond_cg(x0, b, coo_op.matmat, maxiter, tol,
+                                 p_op.matmat, verbose=verbose)
+        if verbose:
+            print("Value of max || A * x - b ||/||b|| at exit:")
+            print(str(sr[-1]))
 
-        def coo_func(x):
-            return mat_vect_prod(x, ind_obs, ind_obs, mask, s_2n)
+    elif pcg_algo == 'mine':
 
-        u, sr, info = precond_bicgstab(x0, b, coo_func, maxiter, tol, p_solver)
+        u, sr, info = precond_bicgstab(x0, b, coo_op.dot, maxiter, tol,
+                                       p_solver)
 
     elif 'scipy' in pcg_algo:
-        coo_op = cov_linear_op(ind_obs, ind_obs, mask, s_2n)
+        coo_op = coo_op.linear_operator()
         p_op = precond_linear_op(p_solver, n_o, n_o)
         tol_eff = np.min([tol, tol * LA.norm(b)])
         if (pcg_algo == 'scipy') | (pcg_algo == 'scipy.bicgstab'):
             u, info = sparse.linalg.bicgstab(coo_op, b, x0=x0, tol=tol_eff,
                                              maxiter=maxiter, M=p_op,
                                              callback=None)
-            print_pcg_status(info)
+            if verbose | (info != 0):
+                print_pcg_status(info)
         elif (pcg_algo == 'scipy.bicg'):
             u, info = sparse.linalg.bicg(coo_op, b, x0=x0, tol=tol_eff,
                                          maxiter=maxiter, M=p_op,
                                          callback=None)
-            print_pcg_status(info)
+            if verbose | (info != 0):
+                print_pcg_status(info)
         elif (pcg_algo == 'scipy.cg'):
             u, info = sparse.linalg.cg(coo_op, b, x0=x0, tol=tol_eff,
                                        maxiter=maxiter, M=p_op, callback=None)
-            print_pcg_status(info)
+            if verbose | (info != 0):
+                print_pcg_status(info)
         elif (pcg_algo == 'scipy.cgs'):
             u, info = sparse.linalg.cgs(coo_op, b, x0=x0, tol=tol_eff,
                                         maxiter=maxiter, M=p_op, callback=None)
-            print_pcg_status(info)
+            if verbose | (info != 0):
+                print_pcg_status(info)
         else:
             raise ValueError("Unknown PCG algorithm name")
-        print("Value of || A * x - b ||/||b|| at exit:")
-        print(str(LA.norm(coo_op.dot(u)-b)/LA.norm(b)))
+        if verbose:
+            print("Value of || A * x - b ||/||b|| at exit:")
+            print(str(LA.norm(coo_op.dot(u)-b)/LA.norm(b)))
 
     else:
         raise ValueError("Unknown PCG algorithm name")
@@ -387,6 +778,259 @@ def pcg_solve(ind_obs, mask, s_2n, b, x0, tol, maxiter, p_solver, pcg_algo):
     return u, info
 
 
+class SolutionRecycler(object):
+    """
+    Class storing the solutions of previous linear systems A x = b to build
+    the initial guess of the next one, when the operator A and the right-hand
+    side b vary slowly from one solve to the next.
+
+    The initial guess is the Galerkin projection of the solution on the space
+    spanned by the last n_recycle solutions, x0 = U (U^T A U)^{-1} U^T b,
+    which minimizes the A-norm of the error on that space. With n_recycle = 1,
+    this is a rescaled warm start.
+
+    """
+
+    def __init__(self, n_recycle=1):
+        """
+
+        Parameters
+        ----------
+        n_recycle : int
+            maximum number of previous solutions to keep
+
+        """
+
+        self.n_recycle = n_recycle
+        # Previous solutions, size n x k
+        self.u = None
+        # Their images by the operator A, size n x k
+        self.au = None
+        # Identifier of the operator A that was used to compute au
+        self.key = None
+
+    def initial_guess(self, b, a_mat, key=None):
+        """
+        Compute the initial guess for the system A x = b
+
+        Parameters
+        ----------
+        b : ndarray
+            right-hand side, size n or n x K
+        a_mat : callable
+            function computing A U for any matrix U of size n x k
+        key : hashable
+            identifier of the operator A. If it differs from the one of the
+            stored solutions, their images are recomputed.
+
+        Returns
+        -------
+        x0 : ndarray
+            initial guess, same size as b
+
+        """
+
+        if self.u is None:
+            return np.zeros(b.shape)
+        if key != self.key:
+            self.au = a_mat(self.u)
+            self.key = key
+        # Galerkin projection on the space of previous solutions
+        g_mat = np.dot(self.u.T, self.au)
+        coeffs = LA.lstsq(0.5 * (g_mat + g_mat.T), np.dot(self.u.T, b),
+                          rcond=None)[0]
+
+        return np.dot(self.u, coeffs)
+
+    def update(self, x, a_mat, key=None):
+        """
+        Store the solution(s) of a system A x = b, together with their images
+        A x. These are computed explicitly rather than approximated by b, which
+        would only hold if the solver converged.
+
+        Parameters
+        ----------
+        x : ndarray
+            solution, size n or n x K
+        a_mat : callable
+            function computing A U for any matrix U of size n x k
+        key : hashable
+            identifier of the operator A
+
+        """
+
+        x_mat = np.reshape(x, (x.shape[0], -1))
+        x_norm = LA.norm(x_mat, axis=0)
+        nonzero = x_norm > 0
+        if not np.any(nonzero):
+            return
+        if (self.u is None) | (key != self.key):
+            self.u = np.empty((x_mat.shape[0], 0))
+            self.au = np.empty((x_mat.shape[0], 0))
+            self.key = key
+        u_new = x_mat[:, nonzero] / x_norm[nonzero]
+        self.u = np.hstack([u_new, self.u])[:, 0:self.n_recycle]
+        self.au = np.hstack([a_mat(u_new), self.au])[:, 0:self.n_recycle]
+
+
+class BandedCholeskyPreconditioner(object):
+    """
+    Preconditionner approximating C_OO^{-1}, where C_OO is the covariance of
+    observed data, by the inverse of its tapered version. Since observed
+    indices are increasing, the tapered covariance of observed data is a band
+    matrix with p sub-diagonals. It is directly built in LAPACK lower band
+    storage and factorized with a banded Cholesky decomposition.
+
+    """
+
+    def __init__(self, autocorr, mask, p=10, taper='Wendland2', pattern=None):
+        """
+
+        Parameters
+        ----------
+        autocorr : numpy array
+            input autocovariance functions at each lag (size >= p + 1)
+        mask : numpy array
+            mask vector
+        p : scalar integer
+            number of lags to calculate the tapered approximation of the
+            autocoariance function.
+        taper : string {'Wendland1','Wendland2','Spherical'}
+            Name of the taper function.
+        pattern : tuple or None
+            band pattern (in_band, lags) of another preconditioner built with
+            the same mask and order p, as returned by band_pattern. If None,
+            it is computed.
+
+        """
+
+        self.p = p
+        self.taper = taper
+        self.ind_obs = np.where(mask != 0)[0]
+        if pattern is None:
+            pattern = self.band_pattern(self.ind_obs, p)
+        self.in_band, self.lags = pattern
+        self.tap = fastoeplitz.taper_covariance(np.arange(0, p + 1), p,
+                                                taper=taper)
+        self.r_tap = None
+        self.cho_band = None
+        self.factorize(autocorr)
+
+    @staticmethod
+    def band_pattern(ind_obs, p):
+        """
+        Compute the time lags corresponding to each element of the band
+        storage of the observed covariance. It only depends on the mask and on
+        p, so that it can be shared by all autocovariances.
+
+        Parameters
+        ----------
+        ind_obs : numpy array
+            indices of observed data
+        p : scalar integer
+            number of lags of the tapered autocovariance
+
+        Returns
+        -------
+        in_band : numpy array
+            boolean array of size (p + 1) x n_o, True for elements whose lag is
+            lower than p
+        lags : numpy array
+            integer array of size (p + 1) x n_o, lags of each element (zero
+            outside the band)
+
+        """
+
+        n_o = len(ind_obs)
+        # Row indices of each band element (diagonal k, column j) is j + k
+        rows = np.arange(n_o)[np.newaxis, :] + np.arange(p + 1)[:, np.newaxis]
+        valid = rows < n_o
+        # Time lags between observed points, for all band elements
+        lags = ind_obs[np.minimum(rows, n_o - 1)] - ind_obs[np.newaxis, :]
+        in_band = valid & (lags <= p)
+
+        return in_band, np.where(in_band, lags, 0)
+
+    @property
+    def pattern(self):
+        return self.in_band, self.lags
+
+    def matches(self, mask, p, taper):
+        """
+        Check whether the preconditioner structure corresponds to a given mask,
+        order and taper function.
+        """
+
+        return (p == self.p) & (taper == self.taper) & np.array_equal(
+            np.where(mask != 0)[0], self.ind_obs)
+
+    def factorize(self, autocorr):
+        """
+        Build the band storage of the tapered covariance of observed data and
+        compute its Cholesky factorization.
+
+        Parameters
+        ----------
+        autocorr : numpy array
+            input autocovariance functions at each lag (size >= p + 1)
+
+        """
+
+        self.r_tap = autocorr[0:self.p + 1] * self.tap
+        ab = np.where(self.in_band, self.r_tap[self.lags], 0.0)
+        self.cho_band = linalg.cholesky_banded(ab, lower=True)
+
+    def update(self, autocorr, tol=0.0):
+        """
+        Update the numerical factorization for a new autocovariance, keeping
+        the band structure. The factorization is skipped if the relative
+        change of the tapered autocovariance is lower than tol.
+
+        Parameters
+        ----------
+        autocorr : numpy array
+            new autocovariance functions at each lag (size >= p + 1)
+        tol : float
+            tolerance on the relative change of the tapered autocovariance
+
+        Returns
+        -------
+        refactorized : bool
+            True if the factorization was updated
+
+        """
+
+        r_tap = autocorr[0:self.p + 1] * self.tap
+        change = LA.norm(r_tap - self.r_tap) / LA.norm(self.r_tap)
+        if change <= tol:
+            return False
+        self.factorize(autocorr)
+
+        return True
+
+    def solve(self, b):
+        """
+        Compute the approximation of C_OO^{-1} b.
+
+        Parameters
+        ----------
+        b : numpy array
+            vector of size n_o, or matrix of size n_o x K whose columns are
+            processed at once
+
+        Returns
+        -------
+        x : numpy array
+            preconditioned vector or matrix
+
+        """
+
+        return linalg.cho_solve_banded((self.cho_band, True), b)
+
+    def __call__(self, b):
+        return self.solve(b)
+
+
 def compute_precond(autocorr, mask, p=10, ptype='sparse', taper='Wendland2'):
     """
     For a given mask and a given PSD function, this function approximately 
@@ -407,19 +1051,22 @@ def compute_precond(autocorr, mask, p=10, ptype='sparse', taper='Wendland2'):
         number of lags to calculate the tapered approximation of the
         autocoariance function. This is needed to pre-conditionate the
         conjugate gradients.
-    ptype : string {'sparse','circulant'}
+    ptype : string {'sparse', 'banded', 'circulant'}
         specifies the type of preconditioner matrix (sparse approximation of
-        the covariance or circulant approximation of the covariance)
+        the covariance factorized with sparse LU, sparse approximation of the
+        covariance factorized with banded Cholesky, or circulant
+        approximation of the covariance)
     taper : string {'Wendland1','Wendland2','Spherical'}
         Name of the taper function. This argument is only used if
-        ptype='sparse'
+        ptype='sparse' or 'banded'
     square : bool
         whether to build a square matrix. if False, then
 
     Returns
     -------
-    solve : sparse.linalg.factorized instance
-        preconditionner operator, calculating n_fft x for all vectors x
+    solve : callable
+        preconditionner operator, calculating n_fft x for all vectors x, or
+        all columns of a matrix x at once
 
     """
 
@@ -435,8 +1082,13 @@ def compute_precond(autocorr, mask, p=10, ptype='sparse', taper='Wendland2'):
                                           form="csc", taper=taper)
         # Calculate the covariance matrix of the observed data
         C_temp = C[:, ind_obs]
-        # Preconditionner
-        solve = sparse.linalg.factorized(C_temp[ind_obs, :])
+        # Preconditionner: the LU factorization can solve several right-hand
+        # sides at once
+        solve = sparse.linalg.splu(C_temp[ind_obs, :]).solve
+
+    elif ptype == 'banded':
+
+        solve = BandedCholeskyPreconditioner(autocorr, mask, p=p, taper=taper)
 
     elif ptype == 'circulant':
 
@@ -444,11 +1096,215 @@ def compute_precond(autocorr, mask, p=10, ptype='sparse', taper='Wendland2'):
         n_fft = len(s_2n)
 
         def solve(v):
-            return np.real(ifft(fft(v, n_fft)/s_2n, len(v)))
+            s_v = np.reshape(s_2n, (n_fft,) + (1,) * (np.ndim(v) - 1))
+            return np.real(ifft(fft(v, n_fft, axis=0) / s_v, len(v), axis=0))
 
     return solve
 
 
+def cov_sqrt(cov):
+    """
+    Compute a square root of a covariance matrix, i.e. a matrix L such that
+    L L^T = cov. The Cholesky factor is used whenever possible. If the matrix
+    is not numerically positive definite, the square root is computed from
+    its eigendecomposition, where negative eigenvalues are set to zero.
+
+    Parameters
+    ----------
+    cov : ndarray
+        symmetric covariance matrix, size n x n
+
+    Returns
+    -------
+    l_mat : ndarray
+        square root of the covariance, size n x n
+
+    """
+
+    try:
+        l_mat = LA.cholesky(cov)
+    except LA.LinAlgError:
+        w, v = LA.eigh(cov)
+        l_mat = v * np.sqrt(np.maximum(w, 0))
+
+    return l_mat
+
+
+def cholesky_batch(normal):
+    """
+    Cholesky factorization of a stack of Hermitian matrices. The whole stack
+    is factorized at once by LAPACK. If some matrices are not numerically
+    positive definite, the factorization is computed column by column,
+    vectorized over the stack, to identify them.
+
+    Parameters
+    ----------
+    normal : ndarray
+        stack of Hermitian matrices, size n x p x p
+
+    Returns
+    -------
+    l_mat : ndarray
+        lower-triangular Cholesky factors, size n x p x p (only meaningful
+        where success is True)
+    success : ndarray
+        boolean array of size n, False for the matrices which could not be
+        factorized
+
+    """
+
+    try:
+        return LA.cholesky(normal), np.ones(normal.shape[0], dtype=bool)
+    except LA.LinAlgError:
+        pass
+
+    p = normal.shape[-1]
+    l_mat = np.zeros(normal.shape, dtype=normal.dtype)
+    success = np.ones(normal.shape[0], dtype=bool)
+    for j in range(p):
+        l_j = l_mat[:, j, 0:j]
+        pivot = np.real(normal[:, j, j]) - np.sum(np.abs(l_j) ** 2, axis=1)
+        success &= pivot > 0
+        # Failed factorizations are continued with a unit pivot
+        l_mat[:, j, j] = np.sqrt(np.where(success, pivot, 1.0))
+        l_mat[:, j + 1:, j] = (normal[:, j + 1:, j] - np.sum(
+            l_mat[:, j + 1:, 0:j] * np.conj(l_j[:, np.newaxis, :]),
+            axis=2)) / l_mat[:, j, j][:, np.newaxis]
+
+    return l_mat, success
+
+
+def cho_solve_batch(l_mat, b_vect):
+    """
+    Solve a stack of linear systems L L^H x = b by forward and backward
+    substitutions, vectorized over the stack.
+
+    Parameters
+    ----------
+    l_mat : ndarray
+        lower-triangular Cholesky factors, size n x p x p
+    b_vect : ndarray
+        right-hand sides, size n x p
+
+    Returns
+    -------
+    x : ndarray
+        solutions, size n x p
+
+    """
+
+    p = l_mat.shape[-1]
+    y = np.zeros(b_vect.shape, dtype=np.result_type(l_mat, b_vect))
+    x = np.zeros(b_vect.shape, dtype=y.dtype)
+    # Solve L y = b
+    for j in range(p):
+        y[:, j] = (b_vect[:, j] - np.sum(l_mat[:, j, 0:j] * y[:, 0:j],
+                                         axis=1)) / l_mat[:, j, j]
+    # Solve L^H x = y
+    for j in range(p - 1, -1, -1):
+        x[:, j] = (y[:, j] - np.sum(np.conj(l_mat[:, j + 1:, j])
+                                    * x[:, j + 1:], axis=1)) \
+            / np.conj(l_mat[:, j, j])
+
+    return x
+
+
+def solve_normal_batch(normal, b_vect, rcond=1e-12):
+    """
+    Solve a stack of Hermitian positive semi-definite linear systems. All
+    systems are first factorized by Cholesky decomposition. The ones which
+    cannot be factorized, or whose factor has a small ratio of diagonal
+    elements, are solved with the pseudo-inverse.
+
+    Parameters
+    ----------
+    normal : ndarray
+        stack of normal matrices, size ... x p x p
+    b_vect : ndarray
+        stack of right-hand sides, size ... x p
+    rcond : float
+        systems whose Cholesky pivots (squared diagonal elements of the
+        factor) have a smallest to largest ratio below rcond are considered
+        ill-conditioned
+
+    Returns
+    -------
+    amps : ndarray
+        solutions, size ... x p
+
+    """
+
+    p = normal.shape[-1]
+    shape = np.broadcast(normal[..., 0], b_vect).shape[:-1]
+    normal = np.broadcast_to(normal, shape + (p, p)).reshape((-1, p, p))
+    b_vect = np.broadcast_to(b_vect, shape + (p,)).reshape((-1, p))
+    l_mat, ill = cholesky_batch(normal)
+    pivots = np.abs(np.diagonal(l_mat, axis1=1, axis2=2)) ** 2
+    ill = ~ill | (np.min(pivots, axis=1) <= rcond * np.max(pivots, axis=1))
+
+    if np.all(~ill):
+        amps = cho_solve_batch(l_mat, b_vect)
+    else:
+        amps = np.zeros(b_vect.shape, dtype=np.result_type(normal, b_vect))
+        amps[~ill] = cho_solve_batch(l_mat[~ill], b_vect[~ill])
+        amps[ill] = np.matmul(LA.pinv(normal[ill], hermitian=True),
+                              b_vect[ill][..., np.newaxis])[..., 0]
+
+    return amps.reshape(shape + (p,))
+
+
+def gls_batch(dat, mat, sn, return_signal=False, return_fstat=False,
+              rcond=1e-12):
+    """
+    Generalized least-square estimator for a stack of design matrices (e.g.
+    for several channels or several parameter values).
+
+    Parameters
+    ----------
+    dat : ndarray
+        data vectors, size ... x n
+    mat : ndarray
+        design matrices, size ... x n x p
+    sn : ndarray
+        variance vectors, size ... x n
+    return_signal : bool
+        if True, also return the estimated signals
+    return_fstat : bool
+        if True, also return the F-statistics 1/2 (mat^H y)^H amps (i.e. the
+        log-likelihood maximized over the amplitudes, up to the
+        normalization of the inner product)
+    rcond : float
+        threshold on the ratio of Cholesky pivots of the normal matrices
+        below which the pseudo-inverse is used (see solve_normal_batch)
+
+    Returns
+    -------
+    amps : ndarray
+        estimated amplitudes, size ... x p
+    signal : ndarray
+        estimated signals, size ... x n (only if return_signal is True)
+    fstat : ndarray
+        F-statistics, size ... (only if return_fstat is True)
+
+    """
+
+    mat_weighted = np.conj(mat) / np.asarray(sn)[..., np.newaxis]
+    normal = np.einsum('...nk,...nl->...kl', mat_weighted, mat)
+    b_vect = np.einsum('...nk,...n->...k', mat_weighted, dat)
+    amps = solve_normal_batch(normal, b_vect, rcond=rcond)
+
+    if not (return_signal | return_fstat):
+        return amps
+    out = [amps]
+    if return_signal:
+        out.append(np.einsum('...nk,...k->...n', mat, amps))
+    if return_fstat:
+        out.append(0.5 * np.real(np.einsum('...k,...k->...',
+                                           np.conj(b_vect), amps)))
+
+    return tuple(out)
+
+
 def gls(dat, mat, sn):
     """
     Generalized least-square estimator.
@@ -467,9 +1323,5 @@ def gls(dat, mat, sn):
     amps : ndarray
         estimated amplitudes, size p
     """
-    
-    mat_weighted = mat / np.array([sn]).T
-    amps = LA.pinv(np.dot(mat_weighted.conj().T, mat)).dot(
-        np.dot(mat_weighted.conj().T, dat))
-    
-    return amps
\ No newline at end of file
+
+    return gls_batch(dat, mat, sn)
\ No newline at end of file
@@ -937,6 +937,9 @@ class ModelFDDataPSD(psdmodel.PSD):
         Minimum frequency for result
     fmax: float [default None]
         Maximum frequency for result
+    n_bins: int [default None]
+        If given, the data are averaged in n_bins log-spaced frequency bins
+        (see bayesdawn.psdmodel.LogFrequencyBinning) before fitting.
     Returns: bayesdawn.psfmodel.PSD object
     ----------
     For the specified channel analytic PSD model will be generated. If noise_model is not None,
@@ -957,7 +960,7 @@ class ModelFDDataPSD(psdmodel.PSD):
     there is the crutch we use here for starting from, and scaling against an approximate analytic model.
     '''
 
-    def __init__(self, data, channel, fit_type='poly',fit_dof=4, fit_logx=True, noise_model='spritz', smooth_df=None, fmin=1e-5, fmax=None):
+    def __init__(self, data, channel, fit_type='poly',fit_dof=4, fit_logx=True, noise_model='spritz', smooth_df=None, fmin=1e-5, fmax=None, n_bins=None):
     
         self.channel = channel
         self.fit_type = fit_type
@@ -1029,8 +1032,19 @@ class ModelFDDataPSD(psdmodel.PSD):
                     y=np.log(y/zero)
                 self.fit_zero=zero
                 
+        w=1/f
+        if n_bins is not None:
+            # Fit bin averages, whose standard deviations scale as 1/sqrt(counts)
+            binning=psdmodel.LogFrequencyBinning(f, n_bins=n_bins)
+            f=binning.f
+            if fit_logx: x=binning.logf
+            else: x=f
+            y=binning.average(y)
+            w=np.sqrt(binning.counts)/f
+        self.binning=binning if n_bins is not None else None
+
         if fit_type=='poly' or fit_type=='log_poly':              
-            pf = np.polyfit(x,y,fit_dof+1,w=1/f)
+            pf = np.polyfit(x,y,fit_dof+1,w=w)
             #print('poly fit:',pf)
             self.fit = np.poly1d(pf)
         elif fit_type=='spline' or fit_type=='log_spline':
@@ -1041,7 +1055,7 @@ class ModelFDDataPSD(psdmodel.PSD):
             knots=self.choose_knots(f) #This function needs f, not x
             xknots=knots
             if fit_logx: xknots=np.log(knots) #transform to x-space if needed
-            fitspline=scipy.interpolate.LSQUnivariateSpline(x, y, xknots[1:-1], w=1/f, k=3, ext=3, check_finite=False)                    
+            fitspline=scipy.interpolate.LSQUnivariateSpline(x, y, xknots[1:-1], w=w, k=3, ext=3, check_finite=False)                    
             print('knots',knots)
             self.knots=knots
             self.fit=fitspline
@@ -184,10 +184,12 @@ class FullModel(object):
         self.psd_cls.set_periodogram(z_fft, K2=self.K2_psd)
         # Draw the PSD
         psd_samples, logp_values = self.psd_cls.sample_psd(self.npsd)
+        # Only the first chain is conditioned on the successive Gibbs updates
+        psd_samples, logp_values = psd_samples[:, 0, :], logp_values[:, 0]
         # Last PSD value
-        self.psd_cls.logSc = psd_samples[self.npsd - 1, :]
+        self.psd_cls.logsc = psd_samples[-1, :]
         # Update PSD function and Fourier spectrum
-        self.psd_cls.update_psd_func(self.psd_cls.logSc)
+        self.psd_cls.update_psd_func(self.psd_cls.logsc)
         # Update new value of the spectrum for the posterior step
         self.posterior_cls.spectrum = self.psd_cls.calculate(self.N)
         # Store psd parameter samples
@@ -233,11 +235,11 @@ class FullModel(object):
         # Update new value of the spectrum
         self.spectrum = self.psd_cls.calculate(self.N)
         # Store first value of PSD
-        logSc0 = np.zeros((1, self.psd_cls.logSc.shape[0]))
-        logSc0[0, :] = self.psd_cls.logSc
+        logSc0 = np.zeros((1, self.psd_cls.logsc.shape[0]))
+        logSc0[0, :] = self.psd_cls.logsc
         self.psd_samples = logSc0
         # Calculate first value of loglikelihood
-        self.psd_logpvals = np.array([self.psd_cls.psd_posterior(logSc0)])
+        self.psd_logpvals = self.psd_cls.psd_posterior(logSc0)
         # # Initialization of PSD parameter file
         # fh5 = h5py.File(self.outdir + self.psd_file_name, 'a')
         # # Clear all data sets
@@ -246,7 +248,7 @@ class FullModel(object):
         # if "psd/logpvals" in fh5:
         #     del fh5["psd/logpvals"]
         # dset_samples = fh5.create_dataset("psd/samples", np.shape(self.psd_samples), maxshape=(None, None),
-        #                                   dtype=np.float64, chunks=(npsd, self.psd_cls.logSc.shape[0]))
+        #                                   dtype=np.float64, chunks=(npsd, self.psd_cls.logsc.shape[0]))
         # dset_logpvals = fh5.create_dataset("psd/logpvals", np.shape(self.psd_logpvals), maxshape=(None,),
         #                                    dtype=np.float64, chunks=(npsd,))
         # dset_samples[:] = self.psd_samples
@@ -282,11 +284,11 @@ class FullModel(object):
     def reset_psd_samples(self):
 
         # Store first value of PSD
-        logSc0 = np.zeros((1, self.psd_cls.logSc.shape[0]))
-        logSc0[0, :] = self.psd_cls.logSc
+        logSc0 = np.zeros((1, self.psd_cls.logsc.shape[0]))
+        logSc0[0, :] = self.psd_cls.logsc
         self.psd_samples = logSc0
         # Calculate first value of loglikelihood
-        self.psd_logpvals = np.array([self.psd_cls.psd_posterior(logSc0)])
+        self.psd_logpvals = self.psd_cls.psd_posterior(logSc0)
 
     def save_psd_samples(self):
         """
@@ -17,13 +17,14 @@ import time
 from scipy import linalg
 import copy
 import warnings
+from concurrent import futures
 # FTT modules
 import pyfftw
 from pyfftw.interfaces.numpy_fft import fft, ifft
 pyfftw.interfaces.cache.enable()
 
 
-def generate_freq_noise_from_psd(psd, fs, myseed=None):
+def generate_freq_noise_from_psd(psd, fs, myseed=None, rng=None):
     """
     Generate noise in the frequency domain from the values of the DSP.
     """
@@ -51,6 +52,9 @@ def generate_freq_noise_from_psd(psd, fs, myseed=None):
         sampling frequency
     myseed : scalar integer or None
         seed of the random number generator
+    rng : numpy.random.Generator or None
+        random number generator to use. If None (default), numpy's global
+        generator is used, seeded with myseed.
 
     Returns
     -------
@@ -61,17 +65,19 @@ def generate_freq_noise_from_psd(psd, fs, myseed=None):
     # Size of the DSP
     n_psd = len(psd)
     # Initialize seed for generating random numbers
-    np.random.seed(myseed)
+    if rng is None:
+        np.random.seed(myseed)
+        rng = np.random
 
     n_fft = np.int((n_psd-1)/2)
     # Real part of the Noise fft : it is a gaussian random variable
-    noise_ft_real = np.sqrt(0.5 * psd[0:n_fft+1])*np.random.normal(loc=0.0, 
-                                                                 scale=1.0, 
-                                                                 size=n_fft+1) 
+    noise_ft_real = np.sqrt(0.5 * psd[0:n_fft+1])*rng.normal(loc=0.0,
+                                                             scale=1.0,
+                                                             size=n_fft+1)
     # Imaginary part of the Noise fft :
-    noise_ft_imag = np.sqrt(0.5 * psd[0:n_fft+1])*np.random.normal(loc=0.0, 
-                                                               scale=1.0, 
-                                                               size=n_fft+1)
+    noise_ft_imag = np.sqrt(0.5 * psd[0:n_fft+1])*rng.normal(loc=0.0,
+                                                             scale=1.0,
+                                                             size=n_fft+1)
     # The Fourier transform must be real in f = 0
     noise_ft_imag[0] = 0.
     noise_ft_real[0] = noise_ft_real[0]*np.sqrt(2.)
@@ -82,7 +88,7 @@ def generate_freq_noise_from_psd(psd, fs, myseed=None):
     # To get a real valued signal we must have NoiseTF(-f) = NoiseTF*
     if n_psd % 2 == 0 :
         # The TF at Nyquist frequency must be real in the case of an even number of data
-        Noise_sym0 = np.array([ np.sqrt(psd[n_fft+1])*np.random.normal(0,1) ])
+        Noise_sym0 = np.array([ np.sqrt(psd[n_fft+1])*rng.normal(0,1) ])
         # Add the symmetric part corresponding to negative frequencies
         Noise_TF = np.hstack( (Noise_TF, Noise_sym0, np.conj(Noise_TF[1:n_fft+1])[::-1]) )
 
@@ -94,7 +100,7 @@ def generate_freq_noise_from_psd(psd, fs, myseed=None):
     return np.sqrt(n_psd*fs/2.) * Noise_TF
 
 
-def generate_noise_from_psd(psd, fs, myseed=None) :
+def generate_noise_from_psd(psd, fs, myseed=None, rng=None):
     """
     Function generating a colored noise from a vector containing the DSP.
     The PSD contains Np points such that Np > 2N and the output noise should
@@ -117,6 +123,9 @@ def generate_noise_from_psd(psd, fs, myseed=None) :
         sampling frequency
     myseed : scalar integer or None
         seed of the random number generator
+    rng : numpy.random.Generator or None
+        random number generator to use. If None (default), numpy's global
+        generator is used, seeded with myseed.
 
     Returns
     -------
@@ -124,7 +133,7 @@ def generate_noise_from_psd(psd, fs, myseed=None) :
         time sample of the colored noise (size N)
     """
 
-    return ifft(generate_freq_noise_from_psd(psd, fs, myseed=myseed))
+    return ifft(generate_freq_noise_from_psd(psd, fs, myseed=myseed, rng=rng))
 
 
 class NdTimeSeries(ndarray):
@@ -242,13 +251,169 @@ def cm_fft(s2, c, ind_mis, ind_obs, mask):
     return lambda v: matrixalgebra.mat_vect_prod(v, ind_obs, ind_mis, mask, s2)
 
 
-def toeplitz(r, inds):
+def toeplitz(r, inds, inds2=None):
+    """
+    Extract the block of a symmetric Toeplitz matrix defined by its first
+    row r, restricted to rows inds and columns inds2.
+
+    Parameters
+    ----------
+    r : ndarray
+        autocovariance function
+    inds : array_like
+        row indices
+    inds2 : array_like, optional
+        column indices. If None, the columns are the same as the rows.
+
+    Returns
+    -------
+    c : ndarray
+        matrix of size len(inds) x len(inds2)
+
+    """
+
+    if inds2 is None:
+        inds2 = inds
+
+    return r[np.abs(np.asarray(inds)[:, np.newaxis]
+                    - np.asarray(inds2)[np.newaxis, :])]
+
+
+def seed_sequence(seed=None):
+    """
+    Build a numpy SeedSequence from a seed.
+
+    Parameters
+    ----------
+    seed : int, numpy.random.SeedSequence or None
+        seed. If None, the entropy is drawn from numpy's global generator, so
+        that np.random.seed still makes the results reproducible.
+
+    Returns
+    -------
+    seq : numpy.random.SeedSequence
+        seed sequence
+
+    """
+
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    if seed is None:
+        seed = np.random.randint(0, 2**31 - 1, size=4)
 
-    ix, iy = np.meshgrid(inds, inds)
+    return np.random.SeedSequence(seed)
 
-    indx = np.abs(ix - iy)
 
-    return np.vstack([r[indx[i, :]] for i in range(indx.shape[0])])
+def compute_segment_factors(maskj, r, full=True):
+    """
+    Compute the factorizations needed to impute the missing data of a segment
+    with local mask maskj.
+
+    Parameters
+    ----------
+    maskj : ndarray
+        local mask
+    r : ndarray
+        autocovariance computed until lag n_max
+    full : bool
+        if True, also precompute the kernel C_mo C_oo^{-1} and a square root
+        of the conditional covariance of missing data (full-matrix method).
+        Otherwise, C_mo is applied with FFTs, using a precomputed
+        MaskedToeplitzOperator.
+
+    Returns
+    -------
+    factors : dict
+        dictionary containing the local indices of observed and missing
+        data ('ind_obs', 'ind_mis'), and the Cholesky factorization of
+        C_oo ('c_oo_cho'). If full is True, it also contains the kernel
+        ('kernel') and the square root of the conditional covariance
+        ('cond_sqrt'). Otherwise, it contains the operator C_mo ('c_mo').
+
+    """
+
+    # Local indices of missing and observed data
+    ind_obsj = np.where(maskj == 1)[0]
+    ind_misj = np.where(maskj == 0)[0]
+    # Covariance of observed data and its Cholesky factorization
+    c_oo_cho = linalg.cho_factor(toeplitz(r, ind_obsj), lower=True)
+    factors = {'ind_obs': ind_obsj, 'ind_mis': ind_misj,
+               'c_oo_cho': c_oo_cho}
+
+    if full:
+        c_om = toeplitz(r, ind_obsj, ind_misj)
+        kernel = linalg.cho_solve(c_oo_cho, c_om).T
+        # Conditional covariance C_mm - C_mo C_oo^{-1} C_om
+        c_cond = toeplitz(r, ind_misj) - kernel.dot(c_om)
+        factors['kernel'] = kernel
+        factors['cond_sqrt'] = matrixalgebra.cov_sqrt(c_cond)
+    else:
+        factors['c_mo'] = matrixalgebra.MaskedToeplitzOperator(
+            r[0:len(maskj)], ind_obsj, ind_misj)
+
+    return factors
+
+
+def conditional_segments(y_seg, maskj, factors, psd_2n, fs, seeds=None):
+    """
+    Compute the conditional expectation of missing data given the observed
+    data, or draw them from their conditional distribution, for several
+    segments sharing the same local mask.
+
+    Parameters
+    ----------
+    y_seg : ndarray
+        stacked segments of masked data, size n_segments x segment_length
+    maskj : ndarray
+        local mask common to all segments
+    factors : dict
+        factorizations computed by compute_segment_factors
+    psd_2n : ndarray
+        One-sided PSD computed on a Fourier grid of size 2nj
+    fs : float
+        sampling frequency
+    seeds : list of numpy.random.SeedSequence or None
+        seeds of the random streams of each segment. If None, the conditional
+        expectation is returned.
+
+    Returns
+    -------
+    eps : ndarray
+        conditional expectation or draw of missing data,
+        size n_segments x n_mis_j
+
+    """
+
+    ind_obsj = factors['ind_obs']
+    ind_misj = factors['ind_mis']
+
+    # Full-matrix method
+    if 'kernel' in factors:
+        eps = y_seg[:, ind_obsj].dot(factors['kernel'].T)
+        if seeds is not None:
+            # Z u | o = C_mo C_oo^-1 Z_o + L_{m|o} xi with xi ~ N(0, I)
+            xi = np.array([np.random.default_rng(seq).standard_normal(
+                len(ind_misj)) for seq in seeds])
+            eps += xi.dot(factors['cond_sqrt'].T)
+
+    # FFT-based method
+    else:
+        # Covariance missing / observed data : matrix operator
+        c_mo = factors['c_mo'].dot
+        if seeds is None:
+            eps = np.array([c_mo(linalg.cho_solve(factors['c_oo_cho'],
+                                                  yj[ind_obsj]))
+                            for yj in y_seg])
+        else:
+            eps = np.empty((y_seg.shape[0], len(ind_misj)))
+            for j, seq in enumerate(seeds):
+                e = np.real(generate_noise_from_psd(
+                    psd_2n, fs, rng=np.random.default_rng(seq))[0:len(maskj)])
+                # Z u | o = Z_tilde_u + Cmo Coo^-1 ( Z_o - Z_tilde_o )
+                eps[j] = e[ind_misj] + c_mo(linalg.cho_solve(
+                    factors['c_oo_cho'], y_seg[j, ind_obsj] - e[ind_obsj]))
+
+    return eps
 
 
 class GaussianStationaryProcess(object):
@@ -261,7 +426,10 @@ class GaussianStationaryProcess(object):
 
     def __init__(self, y_mean, mask, psd_cls,
                  method='nearest', precond='taper', na=150, nb=150, p=60,
-                 tol=1e-6, n_it_max=1000, n_wood_max=5000):
+                 tol=1e-6, n_it_max=1000, n_wood_max=5000,
+                 n_workers=1, executor='thread', seed=None,
+                 warm_start=True, n_recycle=1, pcg_algo='cg',
+                 precond_tol=0.0):
         """
 
         Parameters
@@ -290,6 +458,31 @@ class GaussianStationaryProcess(object):
         p : int
             number of points to keep before truncation for the preconditionner
             (only if 'PCG' method is chosen)
+        n_workers : int
+            number of workers among which the segments are distributed
+            (only if 'nearest' method is chosen)
+        executor : str or concurrent.futures.Executor instance
+            pool of workers used if n_workers > 1: 'thread' or 'process'
+            pools are created on first use, and kept for later calls.
+            Alternatively, an existing executor can be provided.
+        seed : int or None
+            seed from which the random streams of each segment are derived.
+            Draws do not depend on the number of workers. If None, the streams
+            are seeded from numpy's global random generator.
+        warm_start : bool
+            if True, the solutions of previous calls are used to build the
+            initial guess of the PCG algorithm (only if 'PCG' method is chosen)
+        n_recycle : int
+            number of previous solutions kept per channel to build the initial
+            guess, by projection on the space they span.
+        pcg_algo : str
+            iterative algorithm used by the 'PCG' method, see
+            matrixalgebra.pcg_solve. Default is the conjugate gradient, which
+            solves several channels sharing the same PSD at once.
+        precond_tol : float
+            when the PSD is updated, the preconditioner is only refactorized if
+            the relative change of its tapered autocovariance exceeds
+            precond_tol (only if 'PCG' or 'tapered' method is chosen)
         """
 
         # Masked data
@@ -298,6 +491,11 @@ class GaussianStationaryProcess(object):
         self.mask = copy.deepcopy(mask)
         # The PSD
         self.psd_cls = copy.deepcopy(psd_cls)
+        # Sampling frequency
+        if type(psd_cls) == list:
+            self.fs = psd_cls[0].fs
+        else:
+            self.fs = psd_cls.fs
         # Total length of the data
         self.n = len(mask)
         # Imputation method
@@ -306,12 +504,29 @@ class GaussianStationaryProcess(object):
         self.precond = precond
         # Tappering number for sparse approximation of the covariance
         self.p = p
+        # Relative autocovariance change triggering preconditioner updates
+        self.precond_tol = precond_tol
         # Error tolerance to reach to end PCG algorithm iterations
         self.tol = tol
         # Maximum number of iterations for the PCG algorithm
         self.n_it_max = n_it_max
         # Maximum missing data length accepted by Woodbury method 
         self.n_wood_max = n_wood_max
+        # Parallel processing of segments
+        self.n_workers = n_workers
+        self.executor = executor
+        self.pool = None
+        # Iterative solver for the PCG method
+        self.pcg_algo = pcg_algo
+        # Previous PCG solutions, per channel
+        self.warm_start = warm_start
+        self.n_recycle = n_recycle
+        self.recyclers = {}
+        # Root of the random streams
+        if seed is None:
+            self.seed_seq = None
+        else:
+            self.seed_seq = np.random.SeedSequence(seed)
         # Check whether there are gaps
         if np.any(self.mask == 0):
             # Starting and ending points of gaps
@@ -370,6 +585,9 @@ class GaussianStationaryProcess(object):
                                    self.n_ends[self.n_gaps - 2]])),
                     np.int(np.min([self.n_ends[self.n_gaps - 1] + nb, self.n])))]
 
+        # Segments sharing the same local mask pattern are imputed together
+        self.groups = self.group_segments()
+
         # ==
         # Store quantities that can be computed offline
         # ==
@@ -380,13 +598,90 @@ class GaussianStationaryProcess(object):
         self.s2 = None
         # Preconditionner for PCG or tapered methods
         self.solve = None
-        # Inverted matrix for woodbury method
-        self.sig_inv_mm_inv = None
-        self.w_m_cls = None
+        # Factorized capacitance matrix for woodbury method
+        self.sig_inv_mm_cho = None
         self.a = None
         self.lamdba_n = None
+        self.t_inv = None
+        # Factorizations of the nearest-neighboor method, keyed by channel,
+        # PSD version and local mask pattern
+        self.psd_version = 0
+        self.factors = {}
 
         
+    def __getstate__(self):
+        # Pools of workers cannot be copied or pickled
+        state = self.__dict__.copy()
+        state['pool'] = None
+        if isinstance(self.executor, futures.Executor):
+            state['executor'] = 'thread'
+        return state
+
+    def get_pool(self):
+        """
+        Get the pool of workers used to distribute the segment computations,
+        creating it if necessary.
+
+        Returns
+        -------
+        pool : concurrent.futures.Executor instance
+            pool of workers
+
+        """
+
+        if self.pool is None:
+            if isinstance(self.executor, futures.Executor):
+                self.pool = self.executor
+            elif self.executor == 'thread':
+                self.pool = futures.ThreadPoolExecutor(self.n_workers)
+            elif self.executor == 'process':
+                self.pool = futures.ProcessPoolExecutor(self.n_workers)
+            else:
+                raise ValueError("Unknown executor type.")
+
+        return self.pool
+
+    def map(self, func, *iterables):
+        """
+        Apply a function to all elements of the iterables, serially or with the
+        pool of workers.
+
+        Returns
+        -------
+        results : list
+            list of outputs
+
+        """
+
+        if (self.n_workers > 1) | isinstance(self.executor, futures.Executor):
+            return list(self.get_pool().map(func, *iterables))
+        else:
+            return list(map(func, *iterables))
+
+    def group_segments(self):
+        """
+        Group the embedding segments by gap geometry, i.e. by their local mask
+        pattern (which determines the number of points before the gap, the gap
+        length and the number of points after the gap).
+
+        Returns
+        -------
+        groups : list of ndarrays
+            list of 2D arrays of size n_segments x segment_length, each
+            containing the indices of all segments sharing the same geometry
+
+        """
+
+        if self.indices is None:
+            return []
+
+        groups = {}
+        for indj in self.indices:
+            key = self.mask[indj].tobytes()
+            groups.setdefault(key, []).append(indj)
+
+        return [np.vstack(group) for group in groups.values()]
+
     def update_psd(self, psd_cls):
         """
         Update the PSD class of the Gaussian stationary process
@@ -432,32 +727,73 @@ class GaussianStationaryProcess(object):
             t2 = time.time()
             self.s2 = [psd.calculate(2 * self.n_max) for psd in self.psd_cls]
         print("Computation of autocovariance + PSD took " + str(t2-t1))
+        # Factorizations computed from the previous autocovariance are stale
+        self.psd_version += 1
+        # Factors computed for older PSD versions are discarded
+        self.factors = {}
         
+        # Refresh the preconditioner if it was already built
+        if self.solve is not None:
+            self.compute_preconditioner()
+
         if self.method == 'woodbury':
             if len(self.ind_mis) <= self.n_wood_max:
                 print("Start Toeplitz system precomputations...")
-                self.w_m_cls = operators.MappingOperator(self.ind_mis, self.n)
-                w_m = self.w_m_cls.build_matrix(sp=False)
-                # s_n = self.psd_cls.calculate(self.n_max)
-                # sigma_inv_wmt = ifft(fft(w_m.T, axis=0) / np.array([s_n]).T, axis=0)
                 if type(self.psd_cls) != list:
                     autocorr = self.autocorr[:]
                 else:
                     # Assume same autocovariance for every channel
                     autocorr = self.autocorr[0]
-                # Precompute quantities for calculating the inverse of Sigma
-                self.lambda_n, self.a = fastoeplitz.teopltiz_precompute(
+                # Precompute the operator calculating the inverse of Sigma
+                if self.t_inv is None:
+                    workspace = None
+                else:
+                    workspace = self.t_inv.workspace
+                self.t_inv = fastoeplitz.teopltiz_precompute(
                     autocorr,  p=self.p, nit=self.n_it_max, tol=self.tol,
-                    method='levinson',
-                    precond=self.precond)
-                sigma_inv_wmt = fastoeplitz.multiple_toepltiz_inverse(
-                    w_m.T, self.lambda_n, self.a)
-                self.sig_inv_mm_inv = linalg.pinv(w_m.dot(sigma_inv_wmt))
-                    
+                    method='durbin',
+                    precond=self.precond, operator=True,
+                    workspace=workspace)
+                self.lambda_n, self.a = self.t_inv.lambda_n, self.t_inv.a
+                self.sig_inv_mm_cho = self.woodbury_capacitance()
+
             else:
                 msg = "Number of missing data is too large for woodbury method."
                 raise ValueError(msg)
         
+    def woodbury_capacitance(self, n_batch=256):
+        """
+        Compute the Cholesky factorization of the capacitance matrix of the
+        Woodbury formula, W_m Sigma^{-1} W_m^T, i.e. the restriction of the
+        inverse covariance to missing data. It is computed matrix-free, by
+        applying Sigma^{-1} to batches of unit vectors.
+
+        Parameters
+        ----------
+        n_batch : int
+            number of unit vectors processed at once
+
+        Returns
+        -------
+        sig_inv_mm_cho : tuple
+            Cholesky factorization of the capacitance matrix, as returned by
+            scipy.linalg.cho_factor
+
+        """
+
+        n_mis = len(self.ind_mis)
+        sig_inv_mm = np.empty((n_mis, n_mis))
+
+        for j0 in range(0, n_mis, n_batch):
+            j1 = np.min([j0 + n_batch, n_mis])
+            # Unit vectors located at missing data points
+            e_mat = np.zeros((self.n, j1 - j0))
+            e_mat[self.ind_mis[j0:j1], np.arange(j1 - j0)] = 1.0
+            sig_inv_mm[:, j0:j1] = self.t_inv.solve_many(e_mat)[self.ind_mis]
+
+        return linalg.cho_factor(0.5 * (sig_inv_mm + sig_inv_mm.T),
+                                 lower=True)
+
     def compute_preconditioner(self):
         """
         Precompute the pre-conditioner operator that looks like Coo
@@ -466,24 +802,38 @@ class GaussianStationaryProcess(object):
 
         # Precompute solver if necessary
         if (self.method == 'PCG') | (self.method == 'tapered'):
-            print("Build preconditionner...")
             if type(self.autocorr) != list:
-                self.solve = matrixalgebra.compute_precond(self.autocorr, 
-                                                           self.mask, 
-                                                           p=self.p,
-                                                           taper='Wendland2')
+                autocorrs, solves = [self.autocorr], [self.solve]
+            else:
+                autocorrs = self.autocorr
+                solves = self.solve if type(self.solve) == list else [None]
+            # The band structure only depends on the mask and the order p: if
+            # it is unchanged, only the numerical factorization is updated
+            if (len(solves) == len(autocorrs)) & all(
+                    [isinstance(solve,
+                                matrixalgebra.BandedCholeskyPreconditioner)
+                     and solve.matches(self.mask, self.p, 'Wendland2')
+                     for solve in solves]):
+                n_up = np.sum([solve.update(autocorr, tol=self.precond_tol)
+                               for solve, autocorr in zip(solves, autocorrs)])
+                print("Preconditionner refactorized for " + str(n_up) + "/"
+                      + str(len(solves)) + " channels.")
+            else:
+                print("Build preconditionner...")
+                solves = [matrixalgebra.compute_precond(autocorrs[0],
+                                                        self.mask,
+                                                        p=self.p,
+                                                        ptype='banded',
+                                                        taper='Wendland2')]
+                solves += [matrixalgebra.BandedCholeskyPreconditioner(
+                    autocorr, self.mask, p=self.p, taper='Wendland2',
+                    pattern=solves[0].pattern)
+                    for autocorr in autocorrs[1:]]
+                print("Preconditionner built.")
+            if type(self.autocorr) != list:
+                self.solve = solves[0]
             else:
-                self.solve = [matrixalgebra.compute_precond(autocorr, 
-                                                            self.mask, 
-                                                            p=self.p,
-                                                            taper='Wendland2')
-                              for autocorr in self.autocorr]
-            # # For now, use the same preconditionner for all channels           
-            # self.solve = matrixalgebra.compute_precond(self.autocorr, 
-            #                                             self.mask, 
-            #                                             p=self.p,
-            #                                             taper='Wendland2') 
-            print("Preconditionner built.")
+                self.solve = solves
 
     def impute(self, y, draw=True):
         """
@@ -565,11 +915,35 @@ class GaussianStationaryProcess(object):
             # print("Missing data imputation took " + str(t2-t1))
             
         elif type(y) == list:
-            
-            y_mis_res = [self.imputation(y[i] - self.y_mean[i], 
-                                         self.autocorr[i], self.s2[i],
-                                         solve=self.solve[i], draw=draw) 
-                         for i in range(len(y))]
+
+            # Exact methods impute channels sharing the same PSD together
+            if self.method == 'nearest':
+                channel_groups = [[i] for i in range(len(y))]
+            else:
+                channel_groups = []
+                for i in range(len(y)):
+                    for group in channel_groups:
+                        if np.array_equal(self.s2[group[0]], self.s2[i]):
+                            group.append(i)
+                            break
+                    else:
+                        channel_groups.append([i])
+
+            y_mis_res = [None for i in range(len(y))]
+            for group in channel_groups:
+                i0 = group[0]
+                y_group = np.array([y[i] - self.y_mean[i] for i in group])
+                if len(group) == 1:
+                    y_group = y_group[0]
+                if self.solve is not None:
+                    solve = self.solve[i0]
+                else:
+                    solve = None
+                results = self.imputation(y_group, self.autocorr[i0],
+                                          self.s2[i0], solve=solve,
+                                          draw=draw, channel=i0)
+                for i, res in zip(group, np.atleast_2d(results)):
+                    y_mis_res[i] = res
             y_rec = copy.deepcopy(y)
             
             for i in range(len(y)):
@@ -580,7 +954,7 @@ class GaussianStationaryProcess(object):
             
         return y_rec
     
-    def apply_coo_inv(self, z_o, s2, solve=None):
+    def apply_coo_inv(self, z_o, s2, solve=None, channel=0, coo_op=None):
         """
 
         Operator performing the product Coo^{-1} z on any vector z
@@ -588,25 +962,29 @@ class GaussianStationaryProcess(object):
         Parameters
         ----------
         z_o : array_like
-            vector of size n_obs
+            vector of size n_obs, or matrix of size n_obs x K
         s2 : array_like
             One-sided PSD values calculated on a Fourier grid of size 2 N_max
             WARNING: used to be S(f) * fs / 2. Now the normalization is done
             inside the function.
         solve : linear operator
             preconditionner
+        channel : int, optional
+            index of the channel, used to retrieve previous solutions
+        coo_op : matrixalgebra.MaskedToeplitzOperator instance, optional
+            operator computing C_oo x. If None, it is built from s2.
 
         Returns
         -------
-        x : 1d numpy array
-            vector of size n_obs, such that x = Coo^{-1} z
+        x : numpy array
+            vector of size n_obs (or n_obs x K), such that x = Coo^{-1} z
 
         """
         
         # Compute the DFT covariances from the one-sided PSD
         # The actual covariance is npoints x S(f) * fs / 2 but the factor
         # of npoints is already accounted for in the IFFT normalization
-        cov_2n = s2 * self.psd_cls.fs / 2.0
+        cov_2n = s2 * self.fs / 2.0
 
         if self.method == 'tapered':
             # Approximately solve the linear system C_oo x = eps
@@ -616,27 +994,39 @@ class GaussianStationaryProcess(object):
             if solve is None:
                 # self.compute_preconditioner(r)
                 raise ValueError("Please provide preconditionning operator")
+            if coo_op is None:
+                coo_op = matrixalgebra.MaskedToeplitzOperator.from_spectrum(
+                    cov_2n, self.ind_obs, n_data=self.n)
             # First guess
-            x0 = np.zeros(len(self.ind_obs))
+            if self.warm_start:
+                recycler = self.recyclers.setdefault(
+                    channel, matrixalgebra.SolutionRecycler(self.n_recycle))
+                x0 = recycler.initial_guess(z_o, coo_op.matmat,
+                                            key=self.psd_version)
+            else:
+                x0 = np.zeros(z_o.shape)
             # Solve the linear system C_oo x = eps
             x, _ = matrixalgebra.pcg_solve(self.ind_obs, self.mask, cov_2n,
                                            z_o, x0,
                                            self.tol, self.n_it_max,
                                            solve,
-                                          'scipy')
+                                           self.pcg_algo,
+                                           coo_op=coo_op)
+            if self.warm_start:
+                recycler.update(x, coo_op.matmat, key=self.psd_version)
         elif self.method == 'woodbury':
 
-            epsilon_masked = np.zeros(self.n)
-            epsilon_masked[self.ind_obs] = z_o
+            # All right-hand sides are processed at once
+            z_mat = np.reshape(z_o, (len(self.ind_obs), -1))
+            epsilon_masked = np.zeros((self.n, z_mat.shape[1]))
+            epsilon_masked[self.ind_obs] = z_mat
             # Apply inverse sigma
-            v_ = fastoeplitz.toepltiz_inverse_jain(epsilon_masked, 
-                                                   self.lambda_n, 
-                                                   self.a)
-            y_ = np.zeros(self.n)
-            y_[self.ind_mis] = self.sig_inv_mm_inv.dot(v_[self.ind_mis])
-            e_ = v_ - fastoeplitz.toepltiz_inverse_jain(y_, self.lambda_n, 
-                                                        self.a)
-            x = e_[self.ind_obs]
+            v_ = self.t_inv.solve_many(epsilon_masked)
+            y_ = np.zeros((self.n, z_mat.shape[1]))
+            y_[self.ind_mis] = linalg.cho_solve(self.sig_inv_mm_cho,
+                                                v_[self.ind_mis])
+            e_ = v_ - self.t_inv.solve_many(y_)
+            x = np.reshape(e_[self.ind_obs], z_o.shape)
             
         else:
             raise ValueError("Unknown imputation method.")
@@ -644,7 +1034,7 @@ class GaussianStationaryProcess(object):
         return x
 
 
-    def imputation(self, y, r, s2, solve=None, draw=True):
+    def imputation(self, y, r, s2, solve=None, draw=True, channel=0):
         """
 
         Impute the missing data using a conditional draw.
@@ -652,7 +1042,8 @@ class GaussianStationaryProcess(object):
         Parameters
         ----------
         y : array_like
-            masked residuals (size n_data)
+            masked residuals (size n_data). For exact methods, it can also be
+            a matrix of size K x n_data, whose rows are imputed together.
         r : array_like
             autocovariance function until lag N_max
         s2 : array_like
@@ -664,36 +1055,53 @@ class GaussianStationaryProcess(object):
             if True (default), the missing data are drawn from their 
             conditional distribution. If False, their conditional expectation 
             is returned.
-            
+        channel : int, optional
+            index of the channel being imputed. With the nearest-neighboor
+            method, it identifies the factorizations cached for the
+            autocovariance r, which is assumed to be the one computed by the
+            last call to compute_offline.
+
 
         Returns
         -------
-        y_mis : 1d numpy array
-            imputed missing value
+        y_mis : numpy array
+            imputed missing value (size n_mis, or K x n_mis)
 
         """
 
         if self.method == 'nearest':
             # =================================================================
-            # Gap per gap imputation
+            # Imputation of groups of gaps sharing the same geometry
             # =================================================================
-            if self.n_max <= 2000:
-                c = linalg.toeplitz(r)
-            else:
-                c = None
-
+            factors = self.nearest_factors(r, channel=channel)
+            if draw:
+                call_seq = seed_sequence(self.seed_seq.spawn(1)[0]
+                                         if self.seed_seq is not None
+                                         else None)
+            # Split the groups into chunks of segments to spread among workers
+            chunks = [(inds, factors_j)
+                      for group, factors_j in zip(self.groups, factors)
+                      for inds in np.array_split(
+                          group, np.min([group.shape[0], self.n_workers]))]
+            # Each segment has its own random stream, identified by its
+            # starting point, independently of the way segments are split
             if draw:
-                results = [self.single_imputation(y[indj], 
-                                                self.mask[indj], 
-                                                c,
-                                                r,
-                                                s2) 
-                            for indj in self.indices]
+                seeds = [[np.random.SeedSequence(
+                    call_seq.entropy,
+                    spawn_key=call_seq.spawn_key + (channel, int(start)))
+                    for start in inds[:, 0]] for inds, _ in chunks]
             else:
-                results = [self.single_conditional_mean(y[indj], 
-                                                        self.mask[indj], 
-                                                        c, r, s2) 
-                           for indj in self.indices]
+                seeds = [None for _ in chunks]
+            results = self.map(conditional_segments,
+                               [y[inds] for inds, _ in chunks],
+                               [self.mask[inds[0]] for inds, _ in chunks],
+                               [factors_j for _, factors_j in chunks],
+                               [s2 for _ in chunks],
+                               [self.fs for _ in chunks],
+                               seeds)
+            y_full = np.zeros(self.n)
+            for (inds, factors_j), eps in zip(chunks, results):
+                y_full[inds[:, factors_j['ind_mis']]] = eps
             # else:
             #     # If the number of points inside the gaps is too large, use a
             #     # FFT-based method
@@ -702,28 +1110,38 @@ class GaussianStationaryProcess(object):
             #                                            r,
             #                                            s2)
             #                for indj in self.indices]
-            y_mis = np.concatenate(results)
+            y_mis = y_full[self.ind_mis]
             
         else:
 
+            # Covariance operator of the complete data
+            cov_op = self.covariance_operator(r, channel=channel)
+            # Several data vectors sharing the same covariance can be imputed
+            # at once
+            y_mat = np.atleast_2d(y)
             if draw:
                 # For missing data draw:
-                e = np.real(generate_noise_from_psd(s2, self.psd_cls.fs)[0:self.n])
-                u = self.apply_coo_inv(y[self.ind_obs] - e[self.ind_obs], s2, 
-                                    solve=solve)
+                e = np.array([
+                    np.real(generate_noise_from_psd(s2, self.fs)[0:self.n])
+                    for k in range(y_mat.shape[0])])
+                u = self.apply_coo_inv((y_mat[:, self.ind_obs]
+                                        - e[:, self.ind_obs]).T, s2,
+                                       solve=solve, channel=channel,
+                                       coo_op=cov_op)
                 # Z u | o = Z_tilde_u + Cmo Coo^-1 ( Z_o - Z_tilde_o )
-                y_mis = e[self.ind_mis] + matrixalgebra.mat_vect_prod(u, 
-                                                                    self.ind_obs, 
-                                                                    self.ind_mis, 
-                                                                    self.mask, 
-                                                                    s2)
+                y_mis = e[:, self.ind_mis] + cov_op.matmat(
+                    u.reshape(len(self.ind_obs), -1), ind_out=self.ind_mis).T
             else:
                 # For conditional mean computation:
                 # Compute u = C_oo^{-1} z_o
-                u = self.apply_coo_inv(y[self.ind_obs], s2, solve=solve)
+                u = self.apply_coo_inv(y_mat[:, self.ind_obs].T, s2,
+                                       solve=solve, channel=channel,
+                                       coo_op=cov_op)
                 # Compute the missing data conditional mean via z|o = Cmo u
-                y_mis = matrixalgebra.mat_vect_prod(u, self.ind_obs, self.ind_mis,
-                                                    self.mask, s2)
+                y_mis = cov_op.matmat(u.reshape(len(self.ind_obs), -1),
+                                      ind_out=self.ind_mis).T
+            if np.ndim(y) == 1:
+                y_mis = y_mis[0]
             
         # elif self.method == 'tapered':
         #     # Approximately solve the linear system C_oo x = eps
@@ -768,7 +1186,115 @@ class GaussianStationaryProcess(object):
         return y_mis
             
 
-    def single_imputation(self, yj, maskj, c, r, psd_2n, threshold=2000):
+    def segment_factors(self, maskj, r, threshold=2000, channel=0):
+        """
+        Get the factorizations needed to impute a segment with local mask
+        maskj. They are computed once per channel, PSD version and local mask
+        pattern, and then retrieved from the cache.
+
+        Parameters
+        ----------
+        maskj : ndarray
+            local mask
+        r : ndarray
+            autocovariance computed until lag n_max
+        threshold : int, optional
+            Threshold for the size of the neighbooring segments, above which
+            the methods switches from matrix-based to FFT-based.
+        channel : int, optional
+            index of the channel
+
+        Returns
+        -------
+        factors : dict
+            factorizations computed by compute_segment_factors
+
+        """
+
+        key = (channel, self.psd_version, maskj.tobytes())
+
+        if key not in self.factors:
+            self.factors[key] = compute_segment_factors(
+                maskj, r, full=self.full_matrix(maskj, threshold))
+
+        return self.factors[key]
+
+    def covariance_operator(self, r, channel=0):
+        """
+        Get the operator computing products with blocks of the covariance of
+        the complete data vector, as used by exact imputation methods. It is
+        built once per channel and PSD version.
+
+        Parameters
+        ----------
+        r : ndarray
+            autocovariance function, of size n
+        channel : int, optional
+            index of the channel
+
+        Returns
+        -------
+        op : matrixalgebra.MaskedToeplitzOperator instance
+            covariance operator, which computes C_oo by default
+
+        """
+
+        key = (channel, self.psd_version, 'cov')
+
+        if key not in self.factors:
+            self.factors[key] = matrixalgebra.MaskedToeplitzOperator(
+                r, self.ind_obs)
+
+        return self.factors[key]
+
+    def full_matrix(self, maskj, threshold=2000):
+        """
+        Whether the full-matrix method should be used to impute a segment with
+        local mask maskj, instead of the FFT-based method.
+        """
+
+        # Compute the size of the neighbooring observed points + gap size
+        segment_size = np.int(self.na + self.nb + np.sum(maskj == 0))
+
+        return segment_size <= threshold
+
+    def nearest_factors(self, r, threshold=2000, channel=0):
+        """
+        Get the factorizations of all segment groups for the nearest-neighboor
+        method. Those which are not in the cache are computed in parallel.
+
+        Parameters
+        ----------
+        r : ndarray
+            autocovariance computed until lag n_max
+        threshold : int, optional
+            Threshold for the size of the neighbooring segments, above which
+            the methods switches from matrix-based to FFT-based.
+        channel : int, optional
+            index of the channel
+
+        Returns
+        -------
+        factors : list of dict
+            factorizations of each group in self.groups
+
+        """
+
+        masks = [self.mask[inds[0]] for inds in self.groups]
+        keys = [(channel, self.psd_version, maskj.tobytes())
+                for maskj in masks]
+        new = [i for i, key in enumerate(keys) if key not in self.factors]
+        results = self.map(compute_segment_factors,
+                           [masks[i] for i in new],
+                           [r for i in new],
+                           [self.full_matrix(masks[i], threshold)
+                            for i in new])
+        self.factors.update(zip([keys[i] for i in new], results))
+
+        return [self.factors[key] for key in keys]
+
+    def single_imputation(self, yj, maskj, r, psd_2n, threshold=2000,
+                          channel=0, seed=None):
         """
         Sample the missing data distribution conditionally on the observed
         data, using direct brute-force computation.
@@ -779,8 +1305,6 @@ class GaussianStationaryProcess(object):
             segment of masked data
         maskj : ndarray
             local mask
-        c : ndarray
-            covariance matrix of sized nj x nj
         r : ndarray
             autocovariance computed until lag n_max
         psd_2n : ndarray
@@ -788,6 +1312,10 @@ class GaussianStationaryProcess(object):
         threshold : int, optional
             Threshold for the size of the neighbooring segments, above which
             the methods switches from matrix-based to FFT-based.
+        channel : int, optional
+            index of the channel, used to retrieve cached factorizations
+        seed : int, numpy.random.SeedSequence or None
+            seed of the random stream
 
         Returns
         -------
@@ -795,52 +1323,16 @@ class GaussianStationaryProcess(object):
             imputed missing data, of size len(np.where(maskj == 0)[0])
 
         """
-        # Compute the DFT covariances from the one-sided PSD
-        # The actual covariance is npoints x S(f) * fs / 2 but the factor
-        # of npoints is already accounted for in the IFFT normalization
-        cov_2n = psd_2n * self.psd_cls.fs / 2.0
 
-        # Local indices of missing and observed data
-        ind_obsj = np.where(maskj == 1)[0]
-        ind_misj = np.where(maskj == 0)[0]
+        factors = self.segment_factors(maskj, r, threshold=threshold,
+                                       channel=channel)
 
-        # Compute the size of the neighbooring observed points + gap size
-        segment_size = np.int(self.na + self.nb + len(ind_misj))
-        
-        # If the size is below some threshold, apply full-matrix method:
-        if segment_size <= threshold:
-        
-            c_mo = c[np.ix_(ind_misj, ind_obsj)]
-            #C_mm = C[np.ix_(ind_misj,ind_misj)]
-            c_oo_inv = linalg.inv(c[np.ix_(ind_obsj, ind_obsj)])
-            # out = self.conditional_draw(yj[ind_obsj], psd_2n, c_oo_inv, c_mo,
-            #                             ind_obsj, ind_misj, maskj, c)
-            e = np.random.multivariate_normal(
-                np.zeros(maskj.shape[0]), 
-                c[0:maskj.shape[0], 0:maskj.shape[0]])
-
-            # Z u | o = Z_tilde_u + Cmo Coo^-1 ( Z_o - Z_tilde_o )
-            eps = e[ind_misj] + c_mo.dot(c_oo_inv.dot(yj[ind_obsj] - e[ind_obsj]))
-        
-        # Otherwise, use FFT-based method:
-        else:
-            # Covariance of observed data and its inverse
-            c_oo = toeplitz(r, ind_obsj)
-            c_oo_inv = linalg.inv(c_oo)
-            # Covariance missing / observed data : matrix operator
-            c_mo = lambda v: matrixalgebra.mat_vect_prod(v, ind_obsj, ind_misj,
-                                                         maskj, cov_2n)
-
-            # eps = self.conditional_draw_fast(yj[ind_obsj], psd_2n, c_oo_inv, 
-            #                                  c_mo, ind_obsj, ind_misj, maskj)
-            e = np.real(generate_noise_from_psd(psd_2n, self.psd_cls.fs)[0:maskj.shape[0]])
-
-            # Z u | o = Z_tilde_u + Cmo Coo^-1 ( Z_o - Z_tilde_o )
-            eps = e[ind_misj] + c_mo(c_oo_inv.dot(yj[ind_obsj] - e[ind_obsj]))
-            
-        return eps
+        return conditional_segments(yj[np.newaxis, :], maskj, factors, psd_2n,
+                                    self.fs,
+                                    seeds=[seed_sequence(seed)])[0]
     
-    def single_conditional_mean(self, yj, maskj, c, r, psd_2n, threshold=2000):
+    def single_conditional_mean(self, yj, maskj, r, psd_2n, threshold=2000,
+                                channel=0):
         """
         Compute the conditional expectation of missing data given the observed
         data, using direct brute-force computation 
@@ -852,8 +1344,6 @@ class GaussianStationaryProcess(object):
             segment of masked data
         maskj : ndarray
             local mask
-        c : ndarray
-            covariance matrix of sized nj x nj
         r : ndarray
             autocovariance computed until lag n_max
         psd_2n : ndarray
@@ -861,6 +1351,8 @@ class GaussianStationaryProcess(object):
         threshold : int, optional
             Threshold for the size of the neighbooring segments, above which
             the methods switches from matrix-based to FFT-based.
+        channel : int, optional
+            index of the channel, used to retrieve cached factorizations
 
         Returns
         -------
@@ -870,37 +1362,11 @@ class GaussianStationaryProcess(object):
 
         """
 
-        # Compute the DFT covariances from the one-sided PSD
-        # The actual covariance is npoints x S(f) * fs / 2 but the factor
-        # of npoints is already accounted for in the IFFT normalization
-        cov_2n = psd_2n * self.psd_cls.fs / 2.0
-
-        # Local indices of missing and observed data
-        ind_obsj = np.where(maskj == 1)[0]
-        ind_misj = np.where(maskj == 0)[0]
+        factors = self.segment_factors(maskj, r, threshold=threshold,
+                                       channel=channel)
 
-        # Compute the size of the neighbooring observed points + gap size
-        segment_size = np.int(self.na + self.nb + len(ind_misj))
-        
-        # If the size is below some threshold, apply full-matrix method:
-        if segment_size <= threshold:
-        
-            c_mo = c[np.ix_(ind_misj, ind_obsj)]
-            c_oo_inv = linalg.inv(c[np.ix_(ind_obsj, ind_obsj)])
-            mu_mis_j = c_mo.dot(c_oo_inv.dot(yj[ind_obsj]))
-        
-        # Otherwise, use FFT-based method:
-        else:
-            # Covariance of observed data and its inverse
-            c_oo = toeplitz(r, ind_obsj)
-            c_oo_inv = linalg.inv(c_oo)
-            # Covariance missing / observed data : matrix operator
-            c_mo = lambda v: matrixalgebra.mat_vect_prod(v, ind_obsj, ind_misj,
-                                                         maskj, cov_2n)
-
-            mu_mis_j = c_mo(c_oo_inv.dot(yj[ind_obsj]))
-            
-        return mu_mis_j
+        return conditional_segments(yj[np.newaxis, :], maskj, factors, psd_2n,
+                                    self.fs)[0]
 
 
 class GSP(object):
@@ -9,6 +9,7 @@ import numpy as np
 
 from scipy import linalg as LA
 from . import samplers
+from .algebra import matrixalgebra
 
 # FTT modules
 import pyfftw
@@ -35,9 +36,7 @@ def gls(mat_fft, psd, y_fft):
 
     """
 
-    mat_fft_weighed = mat_fft / np.array([psd]).T
-
-    return LA.pinv(mat_fft_weighed.conj().T.dot(mat_fft)).dot(mat_fft_weighed.conj().T.dot(y_fft))
+    return matrixalgebra.gls(y_fft, mat_fft, psd)
 
 
 class GWModel(object):
@@ -207,12 +206,15 @@ class GWModel(object):
             # Compute design matrices
             mat_list = self.matrix_model(params)
 
-            # Compute extrinsinc amplitudes for each channel
-            amplitudes = [gls(mat_list[i], spectrum[i][self.inds_pos], y_fft[i][self.inds_pos])
-                          for i in range(len(mat_list))]
+            # Compute extrinsinc amplitudes and signals for all channels at once
+            amplitudes, signals = matrixalgebra.gls_batch(
+                np.array([y_fft[i][self.inds_pos] for i in range(len(mat_list))]),
+                np.array(mat_list),
+                np.array([spectrum[i][self.inds_pos] for i in range(len(mat_list))]),
+                return_signal=True)
 
             # Stack the modeled signals
-            s_fft_stack = self.concatenate_model([mat_list[i].dot(amplitudes[i]) for i in range(len(mat_list))])
+            s_fft_stack = self.concatenate_model(list(signals))
             # # Data with real and imaginary part separated
             # yr = np.concatenate((y_fft[self.inds_pos].real, y_fft[self.inds_pos].imag))
             # N_bar = mat_freq_w.conj().T.dot(yr)
@@ -4,8 +4,10 @@ Created on Tue Jan 22 17:11:56 2019
 
 @author: qbaghi
 """
+import hashlib
 import numpy as np
 from scipy import linalg
+from concurrent import futures
 # FTT modules
 import pyfftw
 from pyfftw.interfaces.numpy_fft import fft, ifft
@@ -61,10 +63,121 @@ def gls(mat_fft, psd, y_fft):
 
     """
 
-    mat_fft_weighed = mat_fft / np.array([psd]).T
+    return matrixalgebra.gls(y_fft, mat_fft, psd)
 
-    return linalg.pinv(mat_fft_weighed.conj().T.dot(mat_fft)).dot(
-        mat_fft_weighed.conj().T.dot(y_fft))
+
+def log_likelihood_from_products(b_list, g_list, reduced=False):
+    """
+    Compute the log-likelihood (without the 4 df factor) from the weighted
+    inner products of the data and the waveform (or design matrix) columns.
+
+    Parameters
+    ----------
+    b_list : list[ndarray]
+        inner products (M_k | y) for all columns M_k, for each channel
+    g_list : list[ndarray]
+        inner products (M_k | M_l) for all pairs of columns, for each channel
+    reduced : bool
+        if True, the log-likelihood is maximized over the amplitudes of the
+        columns (reduced likelihood). Otherwise, there is only one column
+        which is the waveform.
+
+    Returns
+    -------
+    ll : float
+        (h | y) - 1/2 (h | h) summed over channels
+
+    """
+
+    b_vect = np.array(b_list)
+    g_mat = np.array(g_list)
+    if reduced:
+        # Least-squares amplitudes for all channels at once
+        amps = matrixalgebra.solve_normal_batch(g_mat, b_vect)
+        return 0.5 * np.sum(np.real(np.conj(b_vect) * amps))
+
+    return np.sum(np.real(b_vect[:, 0]) - 0.5 * np.real(g_mat[:, 0, 0]))
+
+
+def relative_binning_edges(freq, n_bins):
+    """
+    Choose the bin edges used for relative binning, such that the maximal
+    dephasing of a GW signal with respect to a reference waveform is
+    the same in all bins (Zackay et al. 2018). The dephasing is bounded by
+    a sum of power laws with post-Newtonian exponents.
+
+    Parameters
+    ----------
+    freq : ndarray
+        sorted frequency array
+    n_bins : int
+        requested number of bins
+
+    Returns
+    -------
+    edges : ndarray
+        indices of the bin edges in freq, including the first and last
+        frequencies. Duplicated edges are removed, so that the number of bins
+        can be smaller than n_bins.
+
+    """
+
+    gammas = np.array([-5/3, -2/3, 1, 5/3, 7/3])
+    f_star = np.where(gammas < 0, freq[0], freq[-1])
+    dpsi = 2 * np.pi * np.sum(
+        np.sign(gammas) * (freq[:, np.newaxis] / f_star) ** gammas, axis=1)
+    targets = np.linspace(dpsi[0], dpsi[-1], n_bins + 1)
+    edges = np.searchsorted(dpsi, targets)
+    edges[-1] = freq.shape[0] - 1
+
+    return np.unique(edges)
+
+
+def relative_binning_summary(data_dft, sn, mat_ref, freq, edges):
+    """
+    Compute the relative binning summary data of one channel, i.e. the
+    weighted inner products of the data and the reference waveforms within
+    each bin, at zeroth and first order in frequency.
+
+    Parameters
+    ----------
+    data_dft : ndarray
+        frequency-domain data, size nf
+    sn : ndarray
+        noise PSD, size nf
+    mat_ref : ndarray
+        reference waveforms (columns of the reference design matrix),
+        size nf x k
+    freq : ndarray
+        frequency array, size nf
+    edges : ndarray
+        indices of the bin edges in freq
+
+    Returns
+    -------
+    a0, a1 : ndarrays
+        data summaries, size n_bins x k
+    b0, b1 : ndarrays
+        reference waveform summaries, size n_bins x k x k
+
+    """
+
+    # The last edge belongs to the last bin
+    starts = edges[0:-1]
+    stops = np.concatenate([edges[1:-1], [edges[-1] + 1]])
+    df = freq[edges[0]:edges[-1] + 1] \
+        - np.repeat(freq[starts], stops - starts)
+    sl = slice(edges[0], edges[-1] + 1)
+    starts = starts - edges[0]
+    mat_weighted = np.conj(mat_ref[sl]) / sn[sl, np.newaxis]
+    prod = mat_weighted * data_dft[sl, np.newaxis]
+    a0 = np.add.reduceat(prod, starts, axis=0)
+    a1 = np.add.reduceat(prod * df[:, np.newaxis], starts, axis=0)
+    prod = mat_weighted[:, :, np.newaxis] * mat_ref[sl, np.newaxis, :]
+    b0 = np.add.reduceat(prod, starts, axis=0)
+    b1 = np.add.reduceat(prod * df[:, np.newaxis, np.newaxis], starts, axis=0)
+
+    return a0, a1, b0, b1
 
 
 # class LikelihoodModel(object):
@@ -625,7 +738,7 @@ class LogLike(object):
                  signal_kwargs={},
                  normalized=False, channels=None,
                  model_cls=None, psd_cls=None, wd=None, wd_full=None,
-                 gap_convolution=False):
+                 gap_convolution=False, n_psd_workers=1, design_func=None):
         """
 
         Parameters
@@ -673,6 +786,17 @@ class LogLike(object):
         gap_convolution : boolean
             if True, the waveform is convolved with the gap window.
             Significantly increases the likelihood evaluation time.
+        n_psd_workers : int or concurrent.futures.Executor instance
+            number of threads among which the PSD updates of the channels are
+            distributed. The pool is created on first use, and kept for later
+            calls. Alternatively, an existing executor can be provided.
+        design_func : callable, optional
+            function computing the design matrices of the reduced model,
+            taking as input the intrinsic sampling parameter vector, a
+            frequency vector, signal_args and signal_kwargs, and outputing a
+            list of matrices (one for each channel) such that the waveform
+            is a linear combination of their columns. Only required for the
+            reduced likelihood with relative binning.
 
 
         """
@@ -732,9 +856,82 @@ class LogLike(object):
         self.psd_list = psd_cls
         # Gap convolution flag
         self.gap_convolution = gap_convolution
+        # Parallel PSD updates
+        self.n_psd_workers = n_psd_workers
+        self.psd_pool = None
+        # Relative binning
+        self.design_func = design_func
+        self.rb_reduced = False
+        self.rb_edges = None
+        self.rb_mat_ref = None
+        self.rb_summary = None
+        self.rb_aux_digest = None
+        # Reduced-order quadrature
+        self.roq = None
+        self.roq_aux_digest = None
+        # Inner product weights 4 df / sn for batched evaluations
+        self.batch_weights = None
+        self.batch_data = None
+        self.batch_data_weighted = None
+        self.batch_aux_digest = None
+
+    def __getstate__(self):
+        # Pools of workers cannot be copied or pickled
+        state = self.__dict__.copy()
+        state['psd_pool'] = None
+        if isinstance(self.n_psd_workers, futures.Executor):
+            state['n_psd_workers'] = 1
+        return state
+
+    def get_psd_pool(self):
+        """
+        Get the pool of threads used to update the PSD of each channel,
+        creating it if necessary.
+
+        Returns
+        -------
+        pool : concurrent.futures.Executor instance
+            pool of workers
+
+        """
+
+        if self.psd_pool is None:
+            if isinstance(self.n_psd_workers, futures.Executor):
+                self.psd_pool = self.n_psd_workers
+            else:
+                self.psd_pool = futures.ThreadPoolExecutor(self.n_psd_workers)
+
+        return self.psd_pool
+
+    def update_channel_psd(self, i, y_gw, data):
+        """
+        Update the PSD of a single channel.
+
+        Parameters
+        ----------
+        i : int
+            channel index
+        y_gw : ndarray
+            waveform in the time domain for channel i
+        data : ndarray
+            data in the time domain for channel i
+
+        Returns
+        -------
+        sn : ndarray
+            updated PSD of channel i, computed at frequencies self.f[self.inds]
+
+        """
+
+        # Estimate PSD parameters from the residuals in the time domain
+        self.psd_list[i].estimate(data - y_gw, wind='hanning')
+        # Calculate the spectrum in the estimation band
+        return self.psd_list[i].calculate(self.f[self.inds])
 
     def update_psd(self, y_gw_list, data):
         """
+        Update the PSD of all channels. As the channels are independent, their
+        updates are distributed among a pool of threads if n_psd_workers > 1.
 
         Parameters
         ----------
@@ -747,17 +944,20 @@ class LogLike(object):
 
         Returns
         -------
+        sn : list of ndarrays
+            updated PSDs, computed at frequencies self.f[self.inds]
 
         """
 
-        # Estimate PSD parameters from the residuals in the time domain,
-        # in the first TDI channel.
-        [self.psd_list[i].estimate(data[i] - y_gw_list[i], wind='hanning')
-         for i in range(len(data))]
-        # Calculate the spectrum in the estimation band
-        sn = [psd.calculate(self.f[self.inds]) for psd in self.psd_list]
+        channels = range(len(data))
+        if isinstance(self.n_psd_workers, futures.Executor) \
+                or (self.n_psd_workers > 1):
+            sn = list(self.get_psd_pool().map(self.update_channel_psd,
+                                              channels, y_gw_list, data))
+        else:
+            sn = list(map(self.update_channel_psd, channels, y_gw_list, data))
         # It is currently x fs / 2. Should correct for that.
-        
+
         return sn
 
     def update_missing_data(self, y_gw_list):
@@ -814,6 +1014,377 @@ class LogLike(object):
                                 *self.signal_args,
                                 **self.signal_kwargs)
         
+    def split_auxiliary_params(self, par_aux):
+        """
+        Extract frequency-domain data and PSDs from the auxiliary parameters.
+
+        Parameters
+        ----------
+        par_aux :  ndarray
+            Concatenated list of windowed frequency-domain data restricted to
+            the band of interest + PSD values in the same band.
+
+        Returns
+        -------
+        data_dft :  list[ndarray]
+            List of windowed frequency-domain data
+        sn : list of ndarrays
+            list of noise PSDs
+
+        """
+
+        if par_aux is None:
+            return self.data_dft, self.sn
+
+        n_ch = len(self.channels)
+        data_dft = [par_aux[i*self.nf:(i+1)*self.nf] for i in range(n_ch)]
+        sn = [par_aux[i*self.nf:(i+1)*self.nf] for i in range(n_ch, 2*n_ch)]
+
+        return data_dft, sn
+
+    @staticmethod
+    def auxiliary_params_digest(par_aux):
+        """
+        Digest of the full buffer of auxiliary parameters, along with their
+        dtype and shape. It is checked at each likelihood call, including
+        when par_aux is a copy sent to a worker process, so that cached
+        quantities are refreshed whenever any value changes. Its cost is one
+        pass over par_aux.
+
+        Parameters
+        ----------
+        par_aux :  ndarray or None
+            auxiliary parameters
+
+        Returns
+        -------
+        digest : tuple or None
+            dtype, shape and blake2b digest of par_aux
+
+        """
+
+        if par_aux is None:
+            return None
+        buffer = np.ascontiguousarray(par_aux)
+
+        return buffer.dtype.str, buffer.shape, hashlib.blake2b(
+            buffer.view(np.uint8), digest_size=16).digest()
+
+    def set_relative_binning(self, par_ref, n_bins=300, reduced=False,
+                             par_aux=None):
+        """
+        Enable the relative binning (heterodyned) likelihood. The ratio between
+        the waveform and a reference waveform is assumed to be linear in
+        frequency within each bin, so that the likelihood only requires the
+        waveform at the bin edges, and summary data computed once.
+
+        Parameters
+        ----------
+        par_ref : array_like
+            reference waveform parameters (intrinsic parameters only if
+            reduced is True), close to the maximum likelihood
+        n_bins : int
+            number of frequency bins
+        reduced : bool
+            if True, the relative binning is applied to the reduced
+            likelihood, and to each column of the design matrix given by
+            design_func
+        par_aux : ndarray, optional
+            auxiliary parameters used to compute the summary data. If None,
+            the data and PSDs attributes are used.
+
+        """
+
+        if self.gap_convolution:
+            raise ValueError("Relative binning is not compatible with gap "
+                             "convolution.")
+        if reduced & (self.design_func is None):
+            raise ValueError("A design matrix function must be provided for "
+                             "the reduced likelihood with relative binning.")
+
+        freq = self.f[self.inds]
+        self.rb_reduced = reduced
+        self.rb_edges = relative_binning_edges(freq, n_bins)
+        self.rb_mat_ref = self.relative_binning_matrices(par_ref, freq)
+        self.update_relative_binning(par_aux)
+
+    def relative_binning_matrices(self, par, freq):
+        """
+        Compute the waveforms (or design matrices in the reduced case) used by
+        the relative binning, for all channels.
+
+        Returns
+        -------
+        mat_list : list[ndarray]
+            list of matrices of size nf x k, for each channel
+
+        """
+
+        if self.rb_reduced:
+            return self.design_func(par, freq, *self.signal_args,
+                                    **self.signal_kwargs)
+        return [h[:, np.newaxis] for h in self.signal_func(
+            par, freq, *self.signal_args, **self.signal_kwargs)]
+
+    def update_relative_binning(self, par_aux):
+        """
+        Update the relative binning summary data from new auxiliary
+        parameters.
+
+        Parameters
+        ----------
+        par_aux :  ndarray
+            Concatenated list of windowed frequency-domain data restricted to
+            the band of interest + PSD values in the same band.
+
+        """
+
+        data_dft, sn = self.split_auxiliary_params(par_aux)
+        freq = self.f[self.inds]
+        self.rb_summary = [relative_binning_summary(data_dft[i], sn[i],
+                                                    self.rb_mat_ref[i],
+                                                    freq, self.rb_edges)
+                           for i in range(len(self.channels))]
+        self.rb_aux_digest = self.auxiliary_params_digest(par_aux)
+
+    def log_likelihood_relative(self, par, par_aux):
+        """
+        Relative binning approximation of the log-likelihood, or of the
+        reduced log-likelihood.
+
+        Parameters
+        ----------
+        par : array_like
+            vector of waveform parameters (intrinsic parameters if the
+            relative binning is set for the reduced likelihood)
+        par_aux :  ndarray
+            auxiliary parameters. The summary data are updated if they differ
+            from the ones used for the last update.
+
+        Returns
+        -------
+        ll : float
+            log-likelihood
+
+        """
+
+        if self.auxiliary_params_digest(par_aux) != self.rb_aux_digest:
+            self.update_relative_binning(par_aux)
+
+        freq = self.f[self.inds][self.rb_edges]
+        mat_list = self.relative_binning_matrices(par, freq)
+        b_list = []
+        g_list = []
+        for i in range(len(self.channels)):
+            a0, a1, b0, b1 = self.rb_summary[i]
+            mat_ref = self.rb_mat_ref[i][self.rb_edges]
+            r = np.divide(mat_list[i], mat_ref,
+                          out=np.zeros(mat_ref.shape, dtype=np.complex128),
+                          where=mat_ref != 0)
+            r0 = r[0:-1]
+            r1 = (r[1:] - r[0:-1]) / np.diff(freq)[:, np.newaxis]
+            # (M | y) for all columns M
+            b_list.append(np.einsum('bk,bk->k', r0.conj(), a0)
+                          + np.einsum('bk,bk->k', r1.conj(), a1))
+            # (M | M') for all pairs of columns
+            g_list.append(np.einsum('bk,bkl,bl->kl', r0.conj(), b0, r0)
+                          + np.einsum('bk,bkl,bl->kl', r0.conj(), b1, r1)
+                          + np.einsum('bk,bkl,bl->kl', r1.conj(), b1, r0))
+        ll = log_likelihood_from_products(b_list, g_list,
+                                          reduced=self.rb_reduced)
+
+        return 4.0 * self.df * ll + self.ll_norm
+
+    def set_roq(self, roq, par_aux=None):
+        """
+        Enable the reduced-order quadrature likelihood, where the waveforms are
+        only computed at the empirical interpolation nodes.
+
+        Parameters
+        ----------
+        roq : bayesdawn.waveforms.roq.ROQBasis instance
+            reduced-order quadrature rule, built on the frequencies
+            self.f[self.inds]. If roq.reduced is True, it is used for the
+            reduced likelihood and requires design_func.
+        par_aux : ndarray, optional
+            auxiliary parameters used to compute the quadrature weights. If
+            None, the data and PSDs attributes are used.
+
+        """
+
+        if self.gap_convolution:
+            raise ValueError("Reduced-order quadrature is not compatible with "
+                             "gap convolution.")
+        if (roq.freq.shape[0] != self.nf) \
+                or not np.allclose(roq.freq, self.f[self.inds]):
+            raise ValueError("The ROQ basis was built for another frequency "
+                             "grid.")
+        if roq.reduced & (self.design_func is None):
+            raise ValueError("A design matrix function must be provided for "
+                             "the reduced likelihood with ROQ.")
+        self.roq = roq
+        self.update_roq(par_aux)
+
+    def update_roq(self, par_aux):
+        """
+        Update the reduced-order quadrature weights from new auxiliary
+        parameters.
+
+        Parameters
+        ----------
+        par_aux :  ndarray
+            Concatenated list of windowed frequency-domain data restricted to
+            the band of interest + PSD values in the same band.
+
+        """
+
+        data_dft, sn = self.split_auxiliary_params(par_aux)
+        self.roq.compute_weights(data_dft, sn)
+        self.roq_aux_digest = self.auxiliary_params_digest(par_aux)
+
+    def log_likelihood_roq(self, par, par_aux):
+        """
+        Reduced-order quadrature of the log-likelihood, or of the reduced
+        log-likelihood.
+
+        Parameters
+        ----------
+        par : array_like
+            vector of waveform parameters (intrinsic parameters if the
+            quadrature rule is built for the reduced likelihood)
+        par_aux :  ndarray
+            auxiliary parameters. The weights are updated if they differ
+            from the ones used for the last update.
+
+        Returns
+        -------
+        ll : float
+            log-likelihood
+
+        """
+
+        if self.auxiliary_params_digest(par_aux) != self.roq_aux_digest:
+            self.update_roq(par_aux)
+
+        freq = self.f[self.inds][self.roq.nodes]
+        if self.roq.reduced:
+            mat_list = self.design_func(par, freq, *self.signal_args,
+                                        **self.signal_kwargs)
+        else:
+            mat_list = self.signal_func(par, freq, *self.signal_args,
+                                        **self.signal_kwargs)
+        b_list, g_list = self.roq.inner_products(mat_list)
+        ll = log_likelihood_from_products(b_list, g_list,
+                                          reduced=self.roq.reduced)
+
+        return 4.0 * self.df * ll + self.ll_norm
+
+    def update_batch_weights(self, par_aux):
+        """
+        Update the inner product weights used in batched log-likelihood
+        evaluations from new auxiliary parameters.
+
+        Parameters
+        ----------
+        par_aux :  ndarray
+            Concatenated list of windowed frequency-domain data restricted to
+            the band of interest + PSD values in the same band.
+
+        """
+
+        data_dft, sn = self.split_auxiliary_params(par_aux)
+        self.batch_data = np.array(data_dft)
+        # The PSD may be stored as complex in the auxiliary parameters
+        self.batch_weights = 4.0 * self.df / np.real(np.array(sn))
+        self.batch_data_weighted = self.batch_weights * self.batch_data
+        self.batch_aux_digest = self.auxiliary_params_digest(par_aux)
+
+    def log_likelihood_batch(self, pars, par_aux):
+        """
+        Log-likelihood evaluated for several parameter vectors at once. The
+        waveforms are stacked into an array of size n_points x channels x nf,
+        and the inner products of all points are computed in one operation.
+
+        Parameters
+        ----------
+        pars : ndarray
+            array of waveform parameters, size n_points x n_params
+        par_aux :  ndarray
+            Concatenated list of windowed frequency-domain data restricted to
+            the band of interest + PSD values in the same band.
+
+        Returns
+        -------
+        ll : ndarray
+            log-likelihood values, size n_points
+
+        """
+
+        if (self.rb_summary is not None) | (self.roq is not None):
+            return np.array([self.log_likelihood(par, par_aux)
+                             for par in pars])
+
+        if self.auxiliary_params_digest(par_aux) != self.batch_aux_digest:
+            self.update_batch_weights(par_aux)
+
+        n_ch = self.batch_weights.shape[0]
+        if self.gap_convolution:
+            h = np.array([self.apply_gap_convolution(
+                self.compute_signal(par)[0:n_ch]) for par in pars])
+        else:
+            h = np.array([self.compute_signal(par)[0:n_ch] for par in pars])
+        # Channels and frequencies are flattened so that the inner products
+        # of all points are matrix-vector products
+        h = h.reshape((h.shape[0], -1))
+        # (h | y) - 1/2 (h | h)
+        ll = np.real(np.conj(h).dot(self.batch_data_weighted.ravel())) \
+            - 0.5 * (h.real ** 2 + h.imag ** 2).dot(
+                self.batch_weights.ravel())
+
+        return ll + self.ll_norm
+
+    def log_likelihood_reduced_batch(self, pars_intr, par_aux):
+        """
+        Reduced log-likelihood evaluated for several intrinsic parameter
+        vectors at once. If a design matrix function is provided, the
+        amplitudes of all points and channels are estimated in one batched
+        least-squares solve.
+
+        Parameters
+        ----------
+        pars_intr : ndarray
+            array of intrinsic waveform parameters, size n_points x n_params
+        par_aux :  ndarray
+            Concatenated list of windowed frequency-domain data restricted to
+            the band of interest + PSD values in the same band.
+
+        Returns
+        -------
+        ll : ndarray
+            reduced log-likelihood values, size n_points
+
+        """
+
+        if (self.rb_summary is not None) | (self.roq is not None) \
+                | (self.design_func is None) | self.gap_convolution:
+            return np.array([self.log_likelihood_reduced(par, par_aux)
+                             for par in pars_intr])
+
+        if self.auxiliary_params_digest(par_aux) != self.batch_aux_digest:
+            self.update_batch_weights(par_aux)
+
+        n_ch = self.batch_weights.shape[0]
+        freq = self.f[self.inds]
+        mats = np.array([self.design_func(par, freq, *self.signal_args,
+                                          **self.signal_kwargs)[0:n_ch]
+                         for par in pars_intr])
+        # The weights already include the 4 df factor
+        amps, fstat = matrixalgebra.gls_batch(self.batch_data, mats,
+                                              1 / self.batch_weights,
+                                              return_fstat=True)
+
+        return np.sum(fstat, axis=-1) + self.ll_norm
+
     def compute_signal_reduced(self, par_intr, data_dft, sn):
         """
 
@@ -891,7 +1462,18 @@ class LogLike(object):
                 self.model.compute_offline()
 
         # Encapsulate auxiliary parameters lists
-        return np.concatenate(data_dft + sn)
+        par_aux_new = np.concatenate(data_dft + sn)
+        # Refresh relative binning summary data
+        if self.rb_summary is not None:
+            self.update_relative_binning(par_aux_new)
+        # Refresh quadrature weights
+        if self.roq is not None:
+            self.update_roq(par_aux_new)
+        # Refresh batched inner product weights
+        if self.batch_weights is not None:
+            self.update_batch_weights(par_aux_new)
+
+        return par_aux_new
 
     def log_norm(self, data_dft, sn):
         """
@@ -976,6 +1558,12 @@ class LogLike(object):
 
         """
 
+        if (self.rb_summary is not None) & (not self.rb_reduced):
+            return self.log_likelihood_relative(par, par_aux)
+        if self.roq is not None:
+            if not self.roq.reduced:
+                return self.log_likelihood_roq(par, par_aux)
+
         if par_aux is None:
             data_dft = self.data_dft
             sn = self.sn
@@ -1068,9 +1656,17 @@ class LogLike(object):
 
         Returns
         -------
+        ll : float
+            reduced log-likekihood
 
         """
-        
+
+        if (self.rb_summary is not None) & self.rb_reduced:
+            return self.log_likelihood_relative(par_intr, par_aux)
+        if self.roq is not None:
+            if self.roq.reduced:
+                return self.log_likelihood_roq(par_intr, par_aux)
+
         if par_aux is None:
             data_dft = self.data_dft
             sn = self.sn
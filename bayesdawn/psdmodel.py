@@ -3,13 +3,17 @@
 # This code provides routines for PSD estimation using a peace-continuous model
 # that assumes that the logarithm of the PSD is linear per peaces.
 import copy
+import hashlib
 import numpy as np
+from collections import OrderedDict
 # FTT modules
 import pyfftw
 from scipy import interpolate
 from scipy import linalg as la
 from scipy import optimize
-from pyfftw.interfaces.numpy_fft import fft, ifft
+from scipy import special
+from scipy import sparse
+from pyfftw.interfaces.numpy_fft import fft, ifft, irfft
 try:
     import tdi
 except:
@@ -17,6 +21,9 @@ except:
 
 pyfftw.interfaces.cache.enable()
 
+# Spline extrapolation modes
+EXT_MODES = {'extrapolate': 0, 'zeros': 1, 'raise': 2, 'const': 3}
+
 
 # TODO: rewrite spline interpolation with LSQUnivariateSpline from scipy.interpolate
 class MyLSQUnivariateSpline(interpolate.LSQUnivariateSpline):
@@ -32,6 +39,58 @@ class MyLSQUnivariateSpline(interpolate.LSQUnivariateSpline):
         data[9][:n-k-1] = coeffs
         self._data = data
 
+
+class BSplineExt(interpolate.BSpline):
+    """
+    B-spline which behaves outside the base interval [t[k], t[n]] like
+    UnivariateSpline with the same ext argument.
+
+    """
+
+    def __init__(self, t, c, k, ext=0):
+        """
+
+        Parameters
+        ----------
+        t : ndarray
+            knots
+        c : ndarray
+            spline coefficients
+        k : int
+            spline degree
+        ext : int or str
+            extrapolation mode, in {0, 1, 2, 3} or in
+            {'extrapolate', 'zeros', 'raise', 'const'}
+
+        """
+
+        interpolate.BSpline.__init__(self, t, c, k, extrapolate=True)
+        self.ext = EXT_MODES.get(ext, ext)
+
+    def __call__(self, x, nu=0, extrapolate=None):
+
+        x = np.asarray(x)
+        x_min, x_max = self.t[self.k], self.t[-self.k - 1]
+        if self.ext == 3:
+            return interpolate.BSpline.__call__(self, np.clip(x, x_min, x_max),
+                                                nu=nu)
+        out = interpolate.BSpline.__call__(self, x, nu=nu)
+        outside = (x < x_min) | (x > x_max)
+        if self.ext == 1:
+            out = np.where(outside, 0.0, out)
+        elif (self.ext == 2) & np.any(outside):
+            raise ValueError("x value is out of the spline interval.")
+
+        return out
+
+    def get_coeffs(self):
+        """Return spline coefficients."""
+        return self.c
+
+    def get_knots(self):
+        """Return the knots of the spline."""
+        return self.t
+
 # ==============================================================================
 # SPLINES
 # ==============================================================================
@@ -146,37 +205,144 @@ def spline_loglike_hessian(beta, per, A):
     return hessian
 
 
-def newton_raphson(beta_0, grad_func, hess_func, maxiter=1000, tol=1e-4):
+def log_spline_loglike_grad(x, per, a_mat, weights=None):
+    """
+
+    Gradient of the Whittle log-likelihood with a log-PSD model which is
+    linear in its parameters, log S = a_mat x
+
+    Parameters
+    ----------
+    x : array_like
+        vector of log-PSD parameters, or array of size n_chains x n_params
+    per : array_like
+        vector of periodogram (possibly bin-averaged)
+    a_mat : array_like or InterpolationMap instance
+        design matrix, or linear map from parameters to log-PSD values
+    weights : array_like, optional
+        number of frequencies associated with each periodogram value (for
+        bin-averaged periodograms)
+
+
+    Returns
+    -------
+    grad_ll : numpy array
+        gradient of the log-likelihood (along the last axis)
+
+
+    """
+
+    if isinstance(a_mat, InterpolationMap):
+        logs = a_mat(x)
+    else:
+        logs = x.dot(a_mat.T)
+    res = 1 - per * np.exp(-logs)
+    if weights is not None:
+        res = weights * res
+
+    if isinstance(a_mat, InterpolationMap):
+        return - 0.5 * a_mat.rmatvec(res)
+    return - 0.5 * res.dot(a_mat)
+
+
+def newton_raphson(beta_0, grad_func, hess_func, maxiter=1000, tol=1e-4,
+                   func=None, verbose=True):
     """
 
     Newton-Raphson algorithm to compute the maximum likelihood
 
+    Parameters
+    ----------
+    beta_0 : ndarray
+        starting point
+    grad_func : callable
+        gradient of the function to maximize
+    hess_func : callable
+        Hessian of the function to maximize
+    maxiter : int
+        maximum number of iterations
+    tol : float
+        tolerance on the relative change of parameters
+    func : callable, optional
+        function to maximize. If provided, the Newton steps are damped by a
+        backtracking line search ensuring that the function increases.
+    verbose : bool
+        if True, print the convergence criterium and the number of iterations
+
+    Returns
+    -------
+    beta : ndarray
+        maximum found
+
     """
 
     eps = 1.0
     i = 0
     beta_old = beta_0
+    if func is not None:
+        f_old = func(beta_old)
 
     while (i < maxiter) & (eps > tol):
-        beta = beta_old - la.inv(hess_func(beta_old)).dot(grad_func(beta_old))
+        grad = grad_func(beta_old)
+        hess = hess_func(beta_old)
+        try:
+            step = - np.linalg.solve(hess, grad)
+        except np.linalg.LinAlgError:
+            step = - la.lstsq(hess, grad)[0]
+        if func is not None:
+            # Go uphill along the gradient if the Hessian is not negative
+            # definite
+            slope = np.dot(grad, step)
+            if not slope > 0:
+                step = grad
+                slope = np.dot(grad, grad)
+            # Backtracking line search with Armijo condition
+            t = 1.0
+            beta = beta_old + step
+            f_new = func(beta)
+            while (not f_new >= f_old + 1e-4 * t * slope) & (t > 1e-10):
+                t = t / 2
+                beta = beta_old + t * step
+                f_new = func(beta)
+            if not f_new >= f_old:
+                # No increase can be found along the search direction
+                break
+            f_old = f_new
+        else:
+            beta = beta_old + step
         eps = la.norm(beta - beta_old) / la.norm(beta_old)
         beta_old = copy.deepcopy(beta)
         i = i + 1
 
-    print("Criterium at the end: " + str(eps))
-    print("Number of iterations: " + str(i))
+    if verbose:
+        print("Criterium at the end: " + str(eps))
+        print("Number of iterations: " + str(i))
 
-    return beta
+    return beta_old
 
 
-def spline_fisher(a_mat):
+def spline_fisher(a_mat, weights=None):
     """
 
-    Compute the Fisher matrix for the spline PSD model parameters.
+    Compute the Fisher matrix for the spline PSD model parameters. For a
+    log-PSD model which is linear in its parameters, it does not depend on
+    the parameters.
 
+    Parameters
+    ----------
+    a_mat : array_like or InterpolationMap instance
+        design matrix, or linear map from parameters to log-PSD values
+    weights : array_like, optional
+        number of frequencies associated with each periodogram value (for
+        bin-averaged periodograms)
 
     """
 
+    if isinstance(a_mat, InterpolationMap):
+        return 0.5 * a_mat.gram(weights)
+    if weights is not None:
+        return 0.5 * a_mat.conj().T.dot(weights[:, np.newaxis] * a_mat)
+
     return 0.5 * a_mat.conj().T.dot(a_mat)
 
 
@@ -253,10 +419,308 @@ def choose_frequency_knots(n_knots, freq_min=1e-5, freq_max=1.0, base=10):
     return np.unique(np.sort(f_knots))
 
 
+class InterpolationMap(object):
+    """
+    Linear map between the control values of an interpolating function with
+    fixed knots and its values on a fixed grid, equivalent to
+    interpolate.interp1d(x_knots, y, kind=kind, fill_value="extrapolate")(x).
+
+    For linear and cubic interpolation, the map is factorized as a sparse
+    matrix of powers of (x - x_knots[i]) times the dense matrix giving the
+    coefficients of the piecewise polynomials from the control values. For
+    other kinds, the dense map is stored.
+    """
+
+    def __init__(self, x_knots, x, kind='cubic'):
+        """
+
+        Parameters
+        ----------
+        x_knots : ndarray
+            increasing knots of the interpolating function
+        x : ndarray
+            points where the function is evaluated
+        kind : str
+            interpolation kind, see interpolate.interp1d
+
+        """
+
+        self.kind = kind
+        n_knots = len(x_knots)
+        eye = np.eye(n_knots)
+        if kind == 'linear':
+            # Coefficients [slope, intercept] of each segment
+            coeffs = np.array([(eye[1:] - eye[:-1])
+                               / np.diff(x_knots)[:, np.newaxis], eye[:-1]])
+        elif kind == 'cubic':
+            coeffs = interpolate.CubicSpline(x_knots, eye,
+                                             bc_type='not-a-knot').c
+        else:
+            coeffs = None
+            self.mat = interpolate.interp1d(x_knots, eye, kind=kind, axis=0,
+                                            fill_value="extrapolate")(x)
+        if coeffs is not None:
+            order, n_seg = coeffs.shape[0], coeffs.shape[1]
+            # Segment of each point (the end segments are extrapolated)
+            seg = np.clip(np.searchsorted(x_knots, x, side='right') - 1,
+                          0, n_seg - 1)
+            dx = x - x_knots[seg]
+            rows = np.repeat(np.arange(len(x)), order)
+            cols = (np.arange(order)[np.newaxis, :] * n_seg
+                    + seg[:, np.newaxis]).ravel()
+            vals = (dx[:, np.newaxis]
+                    ** np.arange(order - 1, -1, -1)[np.newaxis, :]).ravel()
+            self.basis = sparse.csr_matrix((vals, (rows, cols)),
+                                           shape=(len(x), order * n_seg))
+            self.coeff_map = coeffs.reshape(order * n_seg, n_knots)
+            self.mat = None
+
+    def __call__(self, y):
+        """
+        Evaluate the interpolating function.
+
+        Parameters
+        ----------
+        y : ndarray
+            control values at knots, along the last axis
+
+        Returns
+        -------
+        values : ndarray
+            interpolated values, along the last axis
+
+        """
+
+        if self.mat is not None:
+            return y.dot(self.mat.T)
+
+        return self.basis.dot(y.dot(self.coeff_map.T).T).T
+
+    def rmatvec(self, v):
+        """
+        Apply the transpose of the map.
+
+        Parameters
+        ----------
+        v : ndarray
+            values on the grid, along the last axis
+
+        Returns
+        -------
+        w : ndarray
+            transposed map applied to v, along the last axis (size n_knots)
+
+        """
+
+        if self.mat is not None:
+            return v.dot(self.mat)
+
+        return self.basis.T.dot(v.T).T.dot(self.coeff_map)
+
+    def gram(self, weights=None):
+        """
+        Compute the weighted Gram matrix of the map, M^T W M.
+
+        Parameters
+        ----------
+        weights : ndarray, optional
+            diagonal of W. Default is identity.
+
+        Returns
+        -------
+        gram : ndarray
+            Gram matrix, size n_knots x n_knots
+
+        """
+
+        if self.mat is not None:
+            if weights is None:
+                return self.mat.T.dot(self.mat)
+            return self.mat.T.dot(weights[:, np.newaxis] * self.mat)
+
+        if weights is None:
+            gram = self.basis.T.dot(self.basis)
+        else:
+            gram = self.basis.T.dot(
+                self.basis.multiply(weights[:, np.newaxis]).tocsr())
+
+        return self.coeff_map.T.dot(gram.dot(self.coeff_map))
+
+
+class LogFrequencyBinning(object):
+    """
+    Log-spaced frequency bins used to average periodograms. If the PSD is
+    assumed constant within each bin, the bin average of a periodogram is a
+    sufficient statistic: it follows a scaled chi-square (gamma) distribution
+    whose number of degrees of freedom is known, so that PSD likelihoods and
+    fits can be computed on bins instead of Fourier frequencies.
+    """
+
+    def __init__(self, freq, n_bins=1000, nu=2, f_edges=None):
+        """
+
+        Parameters
+        ----------
+        freq : ndarray
+            positive and increasing frequencies where periodograms are
+            computed
+        n_bins : int
+            number of log-spaced bins between the minimum and maximum
+            frequencies. Empty bins are discarded.
+        nu : int
+            number of degrees of freedom of each periodogram value (2 for the
+            squared modulus of a complex Fourier coefficient)
+        f_edges : ndarray, optional
+            additional bin edges, e.g. spline knots, so that no bin straddles
+            them
+
+        """
+
+        edges = np.logspace(np.log10(freq[0]), np.log10(freq[-1]), n_bins + 1)
+        if f_edges is not None:
+            edges = np.union1d(edges, f_edges[(f_edges > freq[0])
+                                              & (f_edges < freq[-1])])
+        ind = np.clip(np.searchsorted(edges, freq, side='right') - 1,
+                      0, len(edges) - 2)
+        # Discard empty bins
+        bins, self.ind = np.unique(ind, return_inverse=True)
+        self.n_bins = len(bins)
+        self.n_freq = len(freq)
+        # Number of frequencies in each bin
+        self.counts = np.bincount(self.ind).astype(float)
+        # Mean log-frequency of each bin
+        self.logf = self.average(np.log(freq))
+        self.f = np.exp(self.logf)
+        # Degrees of freedom of the bin averages
+        self.dof = nu * self.counts
+        # Mean and variance of log(average / PSD)
+        self.bias = special.digamma(self.dof / 2) - np.log(self.dof / 2)
+        self.var = special.polygamma(1, self.dof / 2)
+
+    def average(self, y):
+        """
+        Average values given at each frequency within each bin.
+
+        Parameters
+        ----------
+        y : ndarray
+            values at the frequencies used to define the bins
+
+        Returns
+        -------
+        y_bar : ndarray
+            bin averages (size n_bins)
+
+        """
+
+        return np.bincount(self.ind, weights=y, minlength=self.n_bins) \
+            / self.counts
+
+    def log_periodogram(self, per):
+        """
+        Unbiased estimate of the log-PSD from a periodogram, in each bin.
+
+        Parameters
+        ----------
+        per : ndarray
+            periodogram at the frequencies used to define the bins
+
+        Returns
+        -------
+        v : ndarray
+            log of the bin-averaged periodogram, corrected from its bias
+
+        """
+
+        return np.log(self.average(per)) - self.bias
+
+    def log_likelihood(self, logs, per_bar):
+        """
+        Whittle log-likelihood of the PSD, assumed to be constant within each
+        bin, as a function of the bin-averaged periodogram.
+
+        Parameters
+        ----------
+        logs : ndarray
+            log-PSD values in each bin, along the last axis
+        per_bar : ndarray
+            bin-averaged periodogram
+
+        Returns
+        -------
+        ll : float or ndarray
+            log-likelihood value(s)
+
+        """
+
+        return np.real(-0.5 * np.sum(self.counts * (logs
+                                                    + per_bar * np.exp(-logs)),
+                                     axis=-1))
+
+
 # =============================================================================
 # General PSD CLASS
 # =============================================================================
-class PSD(object):
+class SpectrumCache(object):
+    """
+    Least-recently-used cache of the spectra computed by a PSD model, along
+    with a version stamp of the model parameters. Any change of parameters
+    must be followed by a call to invalidate.
+    """
+
+    def __init__(self, cache_size=8):
+        """
+
+        Parameters
+        ----------
+        cache_size : int
+            maximum number of grids whose spectra are stored
+        """
+
+        # Version of the PSD parameters
+        self.version = 0
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def invalidate(self):
+        """
+        Increment the parameter version and discard stored spectra.
+        """
+
+        self.version += 1
+        self.cache.clear()
+
+    @staticmethod
+    def cache_key(name, arg):
+        """
+        Key identifying a requested grid: its size if arg is an integer, or a
+        hash of the frequency array.
+        """
+
+        if type(arg) == np.ndarray:
+            return name, arg.shape, hashlib.sha1(
+                np.ascontiguousarray(arg).view(np.uint8)).hexdigest()
+        return name, int(arg)
+
+    def cached(self, key, func, *args):
+        """
+        Return the value stored for key, or compute it as func(*args) and
+        store it. Stored arrays are read-only.
+        """
+
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        value = func(*args)
+        value.setflags(write=False)
+        self.cache[key] = value
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return value
+
+
+class PSD(SpectrumCache):
 
     def __init__(self, n_data, fs, fmin=None, fmax=None):
         """Instantiate the PSD estimator class.
@@ -291,6 +755,8 @@ class PSD(object):
 
         # Flexible interpolation of the estimated PSD
         self.log_psd_fn = None
+        # Spectra already computed for the current parameters
+        SpectrumCache.__init__(self)
 
     def periodogram(self, y_fft, k2=None):
         """
@@ -358,40 +824,30 @@ class PSD(object):
         spectr_sym : ndarray
             one-sided power spectral density expressed in [Units / Hz]
             WE DROPPEP THE FACTOR OF fs / 2!
+            The array is read-only, as it is cached until the PSD parameters
+            change.
 
         """
 
+        if (type(arg) == np.int) | (type(arg) == np.int64) | (
+                type(arg) == np.ndarray):
+            return self.cached(self.cache_key('psd', arg),
+                               self.compute_spectrum, arg)
+        else:
+            raise TypeError("Argument must be integer or ndarray")
+
+    def compute_spectrum(self, arg):
+        """
+        Evaluate the PSD model, see calculate.
+        """
+
         if (type(arg) == np.int) | (type(arg) == np.int64):
             n_data = arg
-            # Symmetrize the estimates
-            if n_data % 2 == 0:  # if n_data is even
-                # Compute PSD from f=0 to f = fs/2
-                if n_data == self.n_data:
-                    n = self.n
-                    f_tot = np.abs(np.concatenate(([self.f[1]],
-                                                   self.f[1:n + 2])))
-                else:
-                    f = np.fft.fftfreq(n_data) * self.fs
-                    n = np.int((n_data - 1) / 2.)
-                    f_tot = np.abs(np.concatenate(([f[1]], f[1:n + 2])))
-
-                spectr = self.psd_fn(f_tot)
-                spectr_sym = np.concatenate((spectr[0:n + 1],
-                                             spectr[1:n + 2][::-1]))
-
-            else:  # if n_data is odd
-                if n_data == self.n_data:
-                    n = self.n
-                    f_tot = np.abs(np.concatenate(([self.f[1]],
-                                                   self.f[1:n + 1])))
-                else:
-                    f = np.fft.fftfreq(n_data) * self.fs
-                    n = np.int((n_data - 1) / 2.)
-                    f_tot = np.abs(np.concatenate(([f[1]], f[1:n + 1])))
-
-                spectr = self.psd_fn(f_tot)
-                spectr_sym = np.concatenate((spectr[0:n + 1],
-                                             spectr[1:n + 1][::-1]))
+            # Symmetrize the estimates computed from f=0 to f = fs/2
+            n = np.int((n_data - 1) / 2.)
+            spectr = self.calculate_onesided(n_data)
+            spectr_sym = np.concatenate((spectr[0:n + 1],
+                                         spectr[1:n_data - n][::-1]))
 
         elif type(arg) == np.ndarray:
 
@@ -404,13 +860,55 @@ class PSD(object):
 
         return spectr_sym
 
+    def calculate_onesided(self, n_data):
+        """
+
+        Calculate the power spectral density on the non-negative frequencies of
+        the Fourier grid of size n_data, i.e. the half-spectrum layout used by
+        real FFTs. The value at zero frequency is set to the value at the first
+        non-zero frequency.
+
+        Parameters
+        ----------
+        n_data : int
+            size of the Fourier grid
+
+        Returns
+        -------
+        spectr : ndarray
+            one-sided power spectral density expressed in [Units / Hz] at
+            frequencies rfftfreq(n_data) * fs (size n_data // 2 + 1). The
+            array is read-only, as it is cached until the PSD parameters
+            change.
+
+        """
+
+        return self.cached(self.cache_key('psd_onesided', n_data),
+                           self.compute_onesided, n_data)
+
+    def compute_onesided(self, n_data):
+        """
+        Evaluate the PSD model on non-negative frequencies, see
+        calculate_onesided.
+        """
+
+        f = np.fft.rfftfreq(n_data) * self.fs
+        f[0] = f[1]
+
+        return self.psd_fn(f)
+
     def calculate_autocorr(self, N):
         """
-        Compute the autocovariance function from the PSD.
+        Compute the autocovariance function from the PSD, using a real inverse
+        FFT of the one-sided spectrum computed on a grid of size 2N. The output
+        array is read-only, as it is cached until the PSD parameters change.
 
         """
 
-        return np.real(ifft(self.calculate(2 * N))[0:N]) * self.fs / 2
+        return self.cached(
+            self.cache_key('autocorr', N),
+            lambda: irfft(self.calculate_onesided(2 * N), 2 * N)[0:N]
+            * self.fs / 2)
 
 
 # ==============================================================================
@@ -419,7 +917,7 @@ class PSD(object):
 class PSDSpline(PSD):
 
     def __init__(self, n_data, fs, n_knots=30, d=3,
-                 fmin=None, fmax=None, f_knots=None, ext=3):
+                 fmin=None, fmax=None, f_knots=None, ext=3, n_bins=None):
         """
 
         Parameters
@@ -446,6 +944,10 @@ class PSDSpline(PSD):
                 if ext=2 or ‘raise’, raise a ValueError
                 if ext=3 of ‘const’, return the boundary value
             The default value is 3.
+        n_bins : int or None
+            if not None, the periodogram is averaged in n_bins log-spaced
+            frequency bins before fitting the log-PSD model, with weights
+            accounting for the number of frequencies in each bin.
         """
 
         PSD.__init__(self, n_data, fs, fmin=fmin, fmax=fmax)
@@ -469,6 +971,10 @@ class PSDSpline(PSD):
         self.logf_knots = np.log(self.f_knots)
         # Spline order
         self.D = d
+        # B-spline design matrices, for each frequency grid
+        self.designs = {}
+        # Number of log-frequency bins
+        self.n_bins = n_bins
         self.C0 = -0.57721
         # Spline coefficient vector
         self.beta = []
@@ -481,7 +987,7 @@ class PSDSpline(PSD):
         # Spline extension
         self.ext = ext
         # Variance function values at control frequencies
-        self.varlogsc = np.pi**3 / 6 * np.ones(self.n_knots + 1)
+        self.varlogsc = np.pi**3 / 6 * np.ones(len(self.logfc))
         # self.varlogsc = np.array(
         #     [3.60807571e-01, 8.90158814e-02, 1.45631966e-02, 3.55646693e-03,
         #      1.09926717e-03, 4.15894275e-04, 1.86984136e-04, 9.73883423e-05,
@@ -500,6 +1006,8 @@ class PSDSpline(PSD):
 
     def set_knots(self, f_knots):
 
+        self.invalidate()
+        self.designs = {}
         self.f_knots = f_knots
         self.logf_knots = np.log(self.f_knots)
         self.logfc = np.concatenate(
@@ -541,7 +1049,7 @@ class PSDSpline(PSD):
         knots).
         """
         
-        return self.log_psd_fn.get_coeffs()
+        return self.log_psd_fn.c
         
     def estimate(self, y, wind='hanning'):
         """
@@ -594,17 +1102,18 @@ class PSDSpline(PSD):
 
         """
 
+        self.invalidate()
         # If there is only one periodogram
         if type(per) == np.ndarray:
             self.log_psd_fn = self.spline_lsqr(per)
-            self.beta = self.log_psd_fn.get_coeffs()
+            self.beta = self.log_psd_fn.c
         elif type(per) == list:
             # If there are several periodograms, average the estimates
             spl_list = [self.spline_lsqr(I0) for I0 in per if
                         self.fs / len(I0) < self.f_knots[0]]
-            self.beta = sum([spl.get_coeffs() for spl in spl_list]) / len(per)
-            self.log_psd_fn = interpolate.BSpline(spl_list[0].get_knots(),
-                                                  self.beta, self.D)
+            self.beta = sum([spl.c for spl in spl_list]) / len(per)
+            self.log_psd_fn = BSplineExt(spl_list[0].t, self.beta, self.D,
+                                         ext=self.ext)
 
         # Estimate psd at positive Fourier log-frequencies
         self.logs = self.log_psd_fn(self.logf[self.n_data])
@@ -617,53 +1126,124 @@ class PSDSpline(PSD):
         # self.varlogsc = self.logvar_fn(self.logfc)
         self.logsc = self.log_psd_fn(self.logfc)
 
+    def spline_design(self, logf, inds):
+        """
+
+        Compute the B-spline basis of the log-PSD model on a fixed grid of
+        log-frequencies, along with the banded Cholesky factorization of the
+        corresponding normal matrix. If n_bins is not None, the basis is
+        computed at the log-frequency bins, whose edges subdivide each knot
+        interval. Knots outside the range of logf are discarded.
+
+        Parameters
+        ----------
+        logf : ndarray
+            increasing log-frequencies where the log-periodogram is fitted
+        inds : ndarray
+            indices of these frequencies in the periodogram
+
+        Returns
+        -------
+        design : dict
+            't': full knot vector, 'basis': sparse B-spline design matrix,
+            'cho': Cholesky factor of the normal matrix in lower band storage,
+            'inds': periodogram indices, 'binning': LogFrequencyBinning
+            instance or None, 'w': least-squares weights or None
+
+        """
+
+        # Interior knots must lie strictly within the fitted frequency range
+        logf_knots = self.logf_knots[(self.logf_knots > logf[0])
+                                     & (self.logf_knots < logf[-1])]
+        k = self.D
+        # Boundary knots are taken on the frequency grid, which contains the
+        # bin centers
+        t = np.concatenate(([logf[0]] * (k + 1), logf_knots,
+                            [logf[-1]] * (k + 1)))
+        if self.n_bins is None:
+            binning = None
+            x = logf
+        else:
+            # Each knot interval is split in k + 1 bins at least, so that
+            # all B-splines are determined by the binned data
+            t_int = t[k:t.shape[0] - k]
+            logf_edges = (t_int[:-1, np.newaxis] + np.diff(t_int)[:, np.newaxis]
+                          * np.arange(k + 2)[np.newaxis, :] / (k + 1))
+            binning = LogFrequencyBinning(np.exp(logf), n_bins=self.n_bins,
+                                          f_edges=np.exp(logf_edges.ravel()))
+            x = binning.logf
+        basis = interpolate.BSpline.design_matrix(x, t, k).tocsr()
+        if binning is None:
+            w = None
+            gram = basis.T.dot(basis)
+        else:
+            # Weights are the inverse variances of the binned log-periodogram
+            w = 1 / binning.var
+            gram = basis.T.dot(basis.multiply(w[:, np.newaxis]).tocsr())
+        # The normal matrix has k sub-diagonals
+        ab = np.zeros((k + 1, gram.shape[0]))
+        for d in range(k + 1):
+            ab[d, 0:gram.shape[0] - d] = gram.diagonal(-d)
+
+        return {'t': t, 'basis': basis, 'inds': inds, 'binning': binning,
+                'w': w, 'cho': la.cholesky_banded(ab, lower=True)}
+
     def spline_lsqr(self, per, freq=None):
         """
 
-        Fit a spline to the log periodogram using least-squares
+        Fit a spline to the log periodogram using least-squares. The B-spline
+        design matrix is computed once for each frequency grid.
 
         Parameters
         ----------
         per : ndarray
             periodogram
-        freq :
+        freq : ndarray, optional
+            frequencies where the periodogram is computed. If None, per is
+            assumed to be computed on the Fourier grid of size len(per).
 
+        Returns
+        -------
+        spl : interpolate.UnivariateSpline instance
+            spline estimator of the log-PSD, function of the log-frequency
 
         """
 
         if freq is None:
             # If the frequencies where per is computed are not given
             NI = len(per)
-            if NI not in list(self.logf.keys()):
-                f = np.fft.fftfreq(NI) * self.fs
-                self.logf[NI] = np.log(f[f > 0])
-            else:
-                f = np.concatenate(([0], np.exp(self.logf[NI])))
-
-            n = np.int((NI - 1) / 2.)
-            z = per[1:n + 1]
-            v = np.log(z) - self.C0
-
-            # Spline estimator of the log-PSD
-            inds_est = np.where((self.f_min_est <= f[1:self.n + 1]) & (
-                        f[1:self.n + 1] <= self.f_max_est))[0]
-            spl = interpolate.LSQUnivariateSpline(self.logf[NI][inds_est],
-                                                  v[inds_est],
-                                                  self.logf_knots,
-                                                  k=self.D,
-                                                  ext=self.ext)
+            if NI not in self.designs:
+                if NI not in list(self.logf.keys()):
+                    f = np.fft.fftfreq(NI) * self.fs
+                    self.logf[NI] = np.log(f[f > 0])
+                else:
+                    f = np.concatenate(([0], np.exp(self.logf[NI])))
+                # Spline estimator of the log-PSD
+                inds_est = np.where((self.f_min_est <= f[1:self.n + 1]) & (
+                            f[1:self.n + 1] <= self.f_max_est))[0]
+                self.designs[NI] = self.spline_design(self.logf[NI][inds_est],
+                                                      inds_est + 1)
+            design = self.designs[NI]
 
         else:
             # If the frequencies are given
-            v = np.log(per) - self.C0
-            # Spline estimator of the log-PSD
-            inds_est = np.where((self.f_min_est <= freq)
-                                & (freq <= self.f_max_est))[0]
-            spl = interpolate.LSQUnivariateSpline(np.log(freq)[inds_est],
-                                                  v[inds_est],
-                                                  self.logf_knots,
-                                                  k=self.D,
-                                                  ext=self.ext)
+            key = SpectrumCache.cache_key('design', freq)
+            if key not in self.designs:
+                inds_est = np.where((self.f_min_est <= freq)
+                                    & (freq <= self.f_max_est))[0]
+                self.designs[key] = self.spline_design(np.log(freq[inds_est]),
+                                                       inds_est)
+            design = self.designs[key]
+
+        # Least-squares fit of the log-periodogram
+        if design['binning'] is None:
+            v = np.log(per[design['inds']]) - self.C0
+            rhs = design['basis'].T.dot(v)
+        else:
+            v = design['binning'].log_periodogram(per[design['inds']])
+            rhs = design['basis'].T.dot(design['w'] * v)
+        coeffs = la.cho_solve_banded((design['cho'], True), rhs)
+        spl = BSplineExt(design['t'], coeffs, self.D, ext=self.ext)
 
         return spl
 
@@ -671,7 +1251,7 @@ class PSDSpline(PSD):
 # ==============================================================================
 # Spline PSD model
 # ==============================================================================
-class PSDEstimator(object):
+class PSDEstimator(SpectrumCache):
 
     def __init__(self, f_knots, d=3, ext=3, cross=False):
         """
@@ -725,6 +1305,8 @@ class PSDEstimator(object):
         # Function of the log-frequency that outputs the log-PSD
         self.log_psd_fn = None
         self.psd_fn = None
+        # Spectra already computed for the current parameters
+        SpectrumCache.__init__(self)
         
     def estimate(self, freq, per):
         """
@@ -741,6 +1323,7 @@ class PSDEstimator(object):
             if True, per is assumed to be a complex cross-periodogram. 
             Thus, its phase is estimated along with its amplitude. 
         """
+        self.invalidate()
         if not self.cross:
             # If the frequencies are given
             v = np.log(per.real) - self.c0
@@ -805,9 +1388,20 @@ class PSDEstimator(object):
         Returns
         -------
         psd : ndarray
-            PSD values
+            PSD values (read-only array, cached until the parameters change)
             
         """
+
+        if type(x) != np.ndarray:
+            return self.compute_spectrum(x)
+
+        return self.cached(self.cache_key('psd', x), self.compute_spectrum, x)
+
+    def compute_spectrum(self, x):
+        """
+        Evaluate the PSD model, see calculate.
+        """
+
         if not self.cross:    
             return np.exp(self.log_psd_fn(np.log(x)))
         else:
@@ -826,6 +1420,7 @@ class PSDEstimator(object):
             the knot frequencies 
         """
         
+        self.invalidate()
         if not self.cross:
             # self.log_psd_fn.set_coeffs(x)
             self.log_psd_fn = interpolate.interp1d(self.logf_knots, x, 
@@ -857,7 +1452,7 @@ class PSDEstimator(object):
             # Update the log-PSD function of the log-frequency
             self.psd_fn = lambda x: s_real_func(x) + 1j * s_imag_func(x)   
     
-    def likelihood(self, x, logfr, per):
+    def likelihood(self, x, logfr, per, binning=None):
         """
 
         Compute log-likelihood for the PSD update
@@ -870,6 +1465,9 @@ class PSDEstimator(object):
             logarithm of frequency vector
         per : array_like
             periodogram computed at frequencies fr
+        binning : LogFrequencyBinning instance or None
+            if provided, logfr and per are the log-frequencies and the
+            bin-averaged periodogram of these bins
             
         Returns
         -------
@@ -881,8 +1479,11 @@ class PSDEstimator(object):
         # Update log PSD function with new parameters
         self.set_params(x)
         
+        # If the periodogram is averaged in frequency bins
+        if binning is not None:
+            ll = binning.log_likelihood(self.log_psd_fn(logfr), per)
         # If only one segment of data is analyzed
-        if type(per) == np.ndarray:
+        elif type(per) == np.ndarray:
             logs = self.log_psd_fn(logfr)
             ll = np.real(-0.5*np.sum(logs + per * np.exp(-logs)))
             
@@ -904,13 +1505,14 @@ class PSDEstimator(object):
 
         return -0.5 * np.sum(np.abs(x - self.logs_knots)**2 / (2*self.varlogsc))
 
-    def posterior(self, x_psd, logfr, per):
+    def posterior(self, x_psd, logfr, per, binning=None):
         """
         Compute the log-posterior probability density for the PSD parameters
 
         """
 
-        return self.likelihood(x_psd, logfr, per) + self.prior(x_psd)
+        return self.likelihood(x_psd, logfr, per,
+                               binning=binning) + self.prior(x_psd)
 
 
 # =============================================================================
@@ -1059,6 +1661,7 @@ class PSDPowerLaw(PSD):
 
         """
 
+        self.invalidate()
         # If there is only one periodogram
         if type(per) == np.ndarray:
             self.beta = self.fit_lsqr(per)
@@ -11,11 +11,13 @@ import numpy as np
 from bayesdawn import psdmodel
 from bayesdawn import samplers
 from scipy import interpolate
+from scipy import linalg as la
 
 
-class PSDSampler(psdmodel.PSDSpline, samplers.MHSampler):
+class PSDSampler(psdmodel.PSDSpline):
     
-    def __init__(self, n_eff, fs, n_knots=30, d=3, fmin=None, fmax=None):
+    def __init__(self, n_eff, fs, n_knots=30, d=3, fmin=None, fmax=None,
+                 n_bins=None, n_chains=8):
         """[summary]
 
         Parameters
@@ -32,15 +34,38 @@ class PSDSampler(psdmodel.PSDSpline, samplers.MHSampler):
             Minimum frequency where the data is analysed, by default None
         fmax : float, optional
             Maximum frequency where the data is analysed, by default None
+        n_bins : int, optional
+            if given, the likelihood is computed from the periodogram averaged
+            in n_bins log-spaced frequency bins, by default None
+        n_chains : int, optional
+            number of Markov chains run in parallel by the adaptive
+            Metropolis sampler, by default 8
         """
 
         psdmodel.PSDSpline.__init__(self, n_eff, fs, n_knots=n_knots, d=d, 
-                                    fmin=fmin, fmax=fmax)
+                                    fmin=fmin, fmax=fmax, n_bins=n_bins)
         
         # Periodogram of the residuals is an attribute
         self.I = []
+        # Log-frequency bins of positive Fourier frequencies
+        if n_bins is not None:
+            self.binning = psdmodel.LogFrequencyBinning(
+                self.f[1:self.n + 1], n_bins=n_bins)
+        else:
+            self.binning = None
+        # Bin-averaged periodogram
+        self.I_bar = []
+        # Interpolation maps from control values to log-PSD values, for each
+        # data length
+        self.interp_maps = {}
         # Initialize the sampler
-        samplers.MHSampler.__init__(self, n_knots + 1, self.psd_posterior)
+        self.n_chains = n_chains
+        self.sampler = samplers.AdaptiveMetropolis(len(self.logfc),
+                                                   self.psd_posterior,
+                                                   n_chains=n_chains,
+                                                   vectorized=True)
+        # Last maximum a posteriori, used as a starting point for the next one
+        self.x_map = None
 
     def set_periodogram(self, z_fft, K2=None):
         """
@@ -58,9 +83,51 @@ class PSDSampler(psdmodel.PSDSpline, samplers.MHSampler):
         """
         if type(z_fft) == np.ndarray :
             self.I = self.periodogram(z_fft, k2= K2)
+            if self.binning is not None:
+                self.I_bar = self.binning.average(self.I[1:self.n+1])
         elif type(z_fft) == list:
             self.I = [self.periodogram(zf, k2= K2) for zf in z_fft]
 
+    def set_knots(self, f_knots):
+
+        psdmodel.PSDSpline.set_knots(self, f_knots)
+        self.interp_maps = {}
+        self.sampler = samplers.AdaptiveMetropolis(len(self.logfc),
+                                                   self.psd_posterior,
+                                                   n_chains=self.n_chains,
+                                                   vectorized=True)
+
+    def interpolation_map(self, key):
+        """
+        Linear map from the log-PSD values at control frequencies to the
+        log-PSD at positive Fourier frequencies. It is computed once for each
+        data length, and recomputed when the knots change.
+
+        Parameters
+        ----------
+        key : int or str
+            data length, or 'bins' for the log-frequency bins
+
+        Returns
+        -------
+        interp_map : psdmodel.InterpolationMap instance
+            the interpolation map
+
+        """
+
+        if key not in self.interp_maps:
+            if key == 'bins':
+                logf = self.binning.logf
+            else:
+                if key not in self.logf:
+                    f = np.fft.fftfreq(key) * self.fs
+                    self.logf[key] = np.log(f[f > 0])
+                logf = self.logf[key]
+            self.interp_maps[key] = psdmodel.InterpolationMap(self.logfc, logf,
+                                                              kind='cubic')
+
+        return self.interp_maps[key]
+
     def psd_likelihood(self, x):
         """
 
@@ -69,37 +136,118 @@ class PSDSampler(psdmodel.PSDSpline, samplers.MHSampler):
         Parameters
         ----------
         x: array_like
-            vector of log-PSD values at specific frequencies
+            vector of log-PSD values at specific frequencies, or array of
+            size n_chains x n_params for several parameter vectors at once
             
         Returns
         -------
-        ll : scalar float
-            value of the log-likelihood
+        ll : scalar float or ndarray
+            value of the log-likelihood (of size n_chains if x is 2D)
 
         """
 
-        logSfunc = interpolate.interp1d(self.logfc, x, kind='cubic', 
-                                        fill_value="extrapolate")
-        
+        # If the periodogram is averaged in frequency bins
+        if (self.binning is not None) & (type(self.I) == np.ndarray):
+            ll = self.binning.log_likelihood(self.interpolation_map('bins')(x),
+                                             self.I_bar)
+
         # If only one segment of data is analyzed
-        if type(self.I) == np.ndarray:
-            logS = logSfunc(self.logf[self.n_data])
+        elif type(self.I) == np.ndarray:
+            logS = self.interpolation_map(self.n_data)(x)
             I_weighted = self.I[1:self.n+1] * np.exp( - logS )
-            ll = np.real( -0.5*np.sum( logS + I_weighted ) )
+            ll = np.real( -0.5*np.sum( logS + I_weighted, axis=-1 ) )
             
         # If several segments of different lengths are considered:
         elif type(self.I) == list:
-            Nsegs = list(self.logf.keys())
+            Nsegs = [len(I0) for I0 in self.I]
             Ls = len(Nsegs)
-            logS_list = [logSfunc(self.logf[self.NI]) for NI in Nsegs]
+            logS_list = [self.interpolation_map(NI)(x) for NI in Nsegs]
             
             I_weighted_list = [self.I[j][1:np.int((Nsegs[j]-1)/2)+1] * np.exp( - logS_list[j] ) \
                           for j in range(Ls)]
             
-            ll = sum([np.real( -0.5*np.sum( logS_list[j] + I_weighted_list[j] ) ) for j in range(Ls)])
+            ll = sum([np.real( -0.5*np.sum( logS_list[j] + I_weighted_list[j], axis=-1 ) ) for j in range(Ls)])
 
         return ll
 
+    def likelihood_terms(self):
+        """
+        Periodogram values entering the PSD likelihood, with the corresponding
+        interpolation maps from the control values.
+
+        Returns
+        -------
+        terms : list of tuples
+            (interp_map, per, weights) for each analyzed periodogram, where
+            weights are the number of frequencies in each bin (None if the
+            periodogram is not binned)
+
+        """
+
+        if (self.binning is not None) & (type(self.I) == np.ndarray):
+            return [(self.interpolation_map('bins'), self.I_bar,
+                     self.binning.counts)]
+        elif type(self.I) == np.ndarray:
+            return [(self.interpolation_map(self.n_data), self.I[1:self.n+1],
+                     None)]
+        elif type(self.I) == list:
+            return [(self.interpolation_map(len(I0)),
+                     I0[1:np.int((len(I0)-1)/2)+1], None) for I0 in self.I]
+
+    def psd_likelihood_grad(self, x):
+        """
+
+        Compute the gradient of the log-likelihood for the PSD update
+
+        Parameters
+        ----------
+        x: array_like
+            vector of log-PSD values at specific frequencies, or array of
+            size n_chains x n_params for several parameter vectors at once
+
+        Returns
+        -------
+        grad_ll : ndarray
+            gradient of the log-likelihood, of the same size as x
+
+        """
+
+        return sum([psdmodel.log_spline_loglike_grad(x, per, interp_map,
+                                                     weights=weights)
+                    for interp_map, per, weights in self.likelihood_terms()])
+
+    def psd_fisher(self, x=None):
+        """
+
+        Compute the Fisher information matrix of the PSD parameters, including
+        the prior contribution. As the log-PSD is linear in the control
+        values, the expected information does not depend on them.
+
+        Parameters
+        ----------
+        x : ndarray, optional
+            if provided, the observed information (minus the Hessian of the
+            log-posterior) at x is computed instead
+
+        Returns
+        -------
+        fisher : ndarray
+            Fisher matrix, size n_params x n_params
+
+        """
+
+        fisher = np.diag(1 / (2 * self.varlogsc))
+        for interp_map, per, weights in self.likelihood_terms():
+            if x is not None:
+                w = per * np.exp(-interp_map(x))
+                if weights is not None:
+                    w = weights * w
+            else:
+                w = weights
+            fisher = fisher + psdmodel.spline_fisher(interp_map, weights=w)
+
+        return fisher
+
     def psd_prior(self, x):
         """
 
@@ -107,7 +255,7 @@ class PSDSampler(psdmodel.PSDSpline, samplers.MHSampler):
 
         """
 
-        return -0.5 * np.sum((x - self.logSc)**2 / (2*self.varlogSc))
+        return -0.5 * np.sum((x - self.logsc)**2 / (2*self.varlogsc), axis=-1)
 
     def psd_posterior(self, x_psd):
         """
@@ -117,47 +265,150 @@ class PSDSampler(psdmodel.PSDSpline, samplers.MHSampler):
 
         return self.psd_likelihood(x_psd) + self.psd_prior(x_psd)
 
-    def update_psd_func(self, logSc, kind='cubic'):
+    def psd_posterior_grad(self, x_psd):
+        """
+        Compute the gradient of the log-posterior probability density for the
+        PSD parameters
+
+        """
+
+        return self.psd_likelihood_grad(x_psd) \
+            - (x_psd - self.logsc) / (2 * self.varlogsc)
+
+    def psd_map(self, x0=None, maxiter=100, tol=1e-6, verbose=False):
+        """
+        Compute the maximum a posteriori of the PSD parameters by
+        Newton-Raphson iterations. The steps are damped by a backtracking line
+        search on the log-posterior, since full Newton steps can overshoot
+        where the periodogram is far from the current PSD.
+
+        Parameters
+        ----------
+        x0 : ndarray, optional
+            starting point. Default is the current log-PSD control values.
+        maxiter : int
+            maximum number of iterations
+        tol : float
+            tolerance on the relative change of parameters
+        verbose : bool
+            if True, print the convergence status
+
+        Returns
+        -------
+        x_map : ndarray
+            maximum a posteriori estimate
+        fisher : ndarray
+            observed information at the maximum
+
+        """
+
+        if x0 is None:
+            x0 = np.copy(self.logsc)
+        x_map = psdmodel.newton_raphson(x0, self.psd_posterior_grad,
+                                        lambda x: - self.psd_fisher(x),
+                                        maxiter=maxiter, tol=tol,
+                                        func=self.psd_posterior,
+                                        verbose=verbose)
+
+        return x_map, self.psd_fisher(x_map)
+
+    def update_psd_func(self, logsc, kind='cubic'):
         """
 
         Update the interpolating function of the PSD with new control
         values logS
 
         """
+        self.invalidate()
         # Update PSD interpolation function
-        self.logPSD_fn = interpolate.interp1d(self.logfc, logSc, kind=kind, 
-                                              fill_value="extrapolate")
+        self.log_psd_fn = interpolate.interp1d(self.logfc, logsc, kind=kind, 
+                                               fill_value="extrapolate")
         self.S = self.calculate(self.n_data)
 
-    def sample_psd(self, nit, verbose=True, cov_update=1000):
+    def sample_psd(self, nit, verbose=True, cov_update=1000,
+                   method='metropolis'):
         """
-        Update PSD parameters 
+        Update PSD parameters by running n_chains chains in parallel. Chains
+        start from the current log-PSD control values at the first call, and
+        continue from their last state afterwards. Within a Gibbs sampler,
+        the first chain provides the conditional PSD draws: its last state
+        is the new PSD value. The other chains can be used for convergence
+        diagnostics; set n_chains=1 to avoid their cost.
         
         Parameters
         ----------
-        noise_params : array_like
-            noise parameters
-        residual_fft : array_like of size n_data
-            discrete Fourier transform of the model residuals
-        wd : array_like of size n_data
-            apodization window (optional)
+        nit : int
+            number of steps of each chain
+        verbose : bool
+            if True, print the acceptance rate every 100 steps
+        cov_update : int
+            number of samples drawn before the proposal covariance starts
+            being adapted (metropolis method only)
+        method : {'metropolis', 'mala', 'laplace'}
+            'metropolis': adaptive Metropolis, initialized with the inverse
+            Fisher matrix as proposal covariance.
+            'mala': Metropolis-adjusted Langevin algorithm preconditioned by
+            the inverse Fisher matrix.
+            'laplace': independence sampler whose proposal is the Gaussian
+            approximation of the posterior around its maximum. If this
+            approximation cannot be computed, the 'metropolis' method is used
+            instead.
             
         Returns
         -------
-        noise_params_new : array_like
-            updated PSD parameters
-            
+        psd_samples : ndarray
+            samples of log-PSD control values, size nit x n_chains x n_params
+        logpvalues : ndarray
+            corresponding log-posterior values, size nit x n_chains
             
         """
 
-        # Update likelihood
-        self.logp_tilde = self.psd_posterior
-        # update PSD parameters by MH steps
-        psd_samples, logpvalues = self.run_mcmc(np.copy(self.logSc), 
-                                                self.varlogSc/(self.J+1), 
-                                                nit,
-                                                verbose=verbose,
-                                                cov_update=cov_update)
+        if method not in ['metropolis', 'mala', 'laplace']:
+            raise ValueError("Unknown PSD sampling method: " + str(method))
+        self.sampler.n_adapt = cov_update
+        x0 = None
+        cov0 = None
+        if self.sampler.x is None:
+            x0 = np.copy(self.logsc)
+        if (method == 'metropolis') & (self.sampler.l_cov is None):
+            cov0 = self.sampler.s_d * la.inv(self.psd_fisher())
+            if x0 is None:
+                x0 = self.sampler.x
+
+        if method == 'metropolis':
+            # update PSD parameters by MH steps
+            psd_samples, logpvalues = self.sampler.run(nit, x0=x0, cov0=cov0,
+                                                       verbose=verbose)
+        else:
+            if x0 is None:
+                x0 = self.sampler.x
+            if method == 'mala':
+                sampler = samplers.PreconditionedMALA(
+                    len(self.logfc), self.psd_posterior,
+                    self.psd_posterior_grad, la.inv(self.psd_fisher()),
+                    n_chains=self.n_chains, vectorized=True)
+            elif method == 'laplace':
+                try:
+                    x_map, fisher = self.psd_map(x0=self.x_map,
+                                                 verbose=verbose)
+                    cov = la.inv(fisher)
+                    # Check that the covariance is positive definite
+                    la.cholesky(cov)
+                except (la.LinAlgError, ValueError):
+                    print("Laplace approximation failed, "
+                          "switching to Metropolis steps.")
+                    self.x_map = None
+                    return self.sample_psd(nit, verbose=verbose,
+                                           cov_update=cov_update,
+                                           method='metropolis')
+                self.x_map = x_map
+                sampler = samplers.IndependenceMetropolis(
+                    len(self.logfc), self.psd_posterior, x_map, cov,
+                    n_chains=self.n_chains, vectorized=True)
+            psd_samples, logpvalues = sampler.run(nit, x0=x0,
+                                                  verbose=verbose)
+            # Share the state of the chains with the adaptive sampler
+            self.sampler.x = sampler.x
 
         return psd_samples, logpvalues
 
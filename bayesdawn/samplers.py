@@ -4,6 +4,7 @@
 
 import numpy as np
 from scipy import linalg as linalg
+import numba as nb
 import copy
 from functools import reduce
 import ptemcee
@@ -285,20 +286,526 @@ class MHSampler(object):
                 if (s%cov_update == 0):
                     # Compute empirical covariance according to Haario optimal 
                     # formula:
-                    self.set_cov( np.cov(self.x_samples[0:s+1,:].T)*2.38**2/self.N_params)
+                    self.set_cov( np.cov(x_samples[0:s+1,:].T)*2.38**2/self.N_params)
 
         return x_samples, logp_samples
 
 
+@nb.njit(cache=True)
+def cholupdate(l_mat, v):
+    """
+    Rank-one update of a lower Cholesky factor, in place: on output,
+    l_mat l_mat^T is equal to the input l_mat l_mat^T + v v^T.
+
+    Parameters
+    ----------
+    l_mat : ndarray
+        lower triangular Cholesky factor, size d x d
+    v : ndarray
+        update vector of size d (overwritten)
+
+    """
+
+    d = v.shape[0]
+    for k in range(d):
+        r = np.sqrt(l_mat[k, k] ** 2 + v[k] ** 2)
+        c = r / l_mat[k, k]
+        s = v[k] / l_mat[k, k]
+        l_mat[k, k] = r
+        for i in range(k + 1, d):
+            l_mat[i, k] = (l_mat[i, k] + s * v[i]) / c
+            v[i] = c * v[i] - s * l_mat[i, k]
+
+
+@nb.njit(cache=True)
+def welford_cholupdate(l_mat, mean, n, x_new):
+    """
+    Update the mean and the Cholesky factor of the empirical covariance of a
+    set of n samples with new samples, using Welford's recursion. The
+    covariance is normalized by the number of samples.
+
+    Parameters
+    ----------
+    l_mat : ndarray
+        lower Cholesky factor of the empirical covariance (updated in place)
+    mean : ndarray
+        empirical mean (updated in place)
+    n : int
+        number of samples already accounted for
+    x_new : ndarray
+        new samples, size k x d
+
+    Returns
+    -------
+    n_new : int
+        updated number of samples
+
+    """
+
+    for j in range(x_new.shape[0]):
+        n += 1
+        delta = x_new[j] - mean
+        mean += delta / n
+        # C_n = (n - 1) / n * (C_{n-1} + delta delta^T / n)
+        cholupdate(l_mat, delta / np.sqrt(n))
+        l_mat *= np.sqrt((n - 1) / n)
+
+    return n
+
+
+class AdaptiveMetropolis(object):
+    """
+    Metropolis sampler advancing several chains in lockstep, with a Gaussian
+    proposal whose covariance is adapted from the samples of all chains
+    (Haario et al. 2001). The Cholesky factor of the empirical covariance is
+    updated with rank-one updates.
+    """
+
+    def __init__(self, ndim, logp, n_chains=8, vectorized=True,
+                 n_adapt=1000):
+        """
+
+        Parameters
+        ----------
+        ndim : integer
+            dimension of parameter space
+        logp : callable
+            log-probability distribution function to target. If vectorized
+            is True, it takes an array of size n_chains x ndim and returns an
+            array of size n_chains.
+        n_chains : int
+            number of chains
+        vectorized : bool
+            whether logp can be evaluated for all chains at once
+        n_adapt : int
+            number of samples drawn (for all chains) before the proposal
+            covariance starts being adapted
+
+        """
+
+        self.logp = logp
+        self.ndim = ndim
+        self.n_chains = n_chains
+        self.vectorized = vectorized
+        self.n_adapt = n_adapt
+        # Optimal scaling of the proposal covariance
+        self.s_d = 2.38 ** 2 / ndim
+        # Current state of chains
+        self.x = None
+        self.logp_x = None
+        # Empirical mean and Cholesky factor of the empirical covariance
+        self.mean = None
+        self.l_cov = None
+        self.n_samples = 0
+        self.accepted = 0
+        self.n_proposed = 0
+
+    def log_prob(self, x):
+        """
+        Evaluate the target for all chains.
+        """
+
+        if self.vectorized:
+            return np.asarray(self.logp(x))
+        return np.array([self.logp(xi) for xi in x])
+
+    def set_cov(self, cov):
+        """
+        Set the proposal covariance, and reset the adaptation.
+
+        Parameters
+        ----------
+        cov : ndarray
+            proposal covariance matrix (size ndim x ndim), or vector of
+            variances
+
+        """
+
+        if len(np.shape(cov)) < 2:
+            cov = np.diag(cov * np.ones(self.ndim))
+        self.l_cov = linalg.cholesky(cov / self.s_d, lower=True)
+        self.mean = None
+        self.n_samples = 0
+
+    def initialize(self, x0, cov0):
+        """
+        Set the initial state of all chains and the proposal covariance.
+
+        Parameters
+        ----------
+        x0 : ndarray
+            initial point, common to all chains (size ndim), or initial
+            points of each chain (size n_chains x ndim)
+        cov0 : ndarray
+            initial proposal covariance (matrix or vector of variances)
+
+        """
+
+        self.x = np.ones((self.n_chains, 1)) * np.asarray(x0, dtype=float)
+        self.logp_x = None
+        self.set_cov(cov0)
+
+    def step(self):
+        """
+        Advance all chains by one Metropolis step.
+        """
+
+        z = np.random.normal(loc=0.0, scale=1.0,
+                             size=(self.n_chains, self.ndim))
+        x_prime = self.x + np.sqrt(self.s_d) * z.dot(self.l_cov.T)
+        logp_prime = self.log_prob(x_prime)
+        u = np.random.uniform(low=0.0, high=1.0, size=self.n_chains)
+        accept = np.log(u) < logp_prime - self.logp_x
+        self.x[accept] = x_prime[accept]
+        self.logp_x[accept] = logp_prime[accept]
+        self.accepted += np.sum(accept)
+        self.n_proposed += self.n_chains
+
+    def adapt(self):
+        """
+        Update the proposal covariance with the current state of all chains.
+        """
+
+        if self.mean is None:
+            self.mean = np.mean(self.x, axis=0)
+            # Weight of the initial covariance
+            self.n_samples = self.n_adapt
+        else:
+            self.n_samples = welford_cholupdate(self.l_cov, self.mean,
+                                                self.n_samples, self.x)
+
+    def run(self, n_steps, x0=None, cov0=None, verbose=False, adapt=True):
+        """
+        Run all chains for several steps. If no initial state is provided,
+        the chains continue from their current state.
+
+        Parameters
+        ----------
+        n_steps : int
+            number of steps
+        x0 : ndarray, optional
+            initial point(s), see initialize
+        cov0 : ndarray, optional
+            initial proposal covariance, see initialize
+        verbose : bool
+            if True, print the acceptance rate every 100 steps
+        adapt : bool
+            whether to adapt the proposal covariance
+
+        Returns
+        -------
+        x_samples : ndarray
+            samples, size n_steps x n_chains x ndim
+        logp_samples : ndarray
+            log-probability values, size n_steps x n_chains
+
+        """
+
+        if x0 is not None:
+            self.initialize(x0, cov0)
+        elif cov0 is not None:
+            self.set_cov(cov0)
+        # The target may have changed since the last call
+        self.logp_x = self.log_prob(self.x)
+        x_samples = np.zeros((n_steps, self.n_chains, self.ndim))
+        logp_samples = np.zeros((n_steps, self.n_chains))
+
+        for s in range(n_steps):
+            self.step()
+            x_samples[s] = self.x
+            logp_samples[s] = self.logp_x
+            if adapt & (self.n_proposed >= self.n_adapt):
+                self.adapt()
+            if verbose & ((s + 1) % 100 == 0):
+                print("Iteration " + str(s + 1) + " completed.")
+                print("Acceptance rate: "
+                      + str(self.accepted / self.n_proposed))
+
+        return x_samples, logp_samples
+
+
+class PreconditionedMALA(AdaptiveMetropolis):
+    """
+    Metropolis-adjusted Langevin algorithm advancing several chains in
+    lockstep, preconditioned by a fixed covariance matrix C (typically the
+    inverse Fisher matrix of the target):
+
+    x' = x + h / 2 C grad log p(x) + sqrt(h) C^{1/2} z
+    """
+
+    def __init__(self, ndim, logp, grad_logp, cov, n_chains=8,
+                 vectorized=True, step_size=None):
+        """
+
+        Parameters
+        ----------
+        ndim : integer
+            dimension of parameter space
+        logp : callable
+            log-probability distribution function to target
+        grad_logp : callable
+            gradient of logp. If vectorized is True, it takes an array of size
+            n_chains x ndim and returns an array of the same size.
+        cov : ndarray
+            preconditioning covariance matrix (size ndim x ndim)
+        n_chains : int
+            number of chains
+        vectorized : bool
+            whether logp and grad_logp can be evaluated for all chains at once
+        step_size : float, optional
+            step size h. Default is 1.65^2 / ndim^(1/3).
+
+        """
+
+        AdaptiveMetropolis.__init__(self, ndim, logp, n_chains=n_chains,
+                                    vectorized=vectorized)
+        self.grad_logp = grad_logp
+        if step_size is None:
+            step_size = 1.65 ** 2 / ndim ** (1 / 3)
+        self.step_size = step_size
+        self.grad_x = None
+        self.set_cov(cov)
+
+    def set_cov(self, cov):
+        """
+        Set the preconditioning covariance matrix.
+        """
+
+        self.cov = cov
+        self.l_cov = linalg.cholesky(cov, lower=True)
+
+    def initialize(self, x0, cov0=None):
+
+        self.x = np.ones((self.n_chains, 1)) * np.asarray(x0, dtype=float)
+        self.logp_x = None
+        if cov0 is not None:
+            self.set_cov(cov0)
+
+    def gradient(self, x):
+        """
+        Evaluate the gradient of the target for all chains.
+        """
+
+        if self.vectorized:
+            return np.asarray(self.grad_logp(x))
+        return np.array([self.grad_logp(xi) for xi in x])
+
+    def log_proposal(self, x_to, x_from, grad_from):
+        """
+        Log-density of the Langevin proposal, up to a constant.
+        """
+
+        mu = x_from + 0.5 * self.step_size * grad_from.dot(self.cov)
+        r = linalg.solve_triangular(self.l_cov, (x_to - mu).T, lower=True)
+
+        return - 0.5 * np.sum(r ** 2, axis=0) / self.step_size
+
+    def step(self):
+
+        if self.grad_x is None:
+            self.grad_x = self.gradient(self.x)
+        z = np.random.normal(loc=0.0, scale=1.0,
+                             size=(self.n_chains, self.ndim))
+        x_prime = self.x + 0.5 * self.step_size * self.grad_x.dot(self.cov) \
+            + np.sqrt(self.step_size) * z.dot(self.l_cov.T)
+        logp_prime = self.log_prob(x_prime)
+        grad_prime = self.gradient(x_prime)
+        log_ratio = logp_prime - self.logp_x \
+            + self.log_proposal(self.x, x_prime, grad_prime) \
+            - self.log_proposal(x_prime, self.x, self.grad_x)
+        u = np.random.uniform(low=0.0, high=1.0, size=self.n_chains)
+        accept = np.log(u) < log_ratio
+        self.x[accept] = x_prime[accept]
+        self.logp_x[accept] = logp_prime[accept]
+        self.grad_x[accept] = grad_prime[accept]
+        self.accepted += np.sum(accept)
+        self.n_proposed += self.n_chains
+
+    def run(self, n_steps, x0=None, cov0=None, verbose=False, adapt=False):
+
+        # The target may have changed since the last call
+        self.grad_x = None
+        if x0 is not None:
+            self.initialize(x0, cov0)
+        elif cov0 is not None:
+            self.set_cov(cov0)
+
+        return AdaptiveMetropolis.run(self, n_steps, verbose=verbose,
+                                      adapt=False)
+
+
+class IndependenceMetropolis(AdaptiveMetropolis):
+    """
+    Independence Metropolis-Hastings sampler advancing several chains in
+    lockstep, with a fixed Gaussian proposal (typically the Laplace
+    approximation of the target).
+    """
+
+    def __init__(self, ndim, logp, mean, cov, n_chains=8, vectorized=True):
+        """
+
+        Parameters
+        ----------
+        ndim : integer
+            dimension of parameter space
+        logp : callable
+            log-probability distribution function to target
+        mean : ndarray
+            mean of the Gaussian proposal
+        cov : ndarray
+            covariance matrix of the Gaussian proposal
+        n_chains : int
+            number of chains
+        vectorized : bool
+            whether logp can be evaluated for all chains at once
+
+        """
+
+        AdaptiveMetropolis.__init__(self, ndim, logp, n_chains=n_chains,
+                                    vectorized=vectorized)
+        self.proposal_mean = mean
+        self.set_cov(cov)
+
+    def set_cov(self, cov):
+        """
+        Set the covariance of the Gaussian proposal.
+        """
+
+        self.l_cov = linalg.cholesky(cov, lower=True)
+
+    def initialize(self, x0, cov0=None):
+
+        self.x = np.ones((self.n_chains, 1)) * np.asarray(x0, dtype=float)
+        self.logp_x = None
+        if cov0 is not None:
+            self.set_cov(cov0)
+
+    def log_proposal(self, x):
+        """
+        Log-density of the proposal, up to a constant.
+        """
+
+        r = linalg.solve_triangular(self.l_cov, (x - self.proposal_mean).T, lower=True)
+
+        return - 0.5 * np.sum(r ** 2, axis=0)
+
+    def step(self):
+
+        z = np.random.normal(loc=0.0, scale=1.0,
+                             size=(self.n_chains, self.ndim))
+        x_prime = self.proposal_mean + z.dot(self.l_cov.T)
+        logp_prime = self.log_prob(x_prime)
+        log_ratio = logp_prime - self.logp_x + self.log_proposal(self.x) \
+            + 0.5 * np.sum(z ** 2, axis=1)
+        u = np.random.uniform(low=0.0, high=1.0, size=self.n_chains)
+        accept = np.log(u) < log_ratio
+        self.x[accept] = x_prime[accept]
+        self.logp_x[accept] = logp_prime[accept]
+        self.accepted += np.sum(accept)
+        self.n_proposed += self.n_chains
+
+    def run(self, n_steps, x0=None, cov0=None, verbose=False, adapt=False):
+
+        if x0 is not None:
+            self.initialize(x0, cov0)
+        elif cov0 is not None:
+            self.set_cov(cov0)
+
+        return AdaptiveMetropolis.run(self, n_steps, verbose=verbose,
+                                      adapt=False)
+
+
+class BatchLikePriorEvaluator(ptemcee.sampler.LikePriorEvaluator):
+    """
+    Wrapper class for vectorized logl and logp, evaluating a whole block of
+    parameter vectors in one call.
+
+    """
+
+    def __call__(self, x):
+        """
+
+        Parameters
+        ----------
+        x : ndarray
+            parameter vectors, size n_points x ndim
+
+        Returns
+        -------
+        ll : ndarray
+            log-likelihoods, size n_points
+        lp : ndarray
+            log-priors, size n_points
+
+        """
+
+        lp = np.asarray(self.logp(x, *self.logpargs, **self.logpkwargs),
+                        dtype=np.float64) * np.ones(x.shape[0])
+        if np.isnan(lp).any():
+            raise ValueError('Prior function returned NaN.')
+        # Can't return -inf, since this messes with beta=0 behaviour.
+        ll = np.zeros(x.shape[0])
+        inside = lp > -np.inf
+        if inside.any():
+            ll[inside] = self.logl(x[inside], *self.loglargs,
+                                   **self.loglkwargs)
+            if np.isnan(ll).any():
+                raise ValueError('Log likelihood function returned NaN.')
+
+        return ll, lp
+
+
 class ExtendedPTMCMC(ptemcee.Sampler):
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, vectorize=False, **kwargs):
+        """
+
+        Parameters
+        ----------
+        args : list
+            arguments of ptemcee.Sampler
+        vectorize : bool
+            if True, the log-likelihood and log-prior functions take arrays of
+            parameters of size n_points x ndim and return arrays of size
+            n_points, and the whole ensemble of walkers is evaluated in one
+            call (or in one call per temperature if a pool is provided)
+        kwargs : dictionary
+            keyword arguments of ptemcee.Sampler
+
+        """
 
         super(ExtendedPTMCMC, self).__init__(*args, **kwargs)
         # ptemcee.Sampler.__init__(self, args)
 
+        self.vectorize = vectorize
+        if vectorize:
+            self._likeprior = BatchLikePriorEvaluator(
+                self._likeprior.logl, self._likeprior.logp,
+                loglargs=self._likeprior.loglargs,
+                logpargs=self._likeprior.logpargs,
+                loglkwargs=self._likeprior.loglkwargs,
+                logpkwargs=self._likeprior.logpkwargs)
+
         self.position = []
 
+    def _evaluate(self, ps):
+
+        if not self.vectorize:
+            return super(ExtendedPTMCMC, self)._evaluate(ps)
+
+        x = ps.reshape((-1, self.dim))
+        if self.pool is None:
+            results = [self._likeprior(x)]
+        else:
+            results = list(self.pool.map(self._likeprior,
+                                         np.array_split(x, self.ntemps)))
+        logl = np.concatenate([r[0] for r in results]).reshape(
+            (self.ntemps, -1))
+        logp = np.concatenate([r[1] for r in results]).reshape(
+            (self.ntemps, -1))
+
+        return logl, logp
+
     def get_log_likelihood(self):
 
         return self._likeprior.logl
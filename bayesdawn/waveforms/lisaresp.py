@@ -35,6 +35,9 @@ i_tc = 4
 i_ext = [i_dist, i_inc, i_phi0, i_psi]
 # Indices of intrinsic parameters
 i_intr = [0, 1, 2, 3, 4, 8, 9]
+# Extrinsic angles (phi0, psi) of the legacy four-column F-statistics basis
+fstat_angles = [(0, 0), (np.pi / 2, np.pi / 4), (3 * np.pi / 4, 0),
+                (np.pi / 4, np.pi / 4)]
 
 
 def indices_low_freq(channel):
@@ -1334,13 +1337,20 @@ class MBHBWaveform(GWwaveform):
         # 1. 1.e-21, 0.5*np.pi, 0.0, 0.0
         # 2. 1.e-21, 0.5*np.pi, 0.25*np.pi, 0.0
 
-        # Calculate the response on required grid
-        tdi_response_plus = self.compute_signal_freq(f, params_1, del_t, tobs,
-                                                     channel=channel,
-                                                     tref=tref)
-        tdi_response_cros = self.compute_signal_freq(f, params_2, del_t, tobs,
-                                                     channel=channel,
-                                                     tref=tref)
+        # TDI responses to both polarisations, sharing the resampling of the
+        # waveform amplitude and phase
+        wftdi_list = [lisa.GenerateLISATDI(
+            params, tobs=tobs, minf=1e-5, maxf=1., tref=tref, torb=0.,
+            TDItag='TDIAET', acc=1e-4, order_fresnel_stencil=0,
+            approximant='IMRPhenomD', responseapprox='full',
+            frozenLISA=False, TDIrescaled=False)
+            for params in [params_1, params_2]]
+        responses = polarisation_responses(wftdi_list, f, channels=[1, 2, 3])
+        # Divide by del_t to be consistent with the unnormalized DFT
+        tdi_response_plus = [self.shift_time(f, ch, tobs).conj() / del_t
+                             for ch in responses[0]]
+        tdi_response_cros = [self.shift_time(f, ch, tobs).conj() / del_t
+                             for ch in responses[1]]
 
         if not complex:
             mat_list = [self.single_design_matrix(tdi_response_plus[i],
@@ -1399,6 +1409,115 @@ def generate_lisa_signal(wftdi, freq=None, channels=None):
     return signal
 
 
+def polarisation_responses(wftdi_list, freq=None, channels=None):
+    """
+    Compute the TDI responses of several waveforms which share the same
+    intrinsic parameters, and only differ by their polarisation angle. The
+    amplitude and phase of the waveform are the same for all of them, so that
+    they are resampled only once, and only the transfer functions are
+    resampled for each waveform.
+
+    Parameters
+    ----------
+    wftdi_list : list of dict
+        dictionaries output from GenerateLISATDI, computed for the same
+        intrinsic parameters
+    freq : ndarray
+        numpy array of freqs on which to sample waveform (or None)
+    channels : list of ints
+        TDI channels to consider
+
+    Returns
+    -------
+    responses : list of lists
+        TDI responses of each waveform, for each channel
+
+    """
+
+    if channels is None:
+        channels = [1, 2]
+
+    fs = wftdi_list[0]['freq']
+    amp = wftdi_list[0]['amp']
+    phase = wftdi_list[0]['phase']
+    if freq is not None:
+        amp = pyspline.resample(freq, fs, amp)
+        phase = pyspline.resample(freq, fs, phase)
+    h = amp * np.exp(1j * phase)
+
+    responses = []
+    for wftdi in wftdi_list:
+        if not np.array_equal(wftdi['freq'], fs):
+            # Coarse grids differ, the waveform cannot be shared
+            signal = generate_lisa_signal(wftdi, freq, channels)
+            responses.append([signal['ch' + str(int(i))]
+                              for i in channels])
+        else:
+            tr = [wftdi['transferL' + str(int(i))] for i in channels]
+            if freq is not None:
+                tr = [pyspline.resample(freq, fs, tri) for tri in tr]
+            responses.append([h * tri for tri in tr])
+
+    return responses
+
+
+def fstat_design_matrix(responses, freq, t_offset=0.0, scale=1.0,
+                        angles=None):
+    """
+    Form the F-statistics design matrices from the TDI responses to a waveform
+    with polarisation angles psi = 0 and psi = pi / 4 (both with phi0 = 0 and
+    inclination pi / 2). The response is linear in the plus and cross
+    polarisations, so that the response for polarisation angle psi is
+    cos(2 psi) R_0 + sin(2 psi) R_{pi/4}, and the initial phase phi0 only
+    multiplies the (2, 2) mode by exp(2 i phi0). Since the amplitudes are
+    complex, the two responses span all the waveforms with free extrinsic
+    parameters, and are the default columns.
+
+    Parameters
+    ----------
+    responses : list of lists
+        TDI responses R_0 and R_{pi/4} for each channel, as output by
+        polarisation_responses
+    freq : ndarray
+        frequencies where the responses are computed
+    t_offset : float
+        time shift applied to the waveforms
+    scale : float
+        rescaling factor applied to the waveforms
+    angles : list of tuples, optional
+        angles (phi0, psi) of each column. If None (default), the columns are
+        the two responses R_0 and R_{pi/4}. Setting angles=fstat_angles gives
+        the legacy four-column layout, whose columns are linearly dependent
+        over the complex numbers.
+
+    Returns
+    -------
+    mat_list : list
+        list of design matrices for each channel, of size nf x 2 (or
+        nf x len(angles))
+
+    """
+
+    # Phasor for the time shift
+    z = np.exp(-2j * np.pi * freq * t_offset)
+    mat_list = []
+
+    for i in range(len(responses[0])):
+        # Time-shifted responses, with the same normalization as
+        # lisabeta_template
+        r_0 = np.conj(responses[0][i] * z) * scale
+        r_1 = np.conj(responses[1][i] * z) * scale
+        if angles is None:
+            mat_list.append(np.array([r_0, r_1]).T)
+        else:
+            mat_list.append(np.array(
+                [np.exp(-2j * phi0) * (np.cos(2 * psi) * r_0
+                                       + np.sin(2 * psi) * r_1)
+                 for phi0, psi in angles]).T)
+
+    return mat_list
+
+
 def lisabeta_template(params, freq, tobs, tref=0, t_offset=52.657,
                       channels=None):
     """
@@ -1585,38 +1704,27 @@ def design_matrix(params_intr, freq, tobs, tref=0, t_offset=52.657,
 
     """
 
-    # First column
     # m1, m2, chi1, chi2, tc, dist, inc, phi, lambd, beta, psi = params
-    # Building the F-statistics basis
-    
-    params_0 = np.zeros(11)
-    # Save intrinsic parameters
-    params_0[i_intr] = params_intr
-    # Luminosity distance (Mpc)
-    params_0[i_dist] = 1e3
-    # Inclination
-    params_0[i_inc] = 0.5 * np.pi
-    # 4 elements
-    params_list = [params_0 for j in range(4)]
-    # First element (phi_c, phi) = (0, 0)
-    params_list[0][i_phi0] = 0
-    params_list[0][i_psi] = 0
-    # Second element (phi_c, phi) = (pi/2, pi/4)
-    params_list[1][i_phi0] = np.pi / 2
-    params_list[1][i_psi] = np.pi / 4
-    # Third element (phi_c, phi) = (3pi/4, 0)
-    params_list[2][i_phi0] = 3 * np.pi / 4
-    params_list[2][i_psi] = 0
-    # Fourth element (phi_c, phi) = (pi/4, pi/4)
-    params_list[3][i_phi0] = np.pi / 4
-    params_list[3][i_psi] = np.pi / 4
-    # Compute all 4 elements for all channels
-    elements = [lisabeta_template(params, freq, tobs, 
-                                  tref=tref, 
-                                  t_offset=t_offset, 
-                                  channels=channels) for params in params_list]
-    # Compute the design matrices for each channel
-    mat_list = [np.vstack([el[i] for el in elements]).T 
-                for i in range(len(elements[0]))]
-
-    return mat_list
+    # Building the F-statistics basis from the responses to the two
+    # polarisations
+    if channels is None:
+        channels = [1, 2, 3]
+    wftdi_list = []
+    for psi in [0, np.pi / 4]:
+        params = np.zeros(11)
+        # Save intrinsic parameters
+        params[i_intr] = params_intr
+        # Luminosity distance (Mpc)
+        params[i_dist] = 1e3
+        # Inclination
+        params[i_inc] = 0.5 * np.pi
+        # Polarization angle
+        params[i_psi] = psi
+        wftdi_list.append(lisa.GenerateLISATDI(
+            params, tobs=tobs, minf=1e-5, maxf=1., tref=tref, torb=0.,
+            TDItag='TDIAET', acc=1e-4, order_fresnel_stencil=0,
+            approximant='IMRPhenomD', responseapprox='full',
+            frozenLISA=False, TDIrescaled=False))
+    responses = polarisation_responses(wftdi_list, freq, channels)
+
+    return fstat_design_matrix(responses, freq, t_offset=t_offset)
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Reduced-order quadrature (ROQ) of the Whittle log-likelihood.
+
+Reduced bases of the waveforms (or of the columns of the design matrices, for
+the reduced likelihood) and of their squared moduli are built by a greedy
+algorithm over a training set drawn in the prior box. The empirical
+interpolation method then selects the frequencies where the waveforms must be
+computed, and the inner products of the likelihood reduce to weighted sums at
+these nodes. The weights depend on the data and the PSD, and are cheap to
+recompute.
+
+@author: qbaghi
+"""
+
+import numpy as np
+from scipy import linalg
+import h5py
+
+
+def bounds_from_config(config, names=None):
+    """
+    Read the prior bounds from the [ParametersLowerBounds] and
+    [ParametersUpperBounds] sections of a configuration file.
+
+    Parameters
+    ----------
+    config : configparser.ConfigParser instance
+        configuration
+    names : list of str, optional
+        names of the parameters to read. Default is all parameters of the
+        lower bound section.
+
+    Returns
+    -------
+    lower_bounds : ndarray
+        lower bounds of the prior box
+    upper_bounds : ndarray
+        upper bounds of the prior box
+
+    """
+
+    if names is None:
+        names = [key for key in config['ParametersLowerBounds']]
+    lower_bounds = np.array([config['ParametersLowerBounds'].getfloat(name)
+                             for name in names])
+    upper_bounds = np.array([config['ParametersUpperBounds'].getfloat(name)
+                             for name in names])
+
+    return lower_bounds, upper_bounds
+
+
+def greedy_basis(training_set, tol=1e-12, n_max=None, basis=None):
+    """
+    Build an orthonormal reduced basis spanning a training set of waveforms,
+    by greedy selection of the worst represented waveform. An existing basis
+    can be extended, so that large training sets can be processed in chunks.
+
+    Parameters
+    ----------
+    training_set : ndarray
+        training waveforms, size n_train x nf
+    tol : float
+        tolerance on the maximal squared projection error of the normalized
+        training waveforms
+    n_max : int, optional
+        maximal number of basis elements
+    basis : ndarray, optional
+        orthonormal basis to extend, size n_basis x nf
+
+    Returns
+    -------
+    basis : ndarray
+        orthonormal basis, size n_basis x nf
+    err : float
+        maximal squared projection error of the normalized training waveforms
+
+    """
+
+    norms = np.sqrt(np.sum(np.abs(training_set) ** 2, axis=1))
+    training = training_set[norms > 0] / norms[norms > 0, np.newaxis]
+    if n_max is None:
+        n_max = training.shape[1]
+    if basis is None:
+        basis = []
+    else:
+        basis = list(basis)
+    if training.shape[0] == 0:
+        return np.array(basis), 0.0
+    err = np.ones(training.shape[0])
+    if len(basis) > 0:
+        err -= np.sum(np.abs(training.dot(np.conj(np.array(basis)).T)) ** 2,
+                      axis=1)
+    i = np.argmax(err)
+
+    while (len(basis) < n_max) & (err[i] > tol):
+        v = training[i]
+        # Iterated Gram-Schmidt orthogonalization for numerical stability
+        for j in range(2):
+            for e in basis:
+                v = v - np.vdot(e, v) * e
+        basis.append(v / linalg.norm(v))
+        err -= np.abs(training.dot(np.conj(basis[-1]))) ** 2
+        i = np.argmax(err)
+
+    return np.array(basis), err[i]
+
+
+def empirical_interpolation(basis, tol=1e-12):
+    """
+    Empirical interpolation method: select interpolation nodes from a reduced
+    basis, such that any waveform in the span of the basis is determined by its
+    values at the nodes.
+
+    Parameters
+    ----------
+    basis : ndarray
+        reduced basis, size n_basis x nf
+    tol : float
+        tolerance on the interpolation residual of each basis element,
+        relative to its maximum modulus. The selection stops at the first
+        element that is already interpolated within tol, since its node would
+        make the interpolation system singular.
+
+    Returns
+    -------
+    nodes : ndarray
+        indices of the interpolation nodes, size n_nodes <= n_basis
+    interpolant : ndarray
+        interpolation matrix B, size nf x n_nodes, such that any waveform h in
+        the span of the first n_nodes basis elements satisfies h = B h[nodes]
+
+    """
+
+    nodes = [np.argmax(np.abs(basis[0]))]
+    for j in range(1, basis.shape[0]):
+        c = linalg.solve(basis[0:j, nodes].T, basis[j, nodes])
+        r = basis[j] - c.dot(basis[0:j])
+        if np.max(np.abs(r)) <= tol * np.max(np.abs(basis[j])):
+            break
+        nodes.append(np.argmax(np.abs(r)))
+    nodes = np.array(nodes)
+    interpolant = linalg.solve(basis[0:nodes.shape[0], nodes],
+                               basis[0:nodes.shape[0]]).T
+
+    return nodes, interpolant
+
+
+class ROQBasis(object):
+    """
+    Reduced-order quadrature rule of the Whittle likelihood for a waveform
+    model, on a fixed frequency grid and prior box.
+
+    """
+
+    def __init__(self, freq, lin_nodes, lin_interp, quad_nodes, quad_interp,
+                 reduced=False, lower_bounds=None, upper_bounds=None):
+        """
+
+        Parameters
+        ----------
+        freq : ndarray
+            frequency array where the data are analysed, size nf
+        lin_nodes : list of ndarrays
+            interpolation nodes of the waveforms, for each channel
+        lin_interp : list of ndarrays
+            interpolation matrices of the waveforms, for each channel
+        quad_nodes : list of ndarrays
+            interpolation nodes of the waveform products, for each channel
+        quad_interp : list of ndarrays
+            interpolation matrices of the waveform products, for each channel
+        reduced : bool
+            if True, the waveform model is a design matrix and the rule is
+            used for the reduced likelihood
+        lower_bounds : ndarray, optional
+            lower bounds of the prior box used to build the bases
+        upper_bounds : ndarray, optional
+            upper bounds of the prior box used to build the bases
+
+        """
+
+        self.freq = freq
+        self.lin_interp = lin_interp
+        self.quad_interp = quad_interp
+        self.reduced = reduced
+        self.lower_bounds = lower_bounds
+        self.upper_bounds = upper_bounds
+        # All frequencies where the waveforms are computed
+        self.nodes = np.unique(np.concatenate(lin_nodes + quad_nodes))
+        # Positions of each set of nodes in the previous array
+        self.lin_pos = [np.searchsorted(self.nodes, nodes)
+                        for nodes in lin_nodes]
+        self.quad_pos = [np.searchsorted(self.nodes, nodes)
+                         for nodes in quad_nodes]
+        # Weights, computed from data and PSD
+        self.w_lin = None
+        self.w_quad = None
+
+    @property
+    def lin_nodes(self):
+        return [self.nodes[pos] for pos in self.lin_pos]
+
+    @property
+    def quad_nodes(self):
+        return [self.nodes[pos] for pos in self.quad_pos]
+
+    @classmethod
+    def build(cls, func, freq, lower_bounds, upper_bounds, n_train=1000,
+              tol=1e-12, n_max=None, reduced=False, args=[], kwargs={},
+              seed=None, verbose=True, chunk_size=100):
+        """
+        Build the reduced bases and interpolation nodes of a waveform model,
+        from a training set drawn uniformly in the prior box.
+
+        The training set is generated and processed in chunks of chunk_size
+        parameter vectors, each of them extending the bases. The waveforms of
+        one chunk and the products of one pair of columns are held in memory
+        at a time, i.e. about chunk_size x nf x (k + 1) complex values for
+        design matrices with k columns, in addition to the bases themselves
+        (n_basis x nf complex values each).
+
+        Parameters
+        ----------
+        func : callable
+            waveform generator, taking a parameter vector, a frequency array,
+            args and kwargs as inputs, and outputing a list of waveforms (or
+            of design matrices if reduced is True), one for each channel
+        freq : ndarray
+            frequency array where the data are analysed
+        lower_bounds : ndarray
+            lower bounds of the prior box
+        upper_bounds : ndarray
+            upper bounds of the prior box
+        n_train : int
+            size of the training set
+        tol : float
+            tolerance of the greedy algorithm
+        n_max : int, optional
+            maximal number of basis elements
+        reduced : bool
+            whether func outputs design matrices
+        args : list
+            secondary arguments of func
+        kwargs : dictionary
+            keyword arguments of func
+        seed : int, optional
+            seed of the training set draws
+        verbose : bool
+            if True, print the size of the bases
+        chunk_size : int
+            number of training waveforms generated and processed at once
+
+        Returns
+        -------
+        roq : ROQBasis instance
+            reduced-order quadrature rule
+
+        """
+
+        rng = np.random.RandomState(seed)
+        pars = rng.uniform(lower_bounds, upper_bounds,
+                           size=(n_train, len(lower_bounds)))
+        bases, bases_q, errs, errs_q = None, None, None, None
+
+        for j in range(0, n_train, chunk_size):
+            # Training matrices for each channel, size chunk_size x nf x k
+            mats = [np.array(mat_list) for mat_list in zip(
+                *[[np.asarray(mat).reshape((freq.shape[0], -1))
+                   for mat in func(par, freq, *args, **kwargs)]
+                  for par in pars[j:j + chunk_size]])]
+            if bases is None:
+                bases, bases_q = [None] * len(mats), [None] * len(mats)
+                errs, errs_q = np.zeros(len(mats)), np.zeros(len(mats))
+            for i, mat in enumerate(mats):
+                # Linear terms: all columns
+                training = np.swapaxes(mat, 1, 2).reshape((-1, freq.shape[0]))
+                bases[i], err = greedy_basis(training, tol=tol, n_max=n_max,
+                                             basis=bases[i])
+                errs[i] = max(errs[i], err)
+                # Quadratic terms: all products conj(M_k) M_l with k <= l
+                for k, l in zip(*np.triu_indices(mat.shape[2])):
+                    bases_q[i], err = greedy_basis(
+                        np.conj(mat[:, :, k]) * mat[:, :, l], tol=tol,
+                        n_max=n_max, basis=bases_q[i])
+                    errs_q[i] = max(errs_q[i], err)
+            del mats, training
+
+        lin_nodes, lin_interp, quad_nodes, quad_interp = [], [], [], []
+        for i in range(len(bases)):
+            nodes, interp = empirical_interpolation(bases[i])
+            lin_nodes.append(nodes)
+            lin_interp.append(interp)
+            nodes, interp = empirical_interpolation(bases_q[i])
+            quad_nodes.append(nodes)
+            quad_interp.append(interp)
+            if verbose:
+                print("Channel " + str(i) + ": " + str(lin_nodes[i].shape[0])
+                      + " linear and " + str(quad_nodes[i].shape[0])
+                      + " quadratic interpolation nodes.")
+                print("Greedy errors: " + str(errs[i]) + ", "
+                      + str(errs_q[i]))
+
+        return cls(freq, lin_nodes, lin_interp, quad_nodes, quad_interp,
+                   reduced=reduced, lower_bounds=lower_bounds,
+                   upper_bounds=upper_bounds)
+
+    def save(self, file_path):
+        """
+        Save the bases in a HDF5 file.
+
+        Parameters
+        ----------
+        file_path : str
+            path of the file
+
+        """
+
+        with h5py.File(file_path, 'w') as fh5:
+            fh5.attrs['reduced'] = self.reduced
+            fh5.create_dataset("freq", data=self.freq)
+            if self.lower_bounds is not None:
+                fh5.create_dataset("lower_bounds", data=self.lower_bounds)
+                fh5.create_dataset("upper_bounds", data=self.upper_bounds)
+            for i in range(len(self.lin_interp)):
+                grp = fh5.create_group("channel" + str(i))
+                grp.create_dataset("lin_nodes", data=self.lin_nodes[i])
+                grp.create_dataset("lin_interp", data=self.lin_interp[i])
+                grp.create_dataset("quad_nodes", data=self.quad_nodes[i])
+                grp.create_dataset("quad_interp", data=self.quad_interp[i])
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Load bases saved in a HDF5 file.
+
+        Parameters
+        ----------
+        file_path : str
+            path of the file
+
+        Returns
+        -------
+        roq : ROQBasis instance
+            reduced-order quadrature rule
+
+        """
+
+        with h5py.File(file_path, 'r') as fh5:
+            n_ch = len([key for key in fh5.keys() if 'channel' in key])
+            grps = [fh5["channel" + str(i)] for i in range(n_ch)]
+            if "lower_bounds" in fh5:
+                lower_bounds = fh5["lower_bounds"][()]
+                upper_bounds = fh5["upper_bounds"][()]
+            else:
+                lower_bounds = None
+                upper_bounds = None
+
+            return cls(fh5["freq"][()],
+                       [grp["lin_nodes"][()] for grp in grps],
+                       [grp["lin_interp"][()] for grp in grps],
+                       [grp["quad_nodes"][()] for grp in grps],
+                       [grp["quad_interp"][()] for grp in grps],
+                       reduced=bool(fh5.attrs['reduced']),
+                       lower_bounds=lower_bounds,
+                       upper_bounds=upper_bounds)
+
+    def compute_weights(self, data_dft, sn):
+        """
+        Compute the quadrature weights from the data and the PSD.
+
+        Parameters
+        ----------
+        data_dft :  list[ndarray]
+            List of windowed frequency-domain data, for each channel
+        sn : list of ndarrays
+            list of noise PSDs, for each channel
+
+        """
+
+        self.w_lin = [(data_dft[i] / sn[i]).dot(np.conj(self.lin_interp[i]))
+                      for i in range(len(sn))]
+        self.w_quad = [(1 / sn[i]).dot(self.quad_interp[i])
+                       for i in range(len(sn))]
+
+    def inner_products(self, mat_list):
+        """
+        Compute the inner products of the likelihood from the waveforms at the
+        interpolation nodes.
+
+        Parameters
+        ----------
+        mat_list : list[ndarray]
+            waveforms (or design matrices) computed at frequencies
+            freq[nodes], for each channel
+
+        Returns
+        -------
+        b_list : list[ndarray]
+            sums of conj(M_k) y / S for all columns M_k, for each channel
+        g_list : list[ndarray]
+            sums of conj(M_k) M_l / S for all pairs of columns, for each
+            channel
+
+        """
+
+        b_list = []
+        g_list = []
+
+        for i, mat in enumerate(mat_list):
+            mat = np.asarray(mat).reshape((self.nodes.shape[0], -1))
+            b_list.append(np.conj(mat[self.lin_pos[i]]).T.dot(self.w_lin[i]))
+            mat_q = mat[self.quad_pos[i]]
+            g_mat = np.einsum('nk,nl,n->kl', np.conj(mat_q), mat_q,
+                              self.w_quad[i])
+            # The lower triangle is deduced from the upper one, which is
+            # interpolated
+            g_mat = np.triu(g_mat) + np.triu(g_mat, 1).conj().T
+            g_list.append(g_mat)
+
+        return b_list, g_list
@@ -4,6 +4,7 @@ import numpy as np
 import copy
 # Bayesdawn modules
 from bayesdawn.algebra import matrixalgebra
+from bayesdawn.waveforms import lisaresp
 # LISABeta and LDC tools
 import lisabeta.lisa.ldctools as ldctools
 import lisabeta.lisa.lisa as lisa
@@ -145,10 +146,10 @@ def design_matrix(params_intr, freq,
     
     """
 
-    # First column
     # m1, m2, chi1, chi2, tc, dist, inc, phi, lambd, beta, psi = params
-    # Building the F-statistics basis
-    
+    # Building the F-statistics basis: the response is linear in the
+    # polarisations, so that only the waveforms for psi = 0 and psi = pi/4
+    # are computed
     params_0 = np.zeros(11)
     # Save intrinsic parameters
     params_0[i_intr] = params_intr
@@ -156,33 +157,41 @@ def design_matrix(params_intr, freq,
     params_0[i_dist] = 1e4
     # Inclination
     params_0[i_inc] = 0.5 * np.pi
-    # 4 elements
-    params_list = [copy.deepcopy(params_0) for j in range(4)]
-    # First element (phi_c, phi) = (0, 0)
-    params_list[0][i_phi0] = 0
-    params_list[0][i_psi] = 0
-    # Second element (phi_c, phi) = (pi/2, pi/4)
-    params_list[1][i_phi0] = np.pi / 2
-    params_list[1][i_psi] = np.pi / 4
-    # Third element (phi_c, phi) = (3pi/4, 0)
-    params_list[2][i_phi0] = 3 * np.pi / 4
-    params_list[2][i_psi] = 0
-    # Fourth element (phi_c, phi) = (pi/4, pi/4)
-    params_list[3][i_phi0] = np.pi / 4
-    params_list[3][i_psi] = np.pi / 4
-    # Compute all 4 elements for all channels
-    elements = [lisabeta_waveform(params, freq, 
-                                  minf=minf, 
-                                  maxf=maxf, 
-                                  tshift=t_offset, 
-                                  channels=channels,
-                                 scale=scale)
-                for params in params_list]
-    # Compute the design matrices for each channel
-    mat_list = [np.vstack([el[i] for el in elements]).T 
-                for i in range(len(elements[0]))]
-
-    return mat_list
+    wftdi_list = []
+    for psi in [0, np.pi / 4]:
+        params = copy.deepcopy(params_0)
+        params[i_phi0] = 0
+        params[i_psi] = psi
+        # Compute waveform on coarse grid
+        wftdi = lisa.GenerateLISATDI_SMBH(ldctools.make_params_dict(params),
+                                          minf=minf,
+                                          maxf=maxf,
+                                          TDI='TDIAET',
+                                          order_fresnel_stencil=0,
+                                          TDIrescaled=False,
+                                          approximant='IMRPhenomD')
+        wftdi_list.append(wftdi[(2, 2)])
+    # Resample on finer grid, sharing amplitude and phase
+    responses = lisaresp.polarisation_responses(wftdi_list, freq=freq,
+                                                channels=channels)
+
+    return lisaresp.fstat_design_matrix(responses, freq, t_offset=t_offset,
+                                        scale=scale)
+
+
+def compute_design_matrix(par_intr, freq, minf=1e-5, maxf=0.1, t_offset=0.0,
+                          channels=[1, 2], scale=1.0):
+    """
+    Design matrices of the reduced model, as a function of the intrinsic
+    sampling parameters [Mc, q, tc, chi1, chi2, sb, lam]
+    """
+
+    return design_matrix(physics.like_to_waveform_intr(par_intr), freq,
+                         minf=minf,
+                         maxf=maxf,
+                         t_offset=t_offset,
+                         channels=channels,
+                         scale=scale)
 
 
 def compute_signal_reduced(par_intr, freq, data_dft, sn,
@@ -217,11 +226,12 @@ def compute_signal_reduced(par_intr, freq, data_dft, sn,
                              t_offset=t_offset,
                              channels=channels,
                             scale=scale)
-    # Compute amplitudes
-    amps = [matrixalgebra.gls(data_dft[i], mat_list[i], sn[i]) 
-            for i in range(len(channels))]
-    # Compute estimated signals
-    ch_list = [np.dot(mat_list[i], amps[i]) for i in range(len(channels))]
+    # Compute amplitudes and estimated signals for all channels at once
+    amps, signals = matrixalgebra.gls_batch(np.array(data_dft),
+                                            np.array(mat_list),
+                                            np.array(sn),
+                                            return_signal=True)
+    ch_list = list(signals)
     
     return ch_list
 
@@ -232,6 +242,7 @@ if __name__ == '__main__':
     from bayesdawn import datamodel, psdmodel, samplers, posteriormodel
     from bayesdawn import likelihoodmodel
     from bayesdawn.utils import loadings, preprocess, postprocess, physics
+    from bayesdawn.waveforms import roq
     # For parallel computing
     # from multiprocessing import Pool, Queue
     import ptemceeg
@@ -431,12 +442,24 @@ if __name__ == '__main__':
                                     psd_cls=psd_cls,
                                     wd=wd,
                                     wd_full=wd_full,
-                                    gap_convolution=gap_convolution)
+                                    gap_convolution=gap_convolution,
+                                    n_psd_workers=len(psd_cls),
+                                    design_func=compute_design_matrix)
 
     # =========================================================================
     # Testing likelihood
     # =========================================================================
     par_aux0 = np.concatenate(ll_cls.data_dft + sn)
+    # Relative binning around the injected parameters
+    n_bins_rb = config['Model'].getint('relativeBinning', fallback=0)
+    if n_bins_rb > 0:
+        print("Relative binning enabled with " + str(n_bins_rb) + " bins.")
+        if reduced:
+            ll_cls.set_relative_binning(p_sampl[i_sampl_intr], n_bins_rb,
+                                        reduced=True, par_aux=par_aux0)
+        else:
+            ll_cls.set_relative_binning(p_sampl, n_bins_rb, reduced=False,
+                                        par_aux=par_aux0)
     t1 = time.time()
     if reduced:
         aft, eft = ll_cls.compute_signal_reduced(p_sampl[i_sampl_intr],
@@ -453,11 +476,8 @@ if __name__ == '__main__':
     # Get all parameter name keys
     names = [key for key in config['ParametersLowerBounds']]
     # Get prior bound values
-    bounds = [[config['ParametersLowerBounds'].getfloat(name),
-               config['ParametersUpperBounds'].getfloat(name)]
-              for name in names]
-    lower_bounds = np.array([bound[0] for bound in bounds])
-    upper_bounds = np.array([bound[1] for bound in bounds])
+    lower_bounds, upper_bounds = roq.bounds_from_config(config, names)
+    bounds = [[lower_bounds[i], upper_bounds[i]] for i in range(len(names))]
     # Print it
     [print("Bounds for parameter " + names[i] + ": " + str(bounds[i]))
      for i in range(len(names))]
@@ -476,6 +496,26 @@ if __name__ == '__main__':
         # np.log10(DL), np.cos(incl), np.sin(bet), lam, psi, phi0
         periodic = [6]
 
+    # Reduced-order quadrature on the prior box
+    roq_path = config['Model'].get('roqBasisPath', fallback='None')
+    if roq_path != 'None':
+        if os.path.isfile(roq_path):
+            print("Loading ROQ basis from " + roq_path)
+            roq_cls = roq.ROQBasis.load(roq_path)
+        else:
+            print("Building ROQ basis...")
+            if reduced:
+                roq_func = compute_design_matrix
+            else:
+                roq_func = compute_signal
+            roq_cls = roq.ROQBasis.build(
+                roq_func, freq_d[inds], lower_bounds, upper_bounds,
+                n_train=config['Model'].getint('roqTrainingSize',
+                                               fallback=1000),
+                reduced=reduced, kwargs=signal_kwargs)
+            roq_cls.save(roq_path)
+        ll_cls.set_roq(roq_cls, par_aux=par_aux0)
+
     fftwisdom.save_wisdom()
     
     # =======================================================================
@@ -545,6 +585,16 @@ if __name__ == '__main__':
 
     if (not psd_estimation) & (not imputation):
 
+        # Evaluate the whole ensemble of walkers in one call
+        vectorize = config["Sampler"].getboolean("vectorize", fallback=False)
+        if vectorize:
+            if reduced:
+                log_likelihood = ll_cls.log_likelihood_reduced_batch
+            else:
+                log_likelihood = ll_cls.log_likelihood_batch
+            # Precompute the weights, so that copies sent to workers have them
+            ll_cls.update_batch_weights(par_aux0)
+
         sampler = samplers.ExtendedPTMCMC(nwalkers, 
                                             len(names),
                                             log_likelihood,
@@ -554,7 +604,8 @@ if __name__ == '__main__':
                                             pool=pool,
                                             loglargs=[par_aux0],
                                             logpargs=(lower_bounds,
-                                                    upper_bounds))
+                                                    upper_bounds),
+                                            vectorize=vectorize)
         t1 = time.time()
         result = sampler.run(int(config["Sampler"]["MaximumIterationNumber"]),
                                 config['Sampler'].getint('SavingNumber'),
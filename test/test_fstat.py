@@ -0,0 +1,58 @@
+import unittest
+import numpy as np
+
+from bayesdawn.waveforms import lisaresp
+from bayesdawn.algebra import matrixalgebra
+
+
+class TestFstatDesignMatrix(unittest.TestCase):
+
+    def setUp(self):
+
+        rng = np.random.RandomState(9)
+        nf = 500
+        self.freq = np.linspace(1e-4, 1e-2, nf)
+        # Synthetic responses R_0 and R_{pi/4} for two channels
+        self.responses = [[rng.normal(size=nf) + 1j * rng.normal(size=nf)
+                           for i in range(2)] for j in range(2)]
+        self.sn = [1 + self.freq / 1e-2, 2 + (self.freq / 1e-2) ** 2]
+        self.data = [rng.normal(size=nf) + 1j * rng.normal(size=nf)
+                     for i in range(2)]
+
+    def test_angles(self):
+
+        kwargs = {'t_offset': 52.657, 'scale': 0.5}
+        mat_list = lisaresp.fstat_design_matrix(self.responses, self.freq,
+                                                **kwargs)
+        mat_list_4 = lisaresp.fstat_design_matrix(
+            self.responses, self.freq, angles=lisaresp.fstat_angles, **kwargs)
+        for i in range(2):
+            self.assertEqual(mat_list[i].shape, (self.freq.shape[0], 2))
+            self.assertEqual(mat_list_4[i].shape, (self.freq.shape[0], 4))
+            # Both layouts span the same space
+            self.assertEqual(np.linalg.matrix_rank(
+                np.hstack((mat_list[i], mat_list_4[i]))), 2)
+            _, signal, fstat = matrixalgebra.gls_batch(
+                self.data[i], mat_list[i], self.sn[i], return_signal=True,
+                return_fstat=True)
+            _, signal_4, fstat_4 = matrixalgebra.gls_batch(
+                self.data[i], mat_list_4[i], self.sn[i], return_signal=True,
+                return_fstat=True)
+            np.testing.assert_allclose(signal_4, signal, rtol=1e-9,
+                                       atol=1e-12)
+            np.testing.assert_allclose(fstat_4, fstat, rtol=1e-9)
+
+    def test_polarisation(self):
+
+        # The columns for angles (0, psi) are cos(2 psi) R_0 + sin(2 psi) R_1
+        psi = 0.3
+        mat = lisaresp.fstat_design_matrix(self.responses, self.freq,
+                                           angles=[(0, psi)])[0][:, 0]
+        np.testing.assert_allclose(
+            mat, np.conj(np.cos(2 * psi) * self.responses[0][0]
+                         + np.sin(2 * psi) * self.responses[1][0]))
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+import numpy as np
+from scipy import signal, linalg
+
+from bayesdawn import datamodel, psdmodel
+
+
+def coloured_noise(n_data, rng, cutoff=0.1):
+
+    noise = rng.normal(size=n_data)
+    b, a = signal.butter(3, cutoff, btype="low", analog=False)
+
+    return signal.lfilter(b, a, noise) + 0.1 * noise
+
+
+class TestImputation(unittest.TestCase):
+
+    def setUp(self):
+
+        self.n_data = 2 ** 13
+        self.fs = 1.0
+        rng = np.random.RandomState(3)
+        self.y = coloured_noise(self.n_data, rng)
+        self.mask = np.ones(self.n_data)
+        # Gaps of two different lengths, so that several gap geometries occur
+        starts = np.sort(rng.choice(np.arange(100, self.n_data - 100), 30,
+                                    replace=False))
+        for i, start in enumerate(starts):
+            self.mask[start:start + 10 + 5 * (i % 2)] = 0
+        self.psd_cls = self.estimate_psd(self.y)
+
+    def estimate_psd(self, y):
+
+        psd_cls = psdmodel.PSDSpline(self.n_data, self.fs, n_knots=10, d=2,
+                                     fmin=self.fs / self.n_data,
+                                     fmax=self.fs / 2)
+        psd_cls.estimate(y)
+
+        return psd_cls
+
+    def model(self, **kwargs):
+
+        return datamodel.GaussianStationaryProcess(
+            np.zeros(self.n_data), self.mask, self.psd_cls, method='nearest',
+            na=50, nb=50, **kwargs)
+
+    def dense_conditional_mean(self, imp, y):
+
+        # Uncached baseline: solve each segment system with a dense matrix
+        cond_means = []
+        for indj in imp.indices:
+            maskj = self.mask[indj]
+            obs, mis = np.where(maskj == 1)[0], np.where(maskj == 0)[0]
+            c = linalg.toeplitz(imp.autocorr[:indj.shape[0]])
+            cond_means.append(c[np.ix_(mis, obs)].dot(
+                np.linalg.solve(c[np.ix_(obs, obs)], y[indj][obs])))
+
+        return np.concatenate(cond_means)
+
+    def test_conditional_mean(self):
+
+        imp = self.model()
+        imp.compute_offline()
+        y_masked = self.y * self.mask
+        y_rec = imp.impute(y_masked, draw=False)
+        # Segments sharing the same geometry share cached factors
+        self.assertLess(len(imp.factors), len(imp.indices))
+        np.testing.assert_allclose(y_rec[imp.ind_mis],
+                                   self.dense_conditional_mean(imp, y_masked),
+                                   rtol=0, atol=1e-10)
+        np.testing.assert_array_equal(y_rec[imp.ind_obs],
+                                      y_masked[imp.ind_obs])
+
+    def test_workers(self):
+
+        y_masked = self.y * self.mask
+        outputs = []
+        for n_workers in [1, 4]:
+            imp = self.model(n_workers=n_workers, seed=42)
+            imp.compute_offline()
+            outputs.append([imp.impute(y_masked, draw=False),
+                            imp.impute(y_masked, draw=True)])
+        for i in range(2):
+            np.testing.assert_allclose(outputs[1][i], outputs[0][i],
+                                       rtol=0, atol=1e-12)
+
+    def test_cache_invalidation(self):
+
+        imp = self.model()
+        imp.compute_offline()
+        y_masked = self.y * self.mask
+        imp.impute(y_masked, draw=False)
+        version = imp.psd_version
+        # Update the PSD with a process of different spectral shape
+        self.psd_cls = self.estimate_psd(
+            coloured_noise(self.n_data, np.random.RandomState(4), cutoff=0.3))
+        imp.update_psd(self.psd_cls)
+        imp.compute_offline()
+        self.assertGreater(imp.psd_version, version)
+        self.assertEqual(len(imp.factors), 0)
+        y_rec = imp.impute(y_masked, draw=False)
+        self.assertTrue(all(key[1] == imp.psd_version for key in imp.factors))
+        np.testing.assert_allclose(y_rec[imp.ind_mis],
+                                   self.dense_conditional_mean(imp, y_masked),
+                                   rtol=0, atol=1e-10)
+
+
+if __name__ == '__main__':
+
+    unittest.main()
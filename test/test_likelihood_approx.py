@@ -0,0 +1,211 @@
+import unittest
+import os
+import tempfile
+import configparser
+import numpy as np
+
+from bayesdawn import likelihoodmodel, samplers, posteriormodel
+from bayesdawn.algebra import matrixalgebra
+from bayesdawn.waveforms import roq
+
+
+# Synthetic chirping waveform model, which does not require lisabeta
+def signal_func(par, freq):
+
+    mc, tc = par[0], par[1]
+    phase = 2 * np.pi * freq * tc + 3e-4 * mc * (freq / 1e-3) ** (-5 / 3)
+    amp = 3e1 * (freq / 1e-3) ** (-7 / 6)
+
+    return [amp * np.exp(-1j * phase), 0.7 * amp * np.exp(-1j * (phase + 0.3))]
+
+
+def design_func(par, freq):
+
+    h = signal_func(par, freq)
+
+    return [np.array([h[0], 0.3 * h[0] * (freq / 1e-2)]).T,
+            np.array([h[1], 1j * h[1] * (freq / 1e-2) ** 0.5]).T]
+
+
+def signal_reduced_func(par, freq, data_dft, sn):
+
+    mat_list = design_func(par, freq)
+
+    return [mat_list[i].dot(likelihoodmodel.gls(mat_list[i], sn[i],
+                                                data_dft[i]))
+            for i in range(len(mat_list))]
+
+
+class TestLikelihoodApproximations(unittest.TestCase):
+
+    def setUp(self):
+
+        n_data = 2 ** 15
+        del_t = 5.0
+        rng = np.random.RandomState(2)
+        self.freq = np.fft.fftfreq(n_data) / del_t
+        self.inds = np.where((self.freq > 1e-4) & (self.freq < 2e-2))[0]
+        nf = self.inds.shape[0]
+        sn = [np.ones(nf), 2 * np.ones(nf)]
+        self.ll_cls = likelihoodmodel.LogLike(
+            [np.zeros(n_data)] * 2, sn, self.inds, n_data * del_t, del_t,
+            signal_func, signal_reduced_func, design_func=design_func)
+        # Injection + white noise
+        self.par0 = np.array([1.0, 4e5])
+        self.lower_bounds = np.array([0.98, 4e5 - 200])
+        self.upper_bounds = np.array([1.02, 4e5 + 200])
+        h = signal_func(self.par0, self.freq[self.inds])
+        noise = [np.sqrt(s / (4 * self.ll_cls.df))
+                 * (rng.normal(size=nf) + 1j * rng.normal(size=nf))
+                 / np.sqrt(2) for s in sn]
+        self.ll_cls.data_dft = [h[i] + noise[i] for i in range(2)]
+        self.par_aux = np.concatenate(self.ll_cls.data_dft + sn)
+        # Parameters close to the injection
+        self.pars = self.par0 + np.array([[0, 0], [2e-3, 0], [0, 20],
+                                          [-2e-3, -20]])
+
+    def exact(self, reduced):
+
+        if reduced:
+            return np.array([self.ll_cls.log_likelihood_reduced(
+                par, self.par_aux) for par in self.pars])
+        return np.array([self.ll_cls.log_likelihood(par, self.par_aux)
+                         for par in self.pars])
+
+    def test_relative_binning(self):
+
+        for reduced in [False, True]:
+            ll_exact = self.exact(reduced)
+            self.ll_cls.set_relative_binning(self.par0, n_bins=200,
+                                             reduced=reduced,
+                                             par_aux=self.par_aux)
+            ll_rb = self.exact(reduced)
+            self.ll_cls.rb_summary = None
+            np.testing.assert_allclose(ll_rb, ll_exact, rtol=0, atol=5e-3)
+
+    def test_auxiliary_params_update(self):
+
+        par_aux = np.copy(self.par_aux)
+        # Change a single PSD value, in place
+        par_aux[2 * self.inds.shape[0] + 1] *= 4
+        self.ll_cls.set_relative_binning(self.par0, n_bins=200,
+                                         par_aux=self.par_aux)
+        self.ll_cls.update_batch_weights(self.par_aux)
+        ll_rb = self.ll_cls.log_likelihood(self.pars[1], par_aux)
+        ll_batch = self.ll_cls.log_likelihood_batch(self.pars, par_aux)
+        # Caches built directly from the modified parameters
+        self.ll_cls.set_relative_binning(self.par0, n_bins=200,
+                                         par_aux=par_aux)
+        self.ll_cls.update_batch_weights(par_aux)
+        self.assertEqual(ll_rb,
+                         self.ll_cls.log_likelihood(self.pars[1], par_aux))
+        np.testing.assert_array_equal(
+            ll_batch, self.ll_cls.log_likelihood_batch(self.pars, par_aux))
+
+    def test_roq(self):
+
+        for reduced in [False, True]:
+            ll_exact = self.exact(reduced)
+            func = design_func if reduced else signal_func
+            roq_cls = roq.ROQBasis.build(func, self.freq[self.inds],
+                                         self.lower_bounds, self.upper_bounds,
+                                         n_train=200, tol=1e-10,
+                                         reduced=reduced, seed=1,
+                                         verbose=False, chunk_size=64)
+            # Check the persistence of the basis
+            with tempfile.TemporaryDirectory() as dir_path:
+                file_path = os.path.join(dir_path, 'roq.h5')
+                roq_cls.save(file_path)
+                roq_cls = roq.ROQBasis.load(file_path)
+            self.ll_cls.set_roq(roq_cls, par_aux=self.par_aux)
+            ll_roq = self.exact(reduced)
+            self.ll_cls.roq = None
+            self.assertLess(roq_cls.nodes.shape[0], self.inds.shape[0] // 10)
+            np.testing.assert_allclose(ll_roq, ll_exact, rtol=0, atol=1e-3)
+
+    def test_batch(self):
+
+        pars = np.random.RandomState(3).uniform(self.lower_bounds,
+                                                self.upper_bounds,
+                                                size=(16, 2))
+        pars = np.vstack((self.pars, pars))
+        ll_exact = np.array([self.ll_cls.log_likelihood(par, self.par_aux)
+                             for par in pars])
+        ll_batch = self.ll_cls.log_likelihood_batch(pars, self.par_aux)
+        np.testing.assert_allclose(ll_batch, ll_exact, rtol=1e-10)
+        ll_exact = np.array([self.ll_cls.log_likelihood_reduced(
+            par, self.par_aux) for par in pars])
+        ll_batch = self.ll_cls.log_likelihood_reduced_batch(pars,
+                                                            self.par_aux)
+        np.testing.assert_allclose(ll_batch, ll_exact, rtol=1e-10)
+
+    def test_vectorized_sampler(self):
+
+        ntemps, nwalkers = 2, 8
+        pos = np.random.RandomState(4).uniform(self.lower_bounds,
+                                               self.upper_bounds,
+                                               size=(ntemps, nwalkers, 2))
+        # One walker outside the prior box
+        pos[0, 0, 0] = 2.0
+        outputs = []
+        for vectorize in [False, True]:
+            if vectorize:
+                log_likelihood = self.ll_cls.log_likelihood_batch
+            else:
+                log_likelihood = self.ll_cls.log_likelihood
+            sampler = samplers.ExtendedPTMCMC(
+                nwalkers, 2, log_likelihood, posteriormodel.logp,
+                ntemps=ntemps, loglargs=[self.par_aux],
+                logpargs=(self.lower_bounds, self.upper_bounds),
+                vectorize=vectorize)
+            outputs.append(sampler._evaluate(pos))
+        for i in range(2):
+            np.testing.assert_allclose(outputs[1][i], outputs[0][i],
+                                       rtol=1e-10)
+
+    def test_solve_normal_batch(self):
+
+        rng = np.random.RandomState(5)
+        a_mat = rng.normal(size=(50, 3, 6)) + 1j * rng.normal(size=(50, 3, 6))
+        normal = np.matmul(a_mat, np.conj(np.swapaxes(a_mat, 1, 2)))
+        # Singular systems
+        normal[::5, :, 2] = normal[::5, :, 0]
+        normal[::5, 2, :] = normal[::5, 0, :]
+        b_vect = rng.normal(size=(50, 3)) + 1j * rng.normal(size=(50, 3))
+        amps = matrixalgebra.solve_normal_batch(normal, b_vect)
+        amps_ref = np.array([np.linalg.pinv(normal[i], hermitian=True).dot(
+            b_vect[i]) for i in range(normal.shape[0])])
+        np.testing.assert_allclose(amps, amps_ref, rtol=1e-8, atol=1e-12)
+
+
+class TestROQUtilities(unittest.TestCase):
+
+    def test_empirical_interpolation(self):
+
+        rng = np.random.RandomState(6)
+        nf = 200
+        basis = np.linalg.qr(rng.normal(size=(nf, 4))
+                             + 1j * rng.normal(size=(nf, 4)))[0].T
+        # The last element is numerically in the span of the others
+        basis = np.vstack((basis, (basis[0] + basis[2]) / np.sqrt(2)))
+        nodes, interp = roq.empirical_interpolation(basis)
+        self.assertEqual(nodes.shape[0], 4)
+        self.assertEqual(np.unique(nodes).shape[0], 4)
+        h = rng.normal(size=5).dot(basis)
+        np.testing.assert_allclose(interp.dot(h[nodes]), h, atol=1e-10)
+
+    def test_bounds_from_config(self):
+
+        config = configparser.ConfigParser()
+        config.read_dict({'ParametersLowerBounds': {'Mc': '1e5', 'q': '1'},
+                          'ParametersUpperBounds': {'Mc': '2e5', 'q': '10'}})
+        lower_bounds, upper_bounds = roq.bounds_from_config(config)
+        np.testing.assert_array_equal(lower_bounds, [1e5, 1])
+        np.testing.assert_array_equal(upper_bounds, [2e5, 10])
+        lower_bounds, upper_bounds = roq.bounds_from_config(config, ['q'])
+        np.testing.assert_array_equal(upper_bounds, [10])
+
+
+if __name__ == '__main__':
+
+    unittest.main()
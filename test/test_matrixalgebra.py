@@ -0,0 +1,130 @@
+import unittest
+import io
+import contextlib
+from multiprocessing.pool import ThreadPool
+import numpy as np
+from scipy import linalg
+
+from bayesdawn.algebra import matrixalgebra
+
+
+class TestPreconditionedSolvers(unittest.TestCase):
+
+    def setUp(self):
+
+        n_data = 2000
+        rng = np.random.RandomState(1)
+        # Exponential autocovariance plus white noise
+        self.autocorr = np.exp(- np.arange(n_data) / 10.0)
+        self.autocorr[0] += 0.1
+        self.mask = np.ones(n_data)
+        for start in rng.choice(np.arange(50, n_data - 50), 15, replace=False):
+            self.mask[start:start + rng.randint(1, 20)] = 0
+        self.ind_obs = np.where(self.mask == 1)[0]
+        self.c_oo = linalg.toeplitz(self.autocorr)[np.ix_(self.ind_obs,
+                                                          self.ind_obs)]
+        self.coo_op = matrixalgebra.MaskedToeplitzOperator(self.autocorr,
+                                                           self.ind_obs)
+        self.b = rng.normal(size=(self.ind_obs.shape[0], 4))
+        self.p = 30
+
+    def test_operator(self):
+
+        np.testing.assert_allclose(self.coo_op.dot(self.b[:, 0]),
+                                   self.c_oo.dot(self.b[:, 0]), atol=1e-12)
+        # Concurrent products
+        with ThreadPool(4) as pool:
+            results = pool.map(self.coo_op.matmat,
+                               [self.b * k for k in range(8)])
+        for k in range(8):
+            np.testing.assert_allclose(results[k], self.c_oo.dot(self.b * k),
+                                       atol=1e-11)
+
+    def test_banded_preconditioner(self):
+
+        solve_lu = matrixalgebra.compute_precond(self.autocorr, self.mask,
+                                                 p=self.p, ptype='sparse')
+        solve_band = matrixalgebra.compute_precond(self.autocorr, self.mask,
+                                                   p=self.p, ptype='banded')
+        np.testing.assert_allclose(solve_band(self.b), solve_lu(self.b),
+                                   rtol=1e-10, atol=1e-12)
+        np.testing.assert_allclose(solve_band(self.b[:, 0]),
+                                   solve_lu(self.b[:, 0]),
+                                   rtol=1e-10, atol=1e-12)
+
+    def test_pattern_reuse(self):
+
+        precond = matrixalgebra.BandedCholeskyPreconditioner(
+            self.autocorr, self.mask, p=self.p)
+        autocorr = 1.5 * np.exp(- np.arange(self.autocorr.shape[0]) / 12.0)
+        autocorr[0] += 0.2
+        precond_ref = matrixalgebra.BandedCholeskyPreconditioner(
+            autocorr, self.mask, p=self.p)
+        # New preconditioner sharing the band pattern
+        precond_new = matrixalgebra.BandedCholeskyPreconditioner(
+            autocorr, self.mask, p=self.p, pattern=precond.pattern)
+        np.testing.assert_allclose(precond_new(self.b), precond_ref(self.b),
+                                   rtol=1e-12)
+        # Numerical update of the factorization
+        self.assertTrue(precond.matches(self.mask, self.p, 'Wendland2'))
+        self.assertFalse(precond.update(self.autocorr * (1 + 1e-6), tol=1e-3))
+        self.assertTrue(precond.update(autocorr))
+        np.testing.assert_allclose(precond(self.b), precond_ref(self.b),
+                                   rtol=1e-12)
+
+    def test_precond_cg(self):
+
+        x_ref = np.linalg.solve(self.c_oo, self.b)
+        for ptype in ['sparse', 'banded']:
+            solve = matrixalgebra.compute_precond(self.autocorr, self.mask,
+                                                  p=self.p, ptype=ptype)
+            # Single right-hand side
+            x, sr, info = matrixalgebra.precond_cg(
+                np.zeros(self.b.shape[0]), self.b[:, 0], self.coo_op.matmat,
+                100, 1e-10, solve, verbose=False)
+            self.assertEqual(info, 0)
+            np.testing.assert_allclose(x, x_ref[:, 0], rtol=1e-7, atol=1e-8)
+            # Block conjugate gradient
+            x, sr, info = matrixalgebra.precond_cg(
+                np.zeros(self.b.shape), self.b, self.coo_op.matmat, 100,
+                1e-10, solve, verbose=False)
+            self.assertEqual(info, 0)
+            np.testing.assert_allclose(x, x_ref, rtol=1e-7, atol=1e-8)
+
+    def test_pcg_solve(self):
+
+        solve = matrixalgebra.compute_precond(self.autocorr, self.mask,
+                                              p=self.p, ptype='banded')
+        x_ref = np.linalg.solve(self.c_oo, self.b)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            x, info = matrixalgebra.pcg_solve(
+                self.ind_obs, self.mask, None, self.b, np.zeros(self.b.shape),
+                1e-10, 100, solve, 'cg', coo_op=self.coo_op)
+        self.assertEqual(output.getvalue(), '')
+        self.assertEqual(info, 0)
+        np.testing.assert_allclose(x, x_ref, rtol=1e-7, atol=1e-8)
+
+    def test_solution_recycler(self):
+
+        solve = matrixalgebra.compute_precond(self.autocorr, self.mask,
+                                              p=self.p, ptype='banded')
+        recycler = matrixalgebra.SolutionRecycler(n_recycle=2)
+        # Solve stopped before convergence
+        x, sr, info = matrixalgebra.precond_cg(
+            np.zeros(self.b.shape[0]), self.b[:, 0], self.coo_op.matmat, 1,
+            1e-10, solve, verbose=False)
+        self.assertEqual(info, 1)
+        recycler.update(x, self.coo_op.matmat, key=0)
+        np.testing.assert_allclose(recycler.au, self.c_oo.dot(recycler.u),
+                                   atol=1e-12)
+        # The initial guess is the Galerkin projection on the stored space
+        x0 = recycler.initial_guess(self.b[:, 0], self.coo_op.matmat, key=0)
+        u = recycler.u[:, 0]
+        np.testing.assert_allclose(
+            x0, u * u.dot(self.b[:, 0]) / u.dot(self.c_oo.dot(u)), atol=1e-12)
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import numpy as np
+from scipy import signal, interpolate
+
+from bayesdawn import psdmodel
+
+
+def coloured_noise(n_data, rng, cutoff=0.1):
+
+    noise = rng.normal(size=n_data)
+    b, a = signal.butter(3, cutoff, btype="low", analog=False)
+
+    return signal.lfilter(b, a, noise) + 0.1 * noise
+
+
+class TestPSDSpline(unittest.TestCase):
+
+    def setUp(self):
+
+        self.n_data = 2 ** 12
+        self.fs = 0.5
+        rng = np.random.RandomState(7)
+        self.y = [coloured_noise(self.n_data, rng),
+                  coloured_noise(self.n_data, rng, cutoff=0.3)]
+
+    def psd_model(self, **kwargs):
+
+        return psdmodel.PSDSpline(self.n_data, self.fs, n_knots=15, d=3,
+                                  fmin=self.fs / self.n_data,
+                                  fmax=self.fs / 2, **kwargs)
+
+    def test_cache_invalidation(self):
+
+        psd_cls = self.psd_model()
+        psd_cls.estimate(self.y[0])
+        freq = np.linspace(1e-3, 0.2, 50)
+        spectra = [psd_cls.calculate(self.n_data), psd_cls.calculate(freq)]
+        # Cached arrays are returned and protected from modification
+        self.assertIs(psd_cls.calculate(self.n_data), spectra[0])
+        self.assertFalse(spectra[0].flags.writeable)
+        version = psd_cls.version
+        psd_cls.estimate(self.y[1])
+        self.assertGreater(psd_cls.version, version)
+        for arg, spectrum in zip([self.n_data, freq], spectra):
+            spectrum_new = psd_cls.calculate(arg)
+            self.assertFalse(np.allclose(spectrum_new, spectrum))
+            np.testing.assert_array_equal(spectrum_new,
+                                          psd_cls.compute_spectrum(arg))
+
+    def test_autocorr(self):
+
+        psd_cls = self.psd_model()
+        psd_cls.estimate(self.y[0])
+        for n in [self.n_data, self.n_data + 1, 1000]:
+            # Two-sided inverse FFT of the full spectrum
+            autocorr_ref = np.real(np.fft.ifft(psd_cls.calculate(2 * n)))[
+                0:n] * self.fs / 2
+            np.testing.assert_allclose(psd_cls.calculate_autocorr(n),
+                                       autocorr_ref, rtol=0,
+                                       atol=1e-12 * autocorr_ref[0])
+            spectrum = psd_cls.calculate(2 * n)
+            np.testing.assert_array_equal(psd_cls.calculate_onesided(2 * n),
+                                          spectrum[0:n + 1])
+
+    def test_spline_lsqr(self):
+
+        psd_cls = self.psd_model()
+        per = psd_cls.periodogram(np.fft.fft(self.y[0]))
+        spl = psd_cls.spline_lsqr(per)
+        # Reference least-squares spline on the same frequencies
+        logf = np.log(psd_cls.f[1:psd_cls.n + 1])
+        spl_ref = interpolate.LSQUnivariateSpline(
+            logf, np.log(per[1:psd_cls.n + 1]) - psd_cls.C0,
+            psd_cls.logf_knots, k=psd_cls.D)
+        np.testing.assert_allclose(spl(logf), spl_ref(logf), rtol=1e-9,
+                                   atol=1e-9)
+
+    def test_binned_fit(self):
+
+        n_data = 2 ** 16
+        y = coloured_noise(n_data, np.random.RandomState(8))
+        psd_ref = psdmodel.PSDSpline(n_data, self.fs)
+        psd_ref.estimate(y)
+        for n_bins in [100, 300, 1000]:
+            for kwargs in [{}, {'n_knots': 10, 'fmin': self.fs / n_data,
+                                'fmax': self.fs / 2}]:
+                psd_cls = psdmodel.PSDSpline(n_data, self.fs, n_bins=n_bins,
+                                             **kwargs)
+                psd_cls.estimate(y)
+                self.assertTrue(np.all(np.isfinite(psd_cls.logs)))
+                # The binned fit is close to the unbinned one
+                self.assertLess(np.median(np.abs(psd_cls.logs
+                                                 - psd_ref.logs)), 0.2)
+
+
+if __name__ == '__main__':
+
+    unittest.main()
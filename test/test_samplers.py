@@ -0,0 +1,120 @@
+import unittest
+import numpy as np
+from scipy import signal
+
+from bayesdawn import samplers, psdsampler, psdmodel
+
+
+class TestGaussianTarget(unittest.TestCase):
+
+    def setUp(self):
+
+        np.random.seed(11)
+        a_mat = np.random.normal(size=(3, 3))
+        self.cov = a_mat.dot(a_mat.T) + np.eye(3)
+        self.cov_inv = np.linalg.inv(self.cov)
+        self.mu = np.array([1.0, -2.0, 0.5])
+
+    def log_prob(self, x):
+
+        r = x - self.mu
+        return - 0.5 * np.sum(r.dot(self.cov_inv) * r, axis=-1)
+
+    def grad_log_prob(self, x):
+
+        return - (x - self.mu).dot(self.cov_inv)
+
+    def check_moments(self, sampler, n_steps=4000, n_burn=500):
+
+        chains, logp = sampler.run(n_steps, x0=np.zeros(3))
+        self.assertEqual(chains.shape, (n_steps, sampler.n_chains, 3))
+        np.testing.assert_allclose(logp[-1], self.log_prob(chains[-1]))
+        x = chains[n_burn:].reshape((-1, 3))
+        scale = np.sqrt(np.diag(self.cov))
+        np.testing.assert_allclose(np.mean(x, axis=0), self.mu, rtol=0,
+                                   atol=0.1 * np.max(scale))
+        np.testing.assert_allclose(np.cov(x.T), self.cov, rtol=0,
+                                   atol=0.1 * np.max(self.cov))
+
+    def test_mala(self):
+
+        sampler = samplers.PreconditionedMALA(3, self.log_prob,
+                                              self.grad_log_prob, self.cov,
+                                              n_chains=16)
+        self.check_moments(sampler)
+
+    def test_independence_metropolis(self):
+
+        # Proposal slightly offset and wider than the target
+        sampler = samplers.IndependenceMetropolis(
+            3, self.log_prob, self.mu + 0.3, 1.5 * self.cov, n_chains=16)
+        self.check_moments(sampler)
+        self.assertGreater(sampler.accepted / sampler.n_proposed, 0.3)
+
+    def test_damped_newton_raphson(self):
+
+        # Concave function whose undamped Newton iterations overshoot
+        a = np.array([1e3, 2.0, 0.1])
+        with np.errstate(over='ignore'):
+            x_max = psdmodel.newton_raphson(
+                np.ones(3), lambda x: a - np.exp(x),
+                lambda x: - np.diag(np.exp(x)), maxiter=200, tol=1e-12,
+                func=lambda x: np.sum(a * x - np.exp(x)), verbose=False)
+        np.testing.assert_allclose(x_max, np.log(a), rtol=1e-8)
+
+
+class TestPSDSampler(unittest.TestCase):
+
+    def setUp(self):
+
+        n_data = 2 ** 14
+        rng = np.random.RandomState(0)
+        noise = rng.normal(size=n_data)
+        b, a = signal.butter(3, 0.1)
+        y = signal.lfilter(b, a, noise) + 0.1 * noise
+        self.samplers = []
+        for n_bins in [None, 300]:
+            psd_cls = psdsampler.PSDSampler(n_data, 1.0, n_knots=15, d=3,
+                                            n_bins=n_bins)
+            psd_cls.estimate(y)
+            psd_cls.set_periodogram(np.fft.fft(y))
+            self.samplers.append(psd_cls)
+        # Several periodograms
+        psd_cls = psdsampler.PSDSampler(n_data // 2, 1.0, n_knots=15, d=3)
+        psd_cls.estimate(y[0:n_data // 2])
+        psd_cls.set_periodogram([np.fft.fft(y[0:n_data // 2]),
+                                 np.fft.fft(y[n_data // 2:])])
+        self.samplers.append(psd_cls)
+        self.rng = rng
+
+    def test_posterior_gradient(self):
+
+        eps = 1e-5
+        for psd_cls in self.samplers:
+            x = psd_cls.logsc + 0.1 * self.rng.normal(size=psd_cls.logsc.shape)
+            eye = np.eye(x.shape[0])
+            grad_ref = np.array([(psd_cls.psd_posterior(x + eps * eye[i])
+                                  - psd_cls.psd_posterior(x - eps * eye[i]))
+                                 / (2 * eps) for i in range(x.shape[0])])
+            grad = psd_cls.psd_posterior_grad(x)
+            np.testing.assert_allclose(grad, grad_ref, rtol=0,
+                                       atol=1e-6 * np.max(np.abs(grad_ref)))
+            # Gradients of several parameter vectors at once
+            grads = psd_cls.psd_posterior_grad(np.array([x, x]))
+            np.testing.assert_allclose(grads, [grad, grad], rtol=1e-12)
+
+    def test_psd_map(self):
+
+        for psd_cls in self.samplers:
+            x0 = psd_cls.logsc + 0.5
+            x_map, fisher = psd_cls.psd_map(x0=x0)
+            self.assertGreater(psd_cls.psd_posterior(x_map),
+                               psd_cls.psd_posterior(x0))
+            grad = psd_cls.psd_posterior_grad(x_map)
+            # Newton decrement at the maximum
+            self.assertLess(grad.dot(np.linalg.solve(fisher, grad)), 1e-6)
+
+
+if __name__ == '__main__':
+
+    unittest.main()